@@ -1,213 +1,328 @@
 import streamlit as st
 import mysql.connector
-from PIL import Image, ImageDraw, ImageFont
-from io import BytesIO
-import tempfile
+from PIL import Image
+from io import BytesIO, TextIOWrapper
 from datetime import datetime
 import time
-import os
-import random
 import base64
-import textwrap
-import barcode
-from barcode.writer import ImageWriter
-from barcode.codex import Code128
-
-# Database configuration
-DB_CONFIG = {
-    'host': 'localhost',
-    'user': 'root',
-    'password': '',
-    'database': 'digital_health_db'
-}
+import re
+import uuid
+from contextlib import contextmanager
+from avatars import AvatarDraft, fetch_avatar, fetch_thumbnail
+from batch_labels import fetch_label_rows, iter_label_pages, write_html, write_pdf
+from db_pool import ConnectionPool, PoolTimeout
+from drafts import DraftStore, encode_patient_data
+from duplicates import find_duplicate_candidates
+from label_media import media_url, print_controls_html
+from label_templates import TEMPLATES
+from labels import (
+    LABEL_DPI, BarcodeError, barcode_cache, encode_png, generate_barcode, get_label_png, label_png_cache,
+    label_timestamp_top
+)
+from metrics import count, register_gauges, span, start_metrics_server
+from migrations import LATEST_VERSION, connect_server, get_schema_version, migrate
+from patient_cache import get_patient_cache
+from patients import age_from_birthday, missing_required_fields, normalize_patient
+from phn import PHNAllocator, reserve_phn_block
+from printers import get_print_queue, print_label_direct
+from save_queue import SaveQueue
+from services import PatientService, ServiceError
+from settings import (
+    DB_AUTO_MIGRATE, DB_CONFIG, DB_POOL_SIZE, DB_POOL_TIMEOUT, LABEL_TIMESTAMP, METRICS_PORT, PRINTER_HOST,
+    SAVE_JOURNAL_DIR
+)
+
+# Form option lists (tuples, built once per server process rather than on every rerun)
+TITLE_OPTIONS = ("Mr.", "Mrs.", "Miss", "Master", "Baby", "Ven.", "Dr.", "Other")
+GENDER_OPTIONS = ("Male", "Female", "Prefer not to say")
+DISTRICT_OPTIONS = (
+    "Kegalle", "Gampaha", "Kalutara", "Kandy", "Matale", "Nuwara Eliya",
+    "Galle", "Matara", "Hambantota", "Jaffna", "Kilinochchi", "Mannar",
+    "Vavuniya", "Mullaitivu", "Batticaloa", "Ampara", "Trincomalee",
+    "Kurunegala", "Puttalam", "Anuradhapura", "Polonnaruwa", "Badulla",
+    "Monaragala", "Ratnapura", "Colombo",
+)
+PROVINCE_OPTIONS = (
+    "Sabaragamuwa", "Central", "Southern", "Northern", "Eastern",
+    "North Western", "North Central", "Uva", "Western",
+)
+BLOOD_TYPE_OPTIONS = ("Unknown", "A+", "A-", "B+", "B-", "AB+", "AB-", "O+", "O-")
+PHYSICIAN_OPTIONS = ("", "Dr. S. Perera", "Dr. R. Fernando", "Dr. M. Silva", "Dr. J. Rajapaksa", "Dr. L. Dias")
+SEARCH_BY_OPTIONS = ("PHN", "NIC", "Name", "Contact")
+
+AVATAR_PREVIEW_SIDE = 800  # pixels; previews are sent to the browser at most this size
+DRAFT_ID_PATTERN = re.compile(r'[0-9a-f]{32}')
+
+
+@contextmanager
+def timed_section(name):
+    """Record how long a section of the page took to render in this session (and as a ui.<name> span)"""
+    started = time.perf_counter()
+    try:
+        with span(f"ui.{name}"):
+            yield
+    finally:
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        timings = st.session_state.setdefault('section_timings', {})
+        entry = timings.setdefault(name, {'runs': 0, 'last_ms': 0.0, 'total_ms': 0.0, 'max_ms': 0.0})
+        entry['runs'] += 1
+        entry['last_ms'] = elapsed_ms
+        entry['total_ms'] += elapsed_ms
+        entry['max_ms'] = max(entry['max_ms'], elapsed_ms)
+
+
+@st.cache_resource
+def get_connection_pool():
+    """Create the process-wide MySQL connection pool once per server process"""
+    return ConnectionPool(
+        lambda: mysql.connector.connect(**DB_CONFIG),
+        size=DB_POOL_SIZE,
+        timeout=DB_POOL_TIMEOUT
+    )
 
 
 def create_db_connection():
+    """Check out a pooled connection; calling close() on it returns it to the pool"""
     try:
-        conn = mysql.connector.connect(**DB_CONFIG)
+        conn = get_connection_pool().get_connection()
         return conn
     except mysql.connector.Error as err:
         st.error(f"Error connecting to MySQL: {err}")
         return None
+    except PoolTimeout as err:
+        st.error(f"Database busy: {err}")
+        return None
 
 
-def initialize_database():
-    conn = create_db_connection()
-    if conn is None:
-        return False
+@st.cache_resource(show_spinner="Checking database schema...")
+def ensure_database_schema():
+    """Apply or verify schema migrations once per server process (failures are not cached)"""
+    if DB_AUTO_MIGRATE:
+        _, version = migrate()
+        return version
 
+    conn = connect_server()
     try:
         cursor = conn.cursor()
-        cursor.execute("CREATE DATABASE IF NOT EXISTS digital_health_db")
-        cursor.execute("USE digital_health_db")
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS patients (
-                id INT AUTO_INCREMENT PRIMARY KEY,
-                title VARCHAR(10),
-                full_name VARCHAR(100) NOT NULL,
-                other_names VARCHAR(100),
-                gender VARCHAR(20),
-                address_line1 VARCHAR(100),
-                address_line2 VARCHAR(100),
-                district VARCHAR(50),
-                province VARCHAR(50),
-                mh_division VARCHAR(50),
-                birthday DATE,
-                age VARCHAR(20),
-                nic VARCHAR(20) UNIQUE,
-                phn VARCHAR(50) UNIQUE,
-                marital_status VARCHAR(20),
-                guardian VARCHAR(100),
-                contact_numbers VARCHAR(100),
-                occupation VARCHAR(50),
-                blood_type VARCHAR(10),
-                known_allergies TEXT,
-                chronic_conditions TEXT,
-                primary_physician VARCHAR(100),
-                avatar BLOB,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP
-            )
-        """)
-        conn.commit()
+        version = get_schema_version(cursor)
+    finally:
+        conn.close()
+
+    if version < LATEST_VERSION:
+        raise RuntimeError(
+            f"Database schema is at version {version}, expected {LATEST_VERSION}. "
+            f"Run `python migrations.py` to upgrade."
+        )
+    return version
+
+
+def initialize_database():
+    try:
+        ensure_database_schema()
         return True
-    except mysql.connector.Error as err:
+    except (mysql.connector.Error, RuntimeError) as err:
         st.error(f"Error initializing database: {err}")
         return False
-    finally:
-        if conn:
-            conn.close()
 
 
-def generate_phn(nic=None):
-    hospital_id = "1250"
-    timestamp = datetime.now().strftime("%y%m%d%H%M")
-    nic_part = nic[-4:] if nic and len(nic) >= 4 else f"{random.randint(1000, 9999):04d}"
-    phn = f"PHN-{hospital_id}-{timestamp}-{nic_part}"
-    return phn
+@st.cache_resource
+def get_phn_allocator():
+    """Process-wide PHN allocator reserving serial blocks through the pool"""
+    def reserve(size):
+        conn = get_connection_pool().get_connection()
+        try:
+            return reserve_phn_block(conn, size)
+        finally:
+            conn.close()
+
+    return PHNAllocator(reserve)
 
-def create_fallback_barcode(text, width, height):
-    """Create a simple barcode when python-barcode is not available"""
-    img = Image.new('RGB', (width, height), (255, 255, 255))
-    draw = ImageDraw.Draw(img)
 
-    # Create binary pattern from text hash
-    text_hash = hash(text) & 0xffffffff  # Get consistent 32-bit hash
-    binary_str = bin(text_hash)[2:].zfill(32)  # Convert to 32-bit binary
+@st.cache_resource
+def get_patient_service():
+    """Process-wide PatientService, the same core operations the JSON API serves"""
+    return PatientService(
+        lambda: get_connection_pool().get_connection(), get_phn_allocator(), get_patient_cache()
+    )
 
-    # Draw barcode lines
-    bar_width = max(1, width // 32)
-    for i, bit in enumerate(binary_str):
-        x = i * bar_width
-        if bit == '1':
-            draw.rectangle([x, 0, x + bar_width, height - 20], fill="black")
 
-    # Add text below
+@st.cache_resource
+def start_metrics():
+    """Export pool and cache gauges and, with METRICS_PORT set, serve /metrics (once per server process)"""
+    register_gauges('db_pool', get_connection_pool().stats)
+    register_gauges('barcode_cache', barcode_cache.stats)
+    register_gauges('label_png_cache', label_png_cache.stats)
+    register_gauges('patient_cache', get_patient_cache().stats)
+    return start_metrics_server(METRICS_PORT) if METRICS_PORT else None
+
+
+@st.cache_resource
+def get_draft_store():
+    """Process-wide handle on the shared draft table (the same rows every replica sees)"""
+    return DraftStore(lambda: get_connection_pool().get_connection())
+
+
+def resume_draft():
+    """Bind a new browser session to the draft in the URL, restoring its form and avatar
+
+    A reconnect routed to a different replica carries the same ?draft= id, so
+    the form survives without sticky sessions.
+    """
+    draft_id = st.query_params.get('draft', '')
+    draft = None
+    if DRAFT_ID_PATTERN.fullmatch(draft_id):
+        try:
+            draft = get_draft_store().load(draft_id)
+        except (mysql.connector.Error, PoolTimeout) as err:
+            st.warning(f"Could not restore the saved draft: {err}")
+    else:
+        draft_id = uuid.uuid4().hex
+        st.query_params['draft'] = draft_id
+
+    st.session_state.draft_id = draft_id
+    st.session_state.draft_saved = None
+    if draft is not None:
+        st.session_state.patient_data = draft['patient_data']
+        st.session_state.draft_restored = True
+        if draft['avatar'] is not None:
+            avatar = AvatarDraft(draft['avatar'])
+            avatar.crop_box = draft['avatar_crop']
+            st.session_state.avatar_draft = avatar
+
+
+def persist_draft(end_of_run=False):
+    """Write the form to the shared draft store when it has changed since the last write
+
+    The avatar is only sent when the picture or its crop changed. A new form
+    is not written until the user changes it: the end of its first full run
+    (once every widget has filled in its default) records the baseline.
+    """
+    if 'draft_id' not in st.session_state:
+        return
+    encoded = encode_patient_data(st.session_state.patient_data)
+    avatar = st.session_state.get('avatar_draft')
+    current = (encoded, avatar.digest if avatar is not None else None)
+    saved = st.session_state.draft_saved
+    if saved is None:
+        if end_of_run:
+            st.session_state.draft_saved = current
+        return
+    if current == saved:
+        return
+    try:
+        get_draft_store().save(
+            st.session_state.draft_id, st.session_state.patient_data,
+            avatar=(avatar or False) if current[1] != saved[1] else None
+        )
+    except (mysql.connector.Error, PoolTimeout) as err:
+        st.warning(f"Draft not saved: {err}")
+        return
+    st.session_state.draft_saved = current
+
+
+def discard_draft():
+    """Delete this session's draft and start a fresh one (after a save or Clear Form)"""
+    if 'draft_id' in st.session_state:
+        try:
+            get_draft_store().delete(st.session_state.draft_id)
+        except (mysql.connector.Error, PoolTimeout):
+            pass  # left for the TTL purge
+    draft_id = uuid.uuid4().hex
+    st.query_params['draft'] = draft_id
+    st.session_state.draft_id = draft_id
+    st.session_state.draft_saved = None
+    st.session_state.pop('draft_restored', None)
+
+
+def option_index(options, field, default):
+    """Selectbox index: the restored draft's value, else the usual default"""
+    if st.session_state.get('draft_restored'):
+        value = st.session_state.patient_data.get(field)
+        if value in options:
+            return options.index(value)
+    return default
+
+
+@st.cache_resource
+def get_save_queue():
+    """Process-wide journaled save queue; replays unsaved registrations on startup"""
+    return SaveQueue(SAVE_JOURNAL_DIR, lambda: get_connection_pool().get_connection())
+
+
+def show_saved_label(patient_data):
+    """Barcode and print options for a registration whose save has completed"""
+    image_url = media_url('barcode', patient_data)
+    if image_url:
+        st.image(image_url, caption="Patient Barcode", width='stretch')
+        print_barcode_web(None, patient_data['phn'], image_url=image_url)
+        return
     try:
-        font = ImageFont.truetype("arial.ttf", 12)
-    except:
-        font = ImageFont.load_default()
+        barcode_img = generate_barcode(patient_data)
+    except BarcodeError as err:
+        st.error(str(err))
+        return
+    st.image(barcode_img, caption="Patient Barcode", width='stretch')
+    print_barcode_web(barcode_img, patient_data['phn'])
+
+
+@st.fragment(run_every=1.0)
+def watch_save_job(job_id):
+    """Poll a background save and rerun the page once it has finished"""
+    job = get_save_queue().status(job_id)
+    if job is None or job['status'] in ('saved', 'done', 'failed'):
+        st.rerun(scope="app")
+    if job['error']:
+        st.warning(f"Waiting for database (attempt {job['attempts']}): {job['error']}")
+    else:
+        st.info(f"Saving {job['phn']}...")
+
+
+def generate_phn():
+    """Issue a new unique PHN (with check digit), or '' if the database is unreachable"""
+    try:
+        return get_patient_service().generate_phn()
+    except (mysql.connector.Error, PoolTimeout) as err:
+        st.error(f"Error generating PHN: {err}")
+        return ''
 
-    text_width = draw.textlength(text, font=font)
-    draw.text(((width - text_width) / 2, height - 20), text, font=font, fill="black")
-    return img
 
+def print_barcode_web(barcode_img, patient_phn, patient_data=None, timestamp_top=None, image_url=None):
+    """Provide ultra high-quality output for both download and print
 
-def generate_label_image(patient_data):
-    """Generate label with ultra high DPI (600) for maximum print quality"""
-    # Dimensions for 10cm x 4.3cm at 600 DPI
-    width, height = 2362, 1016  # 10cm x 4.3cm at 600 DPI
+    barcode_img may be a PIL image or already-encoded PNG bytes. When
+    timestamp_top is given, the print time is overlaid on the printed page at
+    that fraction of the label height instead of being part of the image.
+    With image_url (a label_media URL) nothing is inlined: print and download
+    use that URL and barcode_img is not needed.
+    """
+    try:
+        timestamp_html = ""
+        if timestamp_top is not None:
+            timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+            timestamp_html = (
+                f'<div class="timestamp" style="top: {timestamp_top * 100:.2f}%;">{timestamp}</div>'
+            )
 
-    # Create blank image with white background
-    img = Image.new('RGB', (width, height), (255, 255, 255))
-    draw = ImageDraw.Draw(img)
+        if image_url:
+            html_code = print_controls_html(patient_phn, image_url, timestamp_html, download=True)
+            st.components.v1.html(html_code, height=100)
+            count('payload_bytes', 'print.html', len(html_code))
+            return
 
-    try:
-        # Load fonts with larger sizes for better readability
-        title_font = ImageFont.truetype("arialbd.ttf", 80)  # Increased for 600 DPI
-        header_font = ImageFont.truetype("arialbd.ttf", 64)  # Increased for 600 DPI
-        normal_font = ImageFont.truetype("arial.ttf", 58)  # Increased for 600 DPI
-        small_font = ImageFont.truetype("arial.ttf", 55)  # Increased for 600 DPI
-    except:
-        # Fallback to default fonts
-        title_font = ImageFont.load_default()
-        header_font = ImageFont.load_default()
-        normal_font = ImageFont.load_default()
-        small_font = ImageFont.load_default()
-
-    # Start position
-    y_position = 60
-
-    # Hospital name - Centered at top
-    hospital = "GENERAL HOSPITAL ABCDEFG"
-    bbox = draw.textbbox((0, 0), hospital, font=title_font)
-    text_width = bbox[2] - bbox[0]
-    text_x = (width - text_width) // 2
-    draw.text((text_x, y_position), hospital, font=title_font, fill=(0, 0, 0))
-    y_position += 100
-
-    # Patient name - Centered
-    name = f"{patient_data.get('title', '')} {patient_data.get('full_name', '')}"
-    bbox = draw.textbbox((0, 0), name, font=header_font)
-    text_width = bbox[2] - bbox[0]
-    text_x = (width - text_width) // 2
-    draw.text((text_x, y_position), name, font=header_font, fill=(0, 0, 0))
-    y_position += 80
-
-    # Address line (single line)
-    address_line1 = patient_data.get('address_line1', '')
-    if address_line1:
-        # Allow more characters due to larger sticker size
-        if len(address_line1) > 45:
-            address_line1 = address_line1[:42] + "..."
-
-        bbox = draw.textbbox((0, 0), address_line1, font=header_font)
-        text_width = bbox[2] - bbox[0]
-        text_x = (width - text_width) // 2
-        draw.text((text_x, y_position), address_line1, font=header_font, fill=(0, 0, 0))
-        y_position += 70
-
-    # Contact number
-    contact_text = f"Tel: {patient_data.get('contact_numbers', '')}"
-    if len(contact_text) > 35:
-        contact_text = contact_text[:32] + "..."
-
-    bbox = draw.textbbox((0, 0), contact_text, font=title_font)
-    text_width = bbox[2] - bbox[0]
-    text_x = (width - text_width) // 2
-    draw.text((text_x, y_position), contact_text, font=title_font, fill=(0, 0, 0))
-    y_position += 80
-
-    # Generate barcode with proper width for the new sticker size
-    barcode_img = generate_barcode(patient_data, target_width_cm=8.0)  # 8cm wide barcode
-
-    # Center barcode horizontally
-    barcode_x = (width - barcode_img.width) // 2
-    img.paste(barcode_img, (barcode_x, y_position))
-
-    # Add timestamp below PHN
-    timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-    bbox = draw.textbbox((0, 0), timestamp, font=header_font)
-    text_width = bbox[2] - bbox[0]
-    text_x = (width - text_width) // 2
-    draw.text((text_x, y_position + barcode_img.height - 40), timestamp, font=header_font, fill=(0, 0, 0))
-
-    return img
-
-def print_barcode_web(barcode_img, patient_phn, patient_data=None):
-    """Provide ultra high-quality output for both download and print"""
-    try:
-        # Create the highest quality image for both functions at 600 DPI
-        high_quality_buffer = BytesIO()
-        barcode_img.save(high_quality_buffer, format="PNG", dpi=(600, 600))
-        barcode_bytes = high_quality_buffer.getvalue()
+        # Create the highest quality image for both functions at the label profile DPI
+        if isinstance(barcode_img, bytes):
+            barcode_bytes = barcode_img
+        else:
+            with span("print.encode_png"):
+                barcode_bytes = encode_png(barcode_img)
 
         # Create a base64 version for the print function
-        img_str = base64.b64encode(barcode_bytes).decode()
+        with span("print.base64"):
+            img_str = base64.b64encode(barcode_bytes).decode()
 
         # Download button
         st.download_button(
-            label="📥 Download Ultra High-Quality Barcode (600 DPI)",
+            label=f"📥 Download Ultra High-Quality Barcode ({LABEL_DPI} DPI)",
             data=barcode_bytes,
             file_name=f"barcode_{patient_phn}.png",
             mime="image/png",
@@ -216,167 +331,41 @@ def print_barcode_web(barcode_img, patient_phn, patient_data=None):
         )
 
         # Print button with direct image handling
-        html_code = f"""
-        <div style="text-align: center; margin: 15px 0;">
-            <button onclick="printDirectImage()" 
-                    style="padding: 12px 24px; background-color: #4CAF50; color: white; border: none; border-radius: 4px; cursor: pointer; font-size: 16px;">
-                🖨️ Print Ultra High-Quality Barcode
-            </button>
-        </div>
-
-        <script>
-        function printDirectImage() {{
-            // Create a new window for printing
-            var printWindow = window.open('', '_blank');
-
-            if (!printWindow) {{
-                alert('Please allow pop-ups for this site to print the barcode.');
-                return;
-            }}
-
-            // Write the HTML content with exact dimensions for 10cm x 4.3cm
-            printWindow.document.write(`
-                <!DOCTYPE html>
-                <html>
-                <head>
-                    <title>Print Barcode - {patient_phn}</title>
-                    <style>
-                        @page {{
-                            size: 100mm 43mm;
-                            margin: 0;
-                            padding: 0;
-                        }}
-                        body {{
-                            margin: 0;
-                            padding: 0;
-                            width: 100mm;
-                            height: 43mm;
-                            display: flex;
-                            justify-content: center;
-                            align-items: center;
-                            background: white;
-                        }}
-                        .barcode-container {{
-                            width: 100%;
-                            height: 100%;
-                            display: flex;
-                            justify-content: center;
-                            align-items: center;
-                        }}
-                        img {{
-                            width: 100%;
-                            height: 100%;
-                            object-fit: contain;
-                            image-rendering: crisp-edges;
-                        }}
-                    </style>
-                </head>
-                <body>
-                    <div class="barcode-container">
-                        <img src="data:image/png;base64,{img_str}" 
-                             alt="Patient Barcode: {patient_phn}"
-                             onload="setTimeout(function() {{ 
-                                 window.print(); 
-                                 setTimeout(function() {{ window.close(); }}, 100);
-                             }}, 500)">
-                    </div>
-                </body>
-                </html>
-            `);
-
-            printWindow.document.close();
-        }}
-        </script>
-        """
+        html_code = print_controls_html(patient_phn, f"data:image/png;base64,{img_str}", timestamp_html)
         st.components.v1.html(html_code, height=100)
+        # What this label costs the websocket: the download payload plus the print page
+        count('payload_bytes', 'print.download', len(barcode_bytes))
+        count('payload_bytes', 'print.html', len(html_code))
 
     except Exception as e:
         st.error(f"Error preparing barcode for printing: {e}")
 
 
-def generate_barcode(patient_data, target_width_cm=8.0):
-    """Generate a properly sized barcode with ultra high DPI (600)"""
-    try:
-        # Get PHN from patient data
-        patient_phn = patient_data.get('phn', '')
-        if not patient_phn:
-            patient_phn = "PHN-NOT-FOUND"
-
-        # Remove dashes for barcode encoding
-        clean_phn = patient_phn.replace('-', '')
-
-        # Calculate exact pixel dimensions at 600 DPI
-        dpi = 600
-        target_width_px = int(target_width_cm / 2.54 * dpi)  # Convert cm to pixels
-
-        # Use python-barcode library with optimized settings
-        code128 = barcode.get_barcode_class('code128')
-        barcode_obj = code128(clean_phn, writer=ImageWriter())
-
-        # Configure barcode options for proper size at 600 DPI
-        options = {
-            'module_width': 1.5,  # Adjusted for proper barcode width
-            'module_height': 40.0,  # Proper barcode height at 600 DPI
-            'quiet_zone': 12.0,  # Adequate quiet zone at 600 DPI
-            'font_size': 35,  # Readable font size for barcode text at 600 DPI
-            'text_distance': 16,  # Proper text spacing at 600 DPI
-            'background': 'white',
-            'foreground': 'black',
-            'write_text': True,
-            'dpi': dpi
-        }
-
-        # Generate barcode image
-        buffer = BytesIO()
-        barcode_obj.write(buffer, options=options)
-        buffer.seek(0)
-        img = Image.open(buffer)
-
-        # Resize to exact width with high-quality interpolation
-        current_width, current_height = img.size
-        scaling_factor = target_width_px / current_width
-        target_height = int(current_height * scaling_factor)
-
-        return img.resize((target_width_px, target_height), Image.LANCZOS)
-
-    except Exception as e:
-        st.error(f"Barcode generation error: {e}")
-        return create_fallback_barcode(patient_phn, target_width_px, target_height)
-
-
-def create_precise_fallback_barcode(text, width_cm, height_cm):
-    """Create a precise fallback barcode with exact dimensions"""
-    dpi = 600
-    width_px = int(width_cm / 2.54 * dpi)
-    height_px = int(height_cm / 2.54 * dpi)
+def run_patient_search():
+    """Fetch the current page of the active Reprint search into session state"""
+    search_by, search_term = st.session_state.search_query
+    st.session_state.search_results = []
+    st.session_state.search_next = None
+    st.session_state.pop('search_result_select', None)
+    if not search_term:
+        st.error("Please enter a search term.")
+        return
 
-    img = Image.new('RGB', (width_px, height_px), (255, 255, 255))
-    draw = ImageDraw.Draw(img)
-
-    # Create a simple pattern that resembles a barcode
-    pattern_length = 40  # Number of bars
-    bar_width = width_px / pattern_length
-
-    for i in range(pattern_length):
-        # Alternate between black and white bars
-        if i % 2 == 0:
-            x_start = i * bar_width
-            x_end = (i + 1) * bar_width
-            draw.rectangle([x_start, 0, x_end, height_px], fill="black")
-
-    # Add text below
     try:
-        font_size = int(height_px * 0.2)
-        font = ImageFont.truetype("arial.ttf", font_size)
-    except:
-        font = ImageFont.load_default()
-
-    text_width = draw.textlength(text, font=font)
-    text_x = (width_px - text_width) / 2
-    text_y = height_px - font_size - 5
-    draw.text((text_x, text_y), text, font=font, fill="black")
-
-    return img
+        # PHN and NIC lookups are cached and unique: one row, never a second page
+        rows, next_cursor = get_patient_service().search(
+            search_by, search_term, after=st.session_state.search_cursors[-1]
+        )
+    except ServiceError as err:
+        st.error(str(err))
+        return
+    except (mysql.connector.Error, PoolTimeout) as err:
+        st.error(f"Database error: {err}")
+        return
+    st.session_state.search_results = rows
+    st.session_state.search_next = next_cursor
+    if not rows:
+        st.error("No patient found.")
 
 
 def clear_form():
@@ -393,7 +382,6 @@ def clear_form():
         'province': 'Sabaragamuwa',
         'mh_division': '',
         'birthday': datetime.now().date(),
-        'age': '',
         'nic': '',
         'phn': '',
         'marital_status': 'Single',
@@ -407,66 +395,21 @@ def clear_form():
     }
 
     # Clear avatar and any other temporary data
-    keys_to_remove = ['avatar_img', 'reprint_patient']
+    keys_to_remove = ['avatar_draft', 'save_job', 'reprint_patient', 'search_results', 'reprint_avatar', 'reprint_avatar_id']
     for key in keys_to_remove:
         if key in st.session_state:
             del st.session_state[key]
 
+    discard_draft()
+
     # Force a rerun to update all widgets
     st.rerun()
 
 
-def main():
-    st.set_page_config(
-        page_title="Patient Information System",
-        page_icon="🏥",
-        layout="wide",
-        initial_sidebar_state="expanded"
-    )
-
-    st.title("Patient Information System")
-    st.markdown("## General Hospital Abcdefg - Patient Registration")
-
-    # Initialize database
-    if 'db_initialized' not in st.session_state:
-        if initialize_database():
-            st.session_state.db_initialized = True
-        else:
-            st.error("Database initialization failed!")
-
-    # Create tabs
-    tab1, tab2, tab3, tab4, tab5 = st.tabs([
-        "Personal Info", "Contact Info", "Medical Info", "Avatar", "Reprint"
-    ])
-
-    # Initialize session state for form data
-    if 'patient_data' not in st.session_state:
-        st.session_state.patient_data = {
-            'title': 'Mr.',
-            'full_name': '',
-            'other_names': '',
-            'gender': 'Male',
-            'address_line1': '',
-            'address_line2': '',
-            'district': 'Kegalle',
-            'province': 'Sabaragamuwa',
-            'mh_division': '',
-            'birthday': datetime.now().date(),
-            'age': '',
-            'nic': '',
-            'phn': '',
-            'marital_status': 'Single',
-            'guardian': '',
-            'contact_numbers': '',
-            'occupation': 'Student',
-            'blood_type': 'A+',
-            'known_allergies': '',
-            'chronic_conditions': '',
-            'primary_physician': 'Dr. S. Perera'
-        }
-
-    # Personal Info Tab
-    with tab1:
+@st.fragment
+def render_personal_tab():
+    """Personal details section; reruns on its own when one of its widgets changes"""
+    with timed_section("Personal Info"):
         st.header("Personal Details")
 
         col1, col2 = st.columns(2)
@@ -474,8 +417,8 @@ def main():
         with col1:
             st.session_state.patient_data['title'] = st.selectbox(
                 "Title",
-                ["Mr.", "Mrs.", "Miss", "Master", "Baby", "Ven.", "Dr.", "Other"],
-                index=0,
+                TITLE_OPTIONS,
+                index=option_index(TITLE_OPTIONS, 'title', 0),
                 key="title_select"
             )
             st.session_state.patient_data['full_name'] = st.text_input(
@@ -490,8 +433,8 @@ def main():
             )
             st.session_state.patient_data['gender'] = st.selectbox(
                 "Gender:*",
-                ["Male", "Female", "Prefer not to say"],
-                index=0,
+                GENDER_OPTIONS,
+                index=option_index(GENDER_OPTIONS, 'gender', 0),
                 key="gender_select"
             )
 
@@ -523,13 +466,16 @@ def main():
                 )
             with phn_col2:
                 if st.button("Generate PHN", use_container_width=True, key="generate_phn_btn"):
-                    st.session_state.patient_data['phn'] = generate_phn(
-                        st.session_state.patient_data['nic']
-                    )
+                    st.session_state.patient_data['phn'] = generate_phn()
                     st.rerun()
 
-    # Contact Info Tab
-    with tab2:
+    persist_draft()
+
+
+@st.fragment
+def render_contact_tab():
+    """Contact details section"""
+    with timed_section("Contact Info"):
         st.header("Contact Details")
 
         col1, col2 = st.columns(2)
@@ -547,21 +493,16 @@ def main():
             )
             st.session_state.patient_data['district'] = st.selectbox(
                 "District:*",
-                ["Kegalle", "Gampaha", "Kalutara", "Kandy", "Matale", "Nuwara Eliya",
-                 "Galle", "Matara", "Hambantota", "Jaffna", "Kilinochchi", "Mannar",
-                 "Vavuniya", "Mullaitivu", "Batticaloa", "Ampara", "Trincomalee",
-                 "Kurunegala", "Puttalam", "Anuradhapura", "Polonnaruwa", "Badulla",
-                 "Monaragala", "Ratnapura", "Colombo"],
-                index=0,
+                DISTRICT_OPTIONS,
+                index=option_index(DISTRICT_OPTIONS, 'district', 0),
                 key="district_select"
             )
 
         with col2:
             st.session_state.patient_data['province'] = st.selectbox(
                 "Province:*",
-                ["Sabaragamuwa", "Central", "Southern", "Northern", "Eastern",
-                 "North Western", "North Central", "Uva", "Western"],
-                index=8,
+                PROVINCE_OPTIONS,
+                index=option_index(PROVINCE_OPTIONS, 'province', 8),
                 key="province_select"
             )
             st.session_state.patient_data['mh_division'] = st.text_input(
@@ -575,8 +516,13 @@ def main():
                 key="contact_numbers_input"
             )
 
-    # Medical Info Tab
-    with tab3:
+    persist_draft()
+
+
+@st.fragment
+def render_medical_tab():
+    """Medical information section"""
+    with timed_section("Medical Info"):
         st.header("Medical Information")
 
         col1, col2 = st.columns(2)
@@ -584,8 +530,8 @@ def main():
         with col1:
             st.session_state.patient_data['blood_type'] = st.selectbox(
                 "Blood Type:",
-                ["Unknown", "A+", "A-", "B+", "B-", "AB+", "AB-", "O+", "O-"],
-                index=1,
+                BLOOD_TYPE_OPTIONS,
+                index=option_index(BLOOD_TYPE_OPTIONS, 'blood_type', 1),
                 key="blood_type_select"
             )
             st.session_state.patient_data['known_allergies'] = st.text_area(
@@ -602,34 +548,60 @@ def main():
             )
             st.session_state.patient_data['primary_physician'] = st.selectbox(
                 "Primary Physician:",
-                ["", "Dr. S. Perera", "Dr. R. Fernando", "Dr. M. Silva",
-                 "Dr. J. Rajapaksa", "Dr. L. Dias"],
-                index=1,
+                PHYSICIAN_OPTIONS,
+                index=option_index(PHYSICIAN_OPTIONS, 'primary_physician', 1),
                 key="primary_physician_select"
             )
 
-    # Avatar Tab with improved cropping and clearing
-    with tab4:
+    persist_draft()
+
+
+def set_avatar_source(upload):
+    """Ingest a newly uploaded/captured image once, not on every rerun"""
+    if st.session_state.get('avatar_source') == upload.file_id:
+        return
+    try:
+        st.session_state.avatar_draft = AvatarDraft(upload.getvalue())
+    except OSError as err:
+        st.error(f"Could not read image: {err}")
+    st.session_state.avatar_source = upload.file_id
+
+
+@st.cache_data(max_entries=32, show_spinner=False)
+def avatar_preview(digest, crop_box, _img):
+    """Downscaled JPEG of `_img` (optionally cropped), memoized on image digest and crop box"""
+    preview = _img.crop(crop_box) if crop_box else _img
+    preview = preview.convert('RGB')
+    preview.thumbnail((AVATAR_PREVIEW_SIDE, AVATAR_PREVIEW_SIDE), Image.BILINEAR)
+    buffer = BytesIO()
+    preview.save(buffer, format='JPEG', quality=85)
+    return buffer.getvalue()
+
+
+@st.fragment
+def render_avatar_tab():
+    """Avatar upload, capture and cropping"""
+    with timed_section("Avatar"):
         st.header("Patient Avatar")
 
         # Option 1: File upload
         uploaded_file = st.file_uploader("Upload an image", type=["jpg", "jpeg", "png"], key="avatar_uploader")
         if uploaded_file is not None:
-            image = Image.open(uploaded_file)
-            st.session_state.avatar_img = image
+            set_avatar_source(uploaded_file)
 
         # Option 2: Camera input (built into Streamlit)
         picture = st.camera_input("Or take a picture", key="avatar_camera")
         if picture:
-            image = Image.open(BytesIO(picture.getvalue()))
-            st.session_state.avatar_img = image
+            set_avatar_source(picture)
 
         # Display and cropping functionality
-        if 'avatar_img' in st.session_state and st.session_state.avatar_img is not None:
-            img = st.session_state.avatar_img
+        if st.session_state.get('avatar_draft') is not None:
+            draft = st.session_state.avatar_draft
+            img = draft.image
+            digest = draft.digest
 
             # Display the image
-            st.image(img, caption="Original Image", width='stretch')
+            st.image(avatar_preview(digest, None, img), caption="Original Image", width='stretch')
 
             # Create a simple but effective cropping interface
             st.subheader("Crop Image")
@@ -657,12 +629,14 @@ def main():
 
             # Display crop preview
             try:
-                cropped_preview = img.crop((left, top, right, bottom))
-                st.image(cropped_preview, caption="Cropped Preview", width='stretch')
+                crop_box = (left, top, right, bottom)
+                st.image(avatar_preview(digest, crop_box, img), caption="Cropped Preview", width='stretch')
 
-                # Crop button
+                # Crop button: the full-resolution crop is only made when applied
                 if st.button("Apply Crop", key="apply_crop_btn"):
-                    st.session_state.avatar_img = cropped_preview
+                    draft.crop(crop_box)
+                    for key in ('crop_left', 'crop_right', 'crop_top', 'crop_bottom'):
+                        st.session_state.pop(key, None)
                     st.success("Image cropped successfully!")
                     st.rerun()
             except Exception as e:
@@ -670,165 +644,339 @@ def main():
 
         # Clear avatar button
         if st.button("Clear Avatar", key="clear_avatar_btn"):
-            if 'avatar_img' in st.session_state:
-                del st.session_state.avatar_img
+            if 'avatar_draft' in st.session_state:
+                del st.session_state.avatar_draft
             st.success("Avatar cleared!")
             st.rerun()
 
-    # Reprint Tab
-    with tab5:
+    persist_draft()
+
+
+@st.fragment
+def render_reprint_tab():
+    """Search and barcode reprint"""
+    with timed_section("Reprint"):
         st.header("Barcode Reprint")
 
         search_col1, search_col2 = st.columns([1, 3])
         with search_col1:
-            search_by = st.selectbox("Search by:", ["PHN", "NIC", "Name"], key="search_by_select")
+            search_by = st.selectbox("Search by:", SEARCH_BY_OPTIONS, key="search_by_select")
         with search_col2:
             search_term = st.text_input("Enter search term:", key="search_term_input")
 
         if st.button("Search", key="search_btn"):
-            conn = create_db_connection()
-            if conn:
-                try:
-                    cursor = conn.cursor(dictionary=True)
-                    if search_by == "PHN":
-                        query = "SELECT * FROM patients WHERE phn = %s"
-                    elif search_by == "NIC":
-                        query = "SELECT * FROM patients WHERE nic = %s"
-                    else:
-                        query = "SELECT * FROM patients WHERE full_name LIKE %s"
-                        search_term = f"%{search_term}%"
-
-                    cursor.execute(query, (search_term,))
-                    patient = cursor.fetchone()
+            # Each entry is the keyset cursor that starts a visited page
+            st.session_state.search_query = (search_by, search_term.strip())
+            st.session_state.search_cursors = [None]
+            run_patient_search()
+
+        if st.session_state.get('search_results'):
+            results = st.session_state.search_results
+            page = len(st.session_state.search_cursors)
+            st.caption(f"Page {page} - {len(results)} match(es)")
+
+            selected = st.radio(
+                "Select patient:",
+                range(len(results)),
+                format_func=lambda i: (
+                    f"{results[i]['full_name']} | {results[i]['phn']} | "
+                    f"NIC {results[i]['nic'] or '-'} | {results[i]['birthday'] or '-'}"
+                ),
+                key="search_result_select"
+            )
+            patient = results[selected]
+            st.session_state.reprint_patient = patient
 
-                    if patient:
-                        st.session_state.reprint_patient = patient
-                        st.success("Patient found!")
-                        st.write(f"Name: {patient['full_name']}")
-                        st.write(f"PHN: {patient['phn']}")
+            st.write(f"Name: {patient['full_name']}")
+            st.write(f"PHN: {patient['phn']}")
+            age = age_from_birthday(patient['birthday'])
+            if age is not None:
+                st.write(f"Age: {age}")
 
-                        if patient['avatar']:
-                            avatar_img = Image.open(BytesIO(patient['avatar']))
-                            st.image(avatar_img, caption="Patient Avatar", width=120)
-                    else:
-                        st.error("No patient found.")
-                except mysql.connector.Error as err:
-                    st.error(f"Database error: {err}")
-                finally:
-                    conn.close()
+            # Load the small thumbnail only for the chosen patient
+            if st.session_state.get('reprint_avatar_id') != patient['id']:
+                conn = create_db_connection()
+                if conn:
+                    try:
+                        st.session_state.reprint_avatar = fetch_thumbnail(conn, patient['id'])
+                        st.session_state.reprint_avatar_id = patient['id']
+                    except mysql.connector.Error as err:
+                        st.error(f"Database error: {err}")
+                    finally:
+                        conn.close()
+            if st.session_state.get('reprint_avatar'):
+                st.image(st.session_state.reprint_avatar, caption="Patient Avatar", width=120)
+
+                # Full-size avatar on demand
+                if st.button("Show full avatar", key="show_full_avatar_btn"):
+                    conn = create_db_connection()
+                    if conn:
+                        try:
+                            full_avatar = fetch_avatar(conn, patient['id'])
+                            if full_avatar:
+                                st.image(full_avatar, caption="Patient Avatar")
+                        except mysql.connector.Error as err:
+                            st.error(f"Database error: {err}")
+                        finally:
+                            conn.close()
+
+            prev_col, next_col = st.columns(2)
+            with prev_col:
+                if st.button("Previous", disabled=page == 1, key="search_prev_btn"):
+                    st.session_state.search_cursors.pop()
+                    run_patient_search()
+                    st.rerun()
+            with next_col:
+                if st.button("Next", disabled=st.session_state.search_next is None, key="search_next_btn"):
+                    st.session_state.search_cursors.append(st.session_state.search_next)
+                    run_patient_search()
+                    st.rerun()
 
         if 'reprint_patient' in st.session_state:
+            # Thermal printer path: compact ZPL/EPL over a raw socket, no browser dialog
+            if get_print_queue() is not None:
+                if st.button("Send to Label Printer", key="direct_print_btn"):
+                    try:
+                        job_id = print_label_direct(st.session_state.reprint_patient, with_timestamp=LABEL_TIMESTAMP != 'none')
+                        st.success(f"Print job #{job_id} queued for {PRINTER_HOST}")
+                    except (KeyError, RuntimeError) as err:
+                        st.error(f"Error queueing print job: {err}")
+
             if st.button("Reprint Barcode", key="reprint_btn"):
-                # Generate the complete label image with patient info and barcode
-                label_img = generate_label_image(st.session_state.reprint_patient)
-                st.image(label_img, caption="Patient Label", use_container_width=True)  # Fixed deprecated parameter
-
-                # Provide printing options
-                print_barcode_web(
-                    label_img,
-                    st.session_state.reprint_patient['phn'],
-                    st.session_state.reprint_patient
-                )
+                patient = st.session_state.reprint_patient
+                image_url = media_url('label', patient)
+                if image_url:
+                    # Preview, print and download share one cached URL; the API renders it on first use
+                    st.image(image_url, caption="Patient Label", use_container_width=True)
+                    print_barcode_web(None, patient['phn'], patient, timestamp_top=label_timestamp_top(patient),
+                                      image_url=image_url)
+                else:
+                    # Generate the complete label image with patient info and barcode (cached per PHN)
+                    try:
+                        label_png, timestamp_top = get_label_png(patient)
+                    except BarcodeError as err:
+                        st.error(str(err))
+                    else:
+                        st.image(label_png, caption="Patient Label", use_container_width=True)  # Fixed deprecated parameter
+
+                        # Provide printing options
+                        print_barcode_web(label_png, patient['phn'], patient, timestamp_top=timestamp_top)
+
+        # Batch printing for clinic lists and ward admissions
+        with st.expander("Batch Print"):
+            batch_phns = st.text_area("PHNs (one per line):", key="batch_phns_input")
+            batch_format = st.radio("Output:", ["PDF", "HTML"], horizontal=True, key="batch_format_select")
+            batch_template = st.selectbox("Label:", tuple(TEMPLATES), key="batch_template_select")
+
+            if st.button("Render Batch", key="batch_render_btn"):
+                phns = list(dict.fromkeys(line.strip() for line in batch_phns.splitlines() if line.strip()))
+                conn = create_db_connection() if phns else None
+                if conn:
+                    try:
+                        rows, missing = fetch_label_rows(conn, phns)
+                    except mysql.connector.Error as err:
+                        rows, missing = [], []
+                        st.error(f"Database error: {err}")
+                    finally:
+                        conn.close()
+
+                    if missing:
+                        st.warning(f"Not found: {', '.join(missing)}")
+                    if rows:
+                        progress = st.progress(0.0, text="Rendering labels...")
+                        update = lambda done: progress.progress(done / len(rows), text=f"Rendered {done}/{len(rows)}")
+                        suffix = ".pdf" if batch_format == "PDF" else ".html"
+
+                        # Pages are written straight into the buffer the download is served from
+                        batch_buffer = BytesIO()
+                        if batch_format == "PDF":
+                            write_pdf(iter_label_pages(rows, template=batch_template), batch_buffer, progress=update)
+                        else:
+                            html_out = TextIOWrapper(batch_buffer, encoding='utf-8', write_through=True)
+                            write_html(iter_label_pages(rows, template=batch_template), html_out,
+                                       progress=update, size_mm=TEMPLATES[batch_template]['size_mm'])
+                            html_out.detach()
+
+                        st.download_button(
+                            label=f"📥 Download {len(rows)} labels ({batch_format})",
+                            data=batch_buffer,
+                            file_name=f"labels_{datetime.now():%Y%m%d_%H%M%S}{suffix}",
+                            mime="application/pdf" if batch_format == "PDF" else "text/html",
+                            use_container_width=True
+                        )
+
+
+def main():
+    st.set_page_config(
+        page_title="Patient Information System",
+        page_icon="🏥",
+        layout="wide",
+        initial_sidebar_state="expanded"
+    )
+
+    try:
+        start_metrics()
+    except OSError as err:
+        st.warning(f"Metrics endpoint not started: {err}")
+
+    st.title("Patient Information System")
+    st.markdown("## General Hospital Abcdefg - Patient Registration")
+
+    # Initialize database
+    if 'db_initialized' not in st.session_state:
+        if initialize_database():
+            st.session_state.db_initialized = True
+        else:
+            st.error("Database initialization failed!")
+
+    # Create tabs
+    tab1, tab2, tab3, tab4, tab5 = st.tabs([
+        "Personal Info", "Contact Info", "Medical Info", "Avatar", "Reprint"
+    ])
+
+    # Resume the draft named in the URL (possibly started on another replica)
+    if 'draft_id' not in st.session_state:
+        resume_draft()
+
+    # Initialize session state for form data
+    if 'patient_data' not in st.session_state:
+        st.session_state.patient_data = {
+            'title': 'Mr.',
+            'full_name': '',
+            'other_names': '',
+            'gender': 'Male',
+            'address_line1': '',
+            'address_line2': '',
+            'district': 'Kegalle',
+            'province': 'Sabaragamuwa',
+            'mh_division': '',
+            'birthday': datetime.now().date(),
+            'nic': '',
+            'phn': '',
+            'marital_status': 'Single',
+            'guardian': '',
+            'contact_numbers': '',
+            'occupation': 'Student',
+            'blood_type': 'A+',
+            'known_allergies': '',
+            'chronic_conditions': '',
+            'primary_physician': 'Dr. S. Perera'
+        }
+
+    # Personal Info Tab
+    with tab1:
+        render_personal_tab()
+
+    # Contact Info Tab
+    with tab2:
+        render_contact_tab()
+
+    # Medical Info Tab
+    with tab3:
+        render_medical_tab()
+
+    # Avatar Tab
+    with tab4:
+        render_avatar_tab()
+
+    # Reprint Tab
+    with tab5:
+        render_reprint_tab()
 
     # Sidebar actions
-    with st.sidebar:
+    with st.sidebar, timed_section("Sidebar"):
         st.header("Actions")
 
         if st.button("Check Duplicates", key="check_duplicates_btn"):
-            # Implement duplicate checking
-            st.info("Duplicate checking would be implemented here")
+            conn = create_db_connection()
+            if conn:
+                try:
+                    candidates = find_duplicate_candidates(conn, st.session_state.patient_data)
+                except mysql.connector.Error as err:
+                    st.error(f"Error checking duplicates: {err}")
+                else:
+                    if candidates:
+                        st.warning(f"{len(candidates)} possible duplicate(s) found")
+                        st.dataframe(
+                            [{'Score': c['score'], 'PHN': c['phn'], 'Name': c['full_name'], 'NIC': c['nic'],
+                              'Birthday': c['birthday'], 'Why': c['reasons']} for c in candidates],
+                            hide_index=True
+                        )
+                    else:
+                        st.success("No likely duplicates found")
+                finally:
+                    conn.close()
 
         if st.button("Clear Form", key="clear_form_btn"):
             clear_form()
 
         if st.button("Save Patient", type="primary", key="save_patient_btn"):
-            # Validate required fields
-            required_fields = [
-                ('full_name', 'Full Name'),
-                ('gender', 'Gender'),
-                ('phn', 'PHN'),
-                ('address_line1', 'Address Line 1'),
-                ('district', 'District'),
-                ('province', 'Province'),
-                ('contact_numbers', 'Contact Numbers')
-            ]
-
-            missing_fields = []
-            for field, name in required_fields:
-                if not st.session_state.patient_data[field]:
-                    missing_fields.append(name)
+            # Same record rules as the API and the bulk importer, then the required fields
+            try:
+                patient = normalize_patient(st.session_state.patient_data)
+            except ValueError as err:
+                patient = None
+                st.error(f"Please correct the form: {err}")
+            missing_fields = missing_required_fields(patient) if patient else []
 
             if missing_fields:
                 st.error(f"Please fill in the following required fields: {', '.join(missing_fields)}")
+            elif patient:
+                # Journal the record and let the background writer do the insert
+                try:
+                    job_id = get_save_queue().submit(
+                        patient,
+                        st.session_state.avatar_draft.image if 'avatar_draft' in st.session_state else None
+                    )
+                except OSError as err:
+                    st.error(f"Error saving patient: {err}")
+                else:
+                    st.session_state.save_job = {'id': job_id, 'patient_data': patient}
+                    st.success(f"Patient {patient['phn']} registered")
+
+                    # Clear avatar after saving (as requested)
+                    if 'avatar_draft' in st.session_state:
+                        del st.session_state.avatar_draft
+                    discard_draft()
+
+        if 'save_job' in st.session_state:
+            save_job = st.session_state.save_job
+            job = get_save_queue().status(save_job['id'])
+            if job is None or job['status'] in ('saved', 'done'):
+                show_saved_label(save_job['patient_data'])
+            elif job['status'] == 'failed':
+                st.error(f"Saving {job['phn']} failed: {job['error']} (kept in {SAVE_JOURNAL_DIR}/failed)")
             else:
-                # Save to database
-                conn = create_db_connection()
-                if conn:
-                    try:
-                        cursor = conn.cursor()
-
-                        # Handle avatar image
-                        avatar_blob = None
-                        if 'avatar_img' in st.session_state:
-                            img_byte_arr = BytesIO()
-                            st.session_state.avatar_img.save(img_byte_arr, format='JPEG')
-                            avatar_blob = img_byte_arr.getvalue()
-
-                        # Insert patient
-                        query = """
-                        INSERT INTO patients (
-                            title, full_name, other_names, gender, address_line1, address_line2, 
-                            district, province, mh_division, birthday, age, nic, phn, marital_status, 
-                            guardian, contact_numbers, occupation, blood_type, known_allergies, 
-                            chronic_conditions, primary_physician, avatar
-                        ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-                        """
-
-                        values = (
-                            st.session_state.patient_data['title'],
-                            st.session_state.patient_data['full_name'],
-                            st.session_state.patient_data['other_names'],
-                            st.session_state.patient_data['gender'],
-                            st.session_state.patient_data['address_line1'],
-                            st.session_state.patient_data['address_line2'],
-                            st.session_state.patient_data['district'],
-                            st.session_state.patient_data['province'],
-                            st.session_state.patient_data['mh_division'],
-                            st.session_state.patient_data['birthday'],
-                            st.session_state.patient_data['age'],
-                            st.session_state.patient_data['nic'],
-                            st.session_state.patient_data['phn'],
-                            st.session_state.patient_data['marital_status'],
-                            st.session_state.patient_data['guardian'],
-                            st.session_state.patient_data['contact_numbers'],
-                            st.session_state.patient_data['occupation'],
-                            st.session_state.patient_data['blood_type'],
-                            st.session_state.patient_data['known_allergies'],
-                            st.session_state.patient_data['chronic_conditions'],
-                            st.session_state.patient_data['primary_physician'],
-                            avatar_blob
-                        )
+                watch_save_job(save_job['id'])
 
-                        cursor.execute(query, values)
-                        conn.commit()
+        with st.expander("Connection Pool"):
+            st.json(get_connection_pool().stats())
 
-                        # Generate barcode
-                        barcode_img = generate_barcode(st.session_state.patient_data)
-                        st.image(barcode_img, caption="Patient Barcode", width='stretch')
+        with st.expander("Save Queue"):
+            st.dataframe(get_save_queue().jobs(), hide_index=True)
 
-                        # Provide printing options
-                        st.success("Patient information saved successfully!")
-                        print_barcode_web(barcode_img, st.session_state.patient_data['phn'])
+        if get_print_queue() is not None:
+            with st.expander("Print Queue"):
+                st.dataframe(get_print_queue().jobs(), hide_index=True)
 
-                        # Clear avatar after saving (as requested)
-                        if 'avatar_img' in st.session_state:
-                            del st.session_state.avatar_img
+        with st.expander("Label Cache"):
+            st.json({'barcode': barcode_cache.stats(), 'label_png': label_png_cache.stats()})
 
-                    except mysql.connector.Error as err:
-                        st.error(f"Error saving patient: {err}")
-                    finally:
-                        conn.close()
+        with st.expander("Patient Lookup Cache"):
+            st.json(get_patient_cache().stats())
+
+        with st.expander("Rerun Timing"):
+            st.caption("Per-section render time in this session; tab sections rerun on their own")
+            st.dataframe(
+                [{'Section': name, 'Runs': t['runs'], 'Last ms': round(t['last_ms'], 1),
+                  'Avg ms': round(t['total_ms'] / t['runs'], 1), 'Max ms': round(t['max_ms'], 1)}
+                 for name, t in st.session_state.get('section_timings', {}).items()],
+                hide_index=True
+            )
+
+    persist_draft(end_of_run=True)
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    with timed_section("Full rerun"):
+        main()
\ No newline at end of file
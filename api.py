@@ -0,0 +1,339 @@
+"""Headless JSON API for other hospital systems (lab, pharmacy, ward kiosks)
+
+    python api.py --port 8600 --workers 4
+
+    POST /phn                       {"count": 1}         -> {"phns": [...]}
+    POST /patients                  patient record       -> 201 {"id", "phn"}
+    GET  /patients?by=Name&q=...&after=...               -> {"results", "next"}
+    GET  /patients/{phn}                                 -> patient
+    POST /patients/lookup           {"phns": [...]}      -> {"patients", "missing"}
+    GET  /labels/{phn}.png?template=wristband            -> label PNG
+    GET  /media/{kind}/{phn}/{digest}.png                -> cacheable label/barcode PNG (label_media)
+    POST /labels          {"phns", "format", "template"} -> streamed PDF/HTML
+    GET  /health                                         -> pool and cache stats
+    GET  /metrics                                        -> Prometheus metrics
+
+Handlers are async; database and rendering work runs in the thread pool
+on pooled connections. Concurrent GET /patients/{phn} requests are
+coalesced into one `phn IN (...)` query per short window. Set API_TOKEN
+to require `Authorization: Bearer <token>`; /media URLs are exempt, since
+browsers load them as plain images and the digest already binds each URL to
+one patient's label. Without LABEL_MEDIA_SECRET that digest could be
+computed by anyone, so /media is then refused and not exempt.
+"""
+import argparse
+import asyncio
+import base64
+import hmac
+import json
+import secrets
+
+import mysql.connector
+import uvicorn
+from starlette.applications import Starlette
+from starlette.concurrency import iterate_in_threadpool, run_in_threadpool
+from starlette.responses import JSONResponse, PlainTextResponse, Response, StreamingResponse
+from starlette.routing import Route
+
+from db_pool import ConnectionPool, PoolTimeout
+from label_media import MEDIA_KINDS, media_digest, render_media
+from labels import barcode_cache, label_png_cache
+from metrics import register_gauges, render_prometheus
+from patient_cache import get_patient_cache
+from phn import PHNAllocator, normalize_phn, reserve_phn_block
+from services import ConflictError, NotFoundError, PatientService, ValidationError
+from settings import (
+    API_BATCH_MAX, API_BATCH_WINDOW_MS, API_HOST, API_PORT, API_TOKEN, DB_CONFIG, DB_POOL_SIZE, DB_POOL_TIMEOUT,
+    LABEL_MEDIA_CACHE_CONTROL, LABEL_MEDIA_SECRET
+)
+
+MAX_LOOKUP_PHNS = 1000
+MAX_PHNS_PER_REQUEST = 100
+
+
+class JSON(JSONResponse):
+    """JSONResponse that also serializes dates (birthday) as ISO strings"""
+
+    def render(self, content):
+        return json.dumps(content, default=str, separators=(',', ':')).encode('utf-8')
+
+
+class LookupBatcher:
+    """Coalesces concurrent single-PHN lookups into one batched query
+
+    Requests arriving within `window` seconds of the first (or until
+    `max_batch` distinct PHNs are waiting) share one lookup_many() call.
+    """
+
+    def __init__(self, service, window=API_BATCH_WINDOW_MS / 1000, max_batch=API_BATCH_MAX):
+        self.service = service
+        self.window = window
+        self.max_batch = max_batch
+        self._pending = {}  # phn -> [futures]
+        self._timer = None
+        self._tasks = set()  # running batches; the loop only keeps weak references to tasks
+        self.batches = 0
+        self.lookups = 0
+
+    async def get(self, phn):
+        phn = normalize_phn(phn)
+        future = asyncio.get_running_loop().create_future()
+        self._pending.setdefault(phn, []).append(future)
+        self.lookups += 1
+        if len(self._pending) >= self.max_batch:
+            self._flush()
+        elif self._timer is None:
+            self._timer = asyncio.get_running_loop().call_later(self.window, self._flush)
+        return await future
+
+    def _flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._pending = self._pending, {}
+        if batch:
+            self.batches += 1
+            task = asyncio.ensure_future(self._run(batch))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, batch):
+        try:
+            found, _ = await run_in_threadpool(self.service.lookup_many, list(batch))
+        except Exception as err:  # hand the failure to every waiting request
+            for futures in batch.values():
+                for future in futures:
+                    if not future.done():
+                        future.set_exception(err)
+            return
+        for phn, futures in batch.items():
+            for future in futures:
+                if not future.done():
+                    future.set_result(found.get(phn))
+
+    def stats(self):
+        return {'lookups': self.lookups, 'batches': self.batches,
+                'avg_batch': self.lookups / self.batches if self.batches else 0.0}
+
+
+def encode_cursor(cursor):
+    return base64.urlsafe_b64encode(json.dumps(cursor).encode()).decode() if cursor else None
+
+
+def decode_cursor(token):
+    if not token:
+        return None
+    try:
+        full_name, patient_id = json.loads(base64.urlsafe_b64decode(token.encode()))
+        return full_name, int(patient_id)
+    except (ValueError, TypeError) as err:
+        raise ValidationError("invalid 'after' cursor") from err
+
+
+async def read_json(request):
+    try:
+        body = await request.json()
+    except ValueError as err:
+        raise ValidationError("request body must be JSON") from err
+    if not isinstance(body, dict):
+        raise ValidationError("request body must be a JSON object")
+    return body
+
+
+def phn_list(body, limit):
+    phns = body.get('phns')
+    if not isinstance(phns, list) or not phns or not all(isinstance(phn, str) for phn in phns):
+        raise ValidationError("'phns' must be a non-empty list of strings")
+    if len(phns) > limit:
+        raise ValidationError(f"at most {limit} PHNs per request")
+    return [normalize_phn(phn) for phn in phns]
+
+
+async def issue_phns(request):
+    body = await read_json(request) if await request.body() else {}
+    count = body.get('count', 1)
+    # bool is an int subclass: reject `true` rather than issue one PHN for it
+    if not isinstance(count, int) or isinstance(count, bool) or not 1 <= count <= MAX_PHNS_PER_REQUEST:
+        raise ValidationError(f"'count' must be 1..{MAX_PHNS_PER_REQUEST}")
+    service = request.app.state.service
+    phns = await run_in_threadpool(lambda: [service.generate_phn() for _ in range(count)])
+    return JSON({'phns': phns})
+
+
+async def register_patient(request):
+    record = await read_json(request)
+    result = await run_in_threadpool(request.app.state.service.register, record)
+    return JSON(result, status_code=201)
+
+
+async def search(request):
+    params = request.query_params
+    rows, next_cursor = await run_in_threadpool(
+        request.app.state.service.search, params.get('by', 'Name'), params.get('q', ''),
+        decode_cursor(params.get('after'))
+    )
+    return JSON({'results': rows, 'next': encode_cursor(next_cursor)})
+
+
+async def get_patient(request):
+    phn = normalize_phn(request.path_params['phn'])
+    row = await request.app.state.batcher.get(phn)
+    if row is None:
+        raise NotFoundError(f"no patient with PHN {phn}")
+    return JSON(row)
+
+
+async def lookup_patients(request):
+    phns = phn_list(await read_json(request), MAX_LOOKUP_PHNS)
+    found, missing = await run_in_threadpool(request.app.state.service.lookup_many, phns)
+    return JSON({'patients': found, 'missing': missing})
+
+
+async def label_png(request):
+    png_bytes = await run_in_threadpool(
+        request.app.state.service.label_png, normalize_phn(request.path_params['phn']),
+        request.query_params.get('template', 'patient')
+    )
+    return Response(png_bytes, media_type='image/png')
+
+
+async def media(request):
+    """Content-addressed label image; 304 for any ETag the client already holds"""
+    if not LABEL_MEDIA_SECRET:
+        raise NotFoundError("media URLs are disabled (LABEL_MEDIA_SECRET is not set)")
+    kind, phn, digest = (request.path_params[name] for name in ('kind', 'phn', 'digest'))
+    headers = {
+        'ETag': f'"{digest}"',
+        'Cache-Control': LABEL_MEDIA_CACHE_CONTROL,
+        'Access-Control-Allow-Origin': '*',  # the print page's download fetches it
+    }
+    # The URL names immutable content, so a matching ETag needs no lookup or render
+    if f'"{digest}"' in request.headers.get('if-none-match', ''):
+        return Response(status_code=304, headers=headers)
+
+    patient = await request.app.state.batcher.get(phn) if kind in MEDIA_KINDS else None
+    if patient is None or not hmac.compare_digest(media_digest(kind, patient), digest):
+        raise NotFoundError("no such media")
+    png_bytes = await run_in_threadpool(render_media, kind, patient)
+    return Response(png_bytes, media_type='image/png', headers=headers)
+
+
+async def label_batch(request):
+    body = await read_json(request)
+    phns = phn_list(body, MAX_LOOKUP_PHNS)
+    fmt = body.get('format', 'pdf')
+    template = body.get('template', 'patient')
+    # Validation and lookups happen here, so errors are reported before streaming starts
+    chunks = await run_in_threadpool(
+        request.app.state.service.iter_labels, phns, fmt, None, template
+    )
+    media_type = 'application/pdf' if fmt == 'pdf' else 'text/html; charset=utf-8'
+    return StreamingResponse(iterate_in_threadpool(chunks), media_type=media_type)
+
+
+async def health(request):
+    """Pool and cache stats; 503 and status 'unhealthy' when startup left no service behind the API"""
+    state = request.app.state
+    pool = getattr(state, 'pool', None)
+    batcher = getattr(state, 'batcher', None)
+    healthy = getattr(state, 'service', None) is not None
+    return JSON({
+        'status': 'ok' if healthy else 'unhealthy',
+        'pool': pool.stats() if pool is not None else None,
+        'batcher': batcher.stats() if batcher is not None else None,
+        'patient_cache': get_patient_cache().stats(),
+        'label_png_cache': label_png_cache.stats(),
+        'barcode_cache': barcode_cache.stats(),
+    }, status_code=200 if healthy else 503)
+
+
+async def metrics(request):
+    return PlainTextResponse(render_prometheus(), media_type='text/plain; version=0.0.4')
+
+
+def error_response(status):
+    async def handler(request, exc):
+        return JSON({'error': str(exc)}, status_code=status)
+    return handler
+
+
+class TokenAuth:
+    """ASGI middleware requiring `Authorization: Bearer <API_TOKEN>` when a token is configured"""
+
+    def __init__(self, app, token):
+        self.app = app
+        self.expected = f"Bearer {token}".encode()
+
+    @staticmethod
+    def exempt(path):
+        return path in ('/health', '/metrics') or (bool(LABEL_MEDIA_SECRET) and path.startswith('/media/'))
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'http' and not self.exempt(scope['path']):
+            supplied = dict(scope['headers']).get(b'authorization', b'')
+            if not secrets.compare_digest(supplied, self.expected):
+                response = JSON({'error': 'unauthorized'}, status_code=401)
+                await response(scope, receive, send)
+                return
+        await self.app(scope, receive, send)
+
+
+def create_app(service=None, pool=None):
+    """Build the API; by default on a MySQL connection pool sized by DB_POOL_SIZE"""
+    if service is None:
+        pool = ConnectionPool(lambda: mysql.connector.connect(**DB_CONFIG), size=DB_POOL_SIZE, timeout=DB_POOL_TIMEOUT)
+
+        def reserve(size):
+            conn = pool.get_connection()
+            try:
+                return reserve_phn_block(conn, size)
+            finally:
+                conn.close()
+
+        service = PatientService(pool.get_connection, PHNAllocator(reserve), get_patient_cache())
+
+    app = Starlette(
+        routes=[
+            Route('/phn', issue_phns, methods=['POST']),
+            Route('/patients', register_patient, methods=['POST']),
+            Route('/patients', search, methods=['GET']),
+            Route('/patients/lookup', lookup_patients, methods=['POST']),
+            Route('/patients/{phn}', get_patient, methods=['GET']),
+            Route('/labels', label_batch, methods=['POST']),
+            Route('/labels/{phn}.png', label_png, methods=['GET']),
+            Route('/media/{kind}/{phn}/{digest}.png', media, methods=['GET']),
+            Route('/health', health, methods=['GET']),
+            Route('/metrics', metrics, methods=['GET']),
+        ],
+        exception_handlers={
+            ValidationError: error_response(400),
+            NotFoundError: error_response(404),
+            ConflictError: error_response(409),
+            PoolTimeout: error_response(503),
+            mysql.connector.Error: error_response(503),
+        },
+    )
+    app.state.service = service
+    app.state.pool = pool
+    app.state.batcher = LookupBatcher(service)
+    if pool is not None:
+        register_gauges('db_pool', pool.stats)
+    register_gauges('api_batcher', app.state.batcher.stats)
+    register_gauges('patient_cache', get_patient_cache().stats)
+    register_gauges('barcode_cache', barcode_cache.stats)
+    register_gauges('label_png_cache', label_png_cache.stats)
+    return TokenAuth(app, API_TOKEN) if API_TOKEN else app
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run the patient registration JSON API")
+    parser.add_argument("--host", default=API_HOST)
+    parser.add_argument("--port", type=int, default=API_PORT)
+    parser.add_argument("--workers", type=int, default=1, help="worker processes (each with its own pool)")
+    args = parser.parse_args(argv)
+    uvicorn.run("api:create_app", factory=True, host=args.host, port=args.port,
+                workers=args.workers, access_log=False)
+
+
+if __name__ == "__main__":
+    main()
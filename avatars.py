@@ -0,0 +1,196 @@
+"""Patient avatar storage
+
+Avatars live in `patient_avatars`, away from the hot `patients` row, and are
+stored as a size-capped JPEG plus a small pre-generated thumbnail. Searches
+never touch this table; the UI loads the thumbnail for the selected patient
+and the full image only when asked for.
+
+While a registration is being edited the avatar is an AvatarDraft: the
+upload's compressed bytes plus a working image decoded straight to a
+bounded size, so a 12 MP phone photo never sits in memory at full
+resolution.
+"""
+import hashlib
+from io import BytesIO
+
+from PIL import Image, ImageOps
+
+from settings import AVATAR_SESSION_BUDGET_MB
+
+AVATAR_MAX_SIDE = 640  # pixels, longest edge
+AVATAR_MAX_BYTES = 96 * 1024
+AVATAR_QUALITY_STEPS = (85, 75, 65, 55, 45)
+THUMBNAIL_SIDE = 96
+THUMBNAIL_QUALITY = 70
+AVATAR_WORKING_SIDE = 1280  # pixels, longest edge of the image the crop sliders work on
+ORIGINAL_FALLBACK_QUALITY = 90
+
+
+def _to_jpeg(img, quality):
+    buffer = BytesIO()
+    img.save(buffer, format='JPEG', quality=quality, optimize=True)
+    return buffer.getvalue()
+
+
+def encode_avatar(img):
+    """Downscale and re-encode an avatar; returns (image_bytes, thumbnail_bytes)"""
+    img = ImageOps.exif_transpose(img).convert('RGB')
+
+    avatar = img.copy()
+    avatar.thumbnail((AVATAR_MAX_SIDE, AVATAR_MAX_SIDE), Image.LANCZOS)
+    # Step the JPEG quality down until the encoded avatar fits the size cap
+    for quality in AVATAR_QUALITY_STEPS:
+        image_bytes = _to_jpeg(avatar, quality)
+        if len(image_bytes) <= AVATAR_MAX_BYTES:
+            break
+
+    thumbnail = avatar.copy()
+    thumbnail.thumbnail((THUMBNAIL_SIDE, THUMBNAIL_SIDE), Image.LANCZOS)
+    return image_bytes, _to_jpeg(thumbnail, THUMBNAIL_QUALITY)
+
+
+def decode_avatar(data, max_side=AVATAR_WORKING_SIDE):
+    """Decode image bytes (or bound an open image) to an upright RGB image no larger than `max_side`
+
+    JPEGs are decoded at a reduced DCT scale (draft), others are reduced by an
+    integer factor before the final resample, so the full-resolution frame is
+    never materialized for large JPEGs and only briefly for other formats.
+    An image passed in is left untouched.
+    """
+    img = data if isinstance(data, Image.Image) else Image.open(BytesIO(data))
+    exif = img.getexif()
+    if img is not data:
+        img.draft('RGB', (max_side, max_side))
+    if img.mode not in ('RGB', 'RGBA', 'L'):
+        img = img.convert('RGB')
+    factor = max(img.size) // max_side
+    if factor > 1:
+        img = img.reduce(factor)
+    elif img is data:
+        img = img.copy()
+    # Orientation comes from the source EXIF, which reduce() does not carry over
+    img.info['exif'] = exif.tobytes()
+    img = ImageOps.exif_transpose(img).convert('RGB')
+    # Bilinear is enough here: the stored avatar is resampled again with LANCZOS
+    img.thumbnail((max_side, max_side), Image.BILINEAR)
+    return img
+
+
+class AvatarDraft:
+    """An avatar being edited: compressed original plus a bounded working image
+
+    The decoded working image is only a cache and can be released at any time;
+    it is re-decoded from `original` when next needed. `crop_box` is kept in
+    working-image coordinates of the uncropped image.
+    """
+
+    def __init__(self, data, budget_bytes=AVATAR_SESSION_BUDGET_MB * 1024 * 1024):
+        self.original = data
+        self.budget_bytes = budget_bytes
+        self.crop_box = None
+        self._working = None
+        self._image = None
+        self._source_digest = hashlib.sha1(data).hexdigest()
+        self._fit_budget()
+
+    @property
+    def digest(self):
+        """Identifies the current picture (source plus crop), for memoizing previews"""
+        return f"{self._source_digest}:{self.crop_box}" if self.crop_box else self._source_digest
+
+    @property
+    def working(self):
+        if self._working is None:
+            self._working = decode_avatar(self.original)
+        return self._working
+
+    @property
+    def image(self):
+        """The working image with the applied crop"""
+        if self._image is None:
+            self._image = self.working.crop(self.crop_box) if self.crop_box else self.working
+        return self._image
+
+    def crop(self, box):
+        """Apply a crop given in coordinates of the current (possibly cropped) image"""
+        left, top = self.crop_box[:2] if self.crop_box else (0, 0)
+        self.crop_box = (left + box[0], top + box[1], left + box[2], top + box[3])
+        self._image = None
+        self._fit_budget()
+
+    def reset_crop(self):
+        self.crop_box = None
+        self._image = None
+
+    def memory_bytes(self):
+        decoded = {id(img): img.width * img.height * len(img.getbands())
+                   for img in (self._working, self._image) if img is not None}
+        return len(self.original) + sum(decoded.values())
+
+    def release(self):
+        """Drop the decoded pixels, keeping only the compressed original"""
+        self._working = None
+        self._image = None
+
+    def _fit_budget(self):
+        """Evict whatever the session's budget cannot hold, most expensive first"""
+        if self.memory_bytes() <= self.budget_bytes:
+            return
+        if self._image is not None and self._image is not self._working:
+            self._working = None
+        if self.memory_bytes() > self.budget_bytes and len(self.original) > self.budget_bytes // 2:
+            # The original alone is too big to keep: replace it with the bounded working
+            # image, which is all the stored avatar is ever derived from
+            buffer = BytesIO()
+            self.working.save(buffer, format='JPEG', quality=ORIGINAL_FALLBACK_QUALITY)
+            self.original = buffer.getvalue()
+
+
+def save_avatar(cursor, patient_id, img):
+    """Insert or replace a patient's avatar inside the caller's transaction"""
+    image_bytes, thumbnail_bytes = encode_avatar(img)
+    cursor.execute(
+        """
+        INSERT INTO patient_avatars (patient_id, image, thumbnail) VALUES (%s, %s, %s)
+        ON DUPLICATE KEY UPDATE image = VALUES(image), thumbnail = VALUES(thumbnail)
+        """,
+        (patient_id, image_bytes, thumbnail_bytes)
+    )
+    return len(image_bytes), len(thumbnail_bytes)
+
+
+def _fetch_column(conn, column, patient_id):
+    cursor = conn.cursor()
+    cursor.execute(f"SELECT {column} FROM patient_avatars WHERE patient_id = %s", (patient_id,))
+    row = cursor.fetchone()
+    cursor.close()
+    return row[0] if row else None
+
+
+def fetch_thumbnail(conn, patient_id):
+    """Small JPEG for the search result list, or None"""
+    return _fetch_column(conn, 'thumbnail', patient_id)
+
+
+def fetch_avatar(conn, patient_id):
+    """Full-size (capped) JPEG, loaded only when the operator opens it"""
+    return _fetch_column(conn, 'image', patient_id)
+
+
+def compact_stored_avatars(cursor):
+    """Migration step: re-encode copied legacy avatars and generate thumbnails"""
+    cursor.execute("SELECT patient_id FROM patient_avatars WHERE thumbnail IS NULL")
+    patient_ids = [row[0] for row in cursor.fetchall()]
+
+    for patient_id in patient_ids:
+        cursor.execute("SELECT image FROM patient_avatars WHERE patient_id = %s", (patient_id,))
+        (image,) = cursor.fetchone()
+        try:
+            image_bytes, thumbnail_bytes = encode_avatar(Image.open(BytesIO(image)))
+        except OSError:
+            # Unreadable legacy image: keep the original bytes, skip the thumbnail
+            continue
+        cursor.execute(
+            "UPDATE patient_avatars SET image = %s, thumbnail = %s WHERE patient_id = %s",
+            (image_bytes, thumbnail_bytes, patient_id)
+        )
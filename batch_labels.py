@@ -0,0 +1,272 @@
+"""Batch label printing: many patients' labels in one print job
+
+Labels are rendered in parallel on a process pool and written out page by
+page as they finish, into either a multi-page PDF or a single HTML print
+document with one label-sized page each (any label_templates template).
+Only a bounded window of rendered pages is held in memory at any time, so
+batch size is limited by disk, not RAM.
+
+    python batch_labels.py --pdf ward7.pdf PHN-1250-... PHN-1250-...
+"""
+import argparse
+import base64
+import multiprocessing
+import os
+import struct
+import sys
+import threading
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from io import BytesIO
+
+import mysql.connector
+from PIL import Image
+
+from label_templates import TEMPLATES
+from labels import LABEL_DPI, LABEL_FIELDS, TEMPLATE_FIELDS, encode_png, generate_label_image, post_to_label_worker
+from phn import normalize_phn
+from settings import DB_CONFIG, LABEL_TIMESTAMP, LABEL_WORKER_CONCURRENCY, LABEL_WORKER_URLS
+
+BATCH_WORKERS = int(os.environ.get('BATCH_WORKERS', str(max(1, (os.cpu_count() or 2) - 1))))
+PHN_LOOKUP_CHUNK = 500
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_render_pool():
+    """Pool shared by all batch jobs in this server process
+
+    With label workers configured the rendering happens there, so a thread
+    pool just keeps LABEL_WORKER_CONCURRENCY requests in flight.
+    """
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            if LABEL_WORKER_URLS:
+                _pool = ThreadPoolExecutor(LABEL_WORKER_CONCURRENCY)
+            else:
+                # spawn, not fork: forking a threaded web server is unsafe
+                _pool = ProcessPoolExecutor(BATCH_WORKERS, mp_context=multiprocessing.get_context('spawn'))
+        return _pool
+
+
+def fetch_label_rows(conn, phns):
+    """Load the label fields for `phns`, in the order given; returns (rows, missing)
+
+    PHNs are matched in normalized form (see normalize_phn) on both sides, as
+    the collation matches them case-insensitively anyway.
+    """
+    phns = [normalize_phn(phn) for phn in phns]
+    found = {}
+    cursor = conn.cursor(dictionary=True)
+    for start in range(0, len(phns), PHN_LOOKUP_CHUNK):
+        chunk = phns[start:start + PHN_LOOKUP_CHUNK]
+        placeholders = ", ".join(["%s"] * len(chunk))
+        cursor.execute(f"SELECT {', '.join(LABEL_FIELDS)} FROM patients WHERE phn IN ({placeholders})", chunk)
+        for row in cursor.fetchall():
+            found[normalize_phn(row['phn'])] = row
+    cursor.close()
+
+    rows = [found[phn] for phn in phns if phn in found]
+    missing = [phn for phn in phns if phn not in found]
+    return rows, missing
+
+
+def render_label_page(patient_data, with_timestamp, template='patient'):
+    """Worker entry point: one label as PNG bytes (cheap to send between processes)"""
+    return encode_png(generate_label_image(patient_data, with_timestamp=with_timestamp, template=template))
+
+
+def fetch_label_page(patient_data, with_timestamp, template='patient'):
+    """One label as PNG bytes from a label worker, rendered here if none answers"""
+    try:
+        png_bytes, _ = post_to_label_worker('/page', {
+            'patient': {field: patient_data.get(field) for field in TEMPLATE_FIELDS[template]},
+            'with_timestamp': with_timestamp, 'template': template,
+        })
+        return png_bytes
+    except OSError:
+        return render_label_page(patient_data, with_timestamp, template)
+
+
+def iter_label_pages(rows, with_timestamp=None, pool=None, window=None, template='patient'):
+    """Yield PNG pages of `template` in input order while at most `window` renders are in flight"""
+    if with_timestamp is None:
+        with_timestamp = LABEL_TIMESTAMP != 'none'
+    pool = pool or get_render_pool()
+    if LABEL_WORKER_URLS:
+        render, window = fetch_label_page, window or LABEL_WORKER_CONCURRENCY
+    else:
+        render, window = render_label_page, window or BATCH_WORKERS * 2
+
+    pending = deque()
+    for row in rows:
+        pending.append(pool.submit(render, row, with_timestamp, template))
+        if len(pending) >= window:
+            yield pending.popleft().result()
+    while pending:
+        yield pending.popleft().result()
+
+
+def _png_image_stream(png_bytes):
+    """Return (width, height, pdf_image_dict, data) reusing the PNG's zlib data as-is"""
+    if png_bytes[:8] != b'\x89PNG\r\n\x1a\n':
+        raise ValueError("not a PNG")
+    position, idat = 8, []
+    while position < len(png_bytes):
+        length = struct.unpack('>I', png_bytes[position:position + 4])[0]
+        chunk_type = png_bytes[position + 4:position + 8]
+        chunk = png_bytes[position + 8:position + 8 + length]
+        if chunk_type == b'IHDR':
+            width, height, bit_depth, color_type, _, _, interlace = struct.unpack('>IIBBBBB', chunk)
+        elif chunk_type == b'IDAT':
+            idat.append(chunk)
+        position += length + 12
+
+    if color_type not in (0, 2) or interlace:
+        # Palette/alpha/interlaced PNGs can't be passed through; normalize via Pillow
+        img = Image.open(BytesIO(png_bytes)).convert('RGB')
+        return _png_image_stream(encode_png(img))
+
+    colors = 3 if color_type == 2 else 1
+    image_dict = (
+        f"/Type /XObject /Subtype /Image /Width {width} /Height {height} "
+        f"/ColorSpace /{'DeviceRGB' if colors == 3 else 'DeviceGray'} /BitsPerComponent {bit_depth} "
+        f"/Filter /FlateDecode /DecodeParms << /Predictor 15 /Colors {colors} "
+        f"/BitsPerComponent {bit_depth} /Columns {width} >>"
+    )
+    return width, height, image_dict, b''.join(idat)
+
+
+def _pdf_object(obj_id, body, stream=None):
+    head = f"{obj_id} 0 obj\n<< {body}".encode()
+    if stream is None:
+        return head + b" >>\nendobj\n"
+    return head + f" /Length {len(stream)} >>\nstream\n".encode() + stream + b"\nendstream\nendobj\n"
+
+
+def iter_pdf(pages, progress=None):
+    """Yield a PDF of PNG pages chunk by chunk, one chunk per page as it is rendered
+
+    Each page's compressed PNG data is copied straight into the PDF, and only
+    object offsets are kept in memory, so the document is produced in one pass
+    and can be streamed to a file or an HTTP response.
+    """
+    offsets = {}
+    position = 0
+    next_id = 3  # 1 = catalog, 2 = page tree (written last)
+    page_ids = []
+
+    def emit(obj_id, body, stream=None):
+        nonlocal position
+        offsets[obj_id] = position
+        data = _pdf_object(obj_id, body, stream)
+        position += len(data)
+        return data
+
+    header = b"%PDF-1.4\n%\xe2\xe3\xcf\xd3\n"
+    position = len(header)
+    yield header
+
+    for png_bytes in pages:
+        width, height, image_dict, data = _png_image_stream(png_bytes)
+        width_pt, height_pt = width * 72 / LABEL_DPI, height * 72 / LABEL_DPI
+
+        image_id, content_id, page_id = next_id, next_id + 1, next_id + 2
+        next_id += 3
+        yield b"".join((
+            emit(image_id, image_dict, data),
+            emit(content_id, "", f"q {width_pt:.2f} 0 0 {height_pt:.2f} 0 0 cm /Im0 Do Q".encode()),
+            emit(
+                page_id,
+                f"/Type /Page /Parent 2 0 R /MediaBox [0 0 {width_pt:.2f} {height_pt:.2f}] "
+                f"/Resources << /XObject << /Im0 {image_id} 0 R >> >> /Contents {content_id} 0 R"
+            ),
+        ))
+        page_ids.append(page_id)
+        if progress:
+            progress(len(page_ids))
+
+    kids = " ".join(f"{page_id} 0 R" for page_id in page_ids)
+    tail = emit(2, f"/Type /Pages /Kids [{kids}] /Count {len(page_ids)}") + emit(1, "/Type /Catalog /Pages 2 0 R")
+    xref = [f"xref\n0 {next_id}\n0000000000 65535 f \n"]
+    xref += [f"{offsets[obj_id]:010d} 00000 n \n" for obj_id in range(1, next_id)]
+    xref.append(f"trailer\n<< /Size {next_id} /Root 1 0 R >>\nstartxref\n{position}\n%%EOF\n")
+    yield tail + "".join(xref).encode()
+
+
+def iter_html(pages, title="Patient Labels", progress=None, size_mm=(100, 43)):
+    """Yield a print-ready HTML document with one label-sized page (size_mm) per label"""
+    width, height = size_mm
+    yield (
+        f"<!DOCTYPE html><html><head><title>{title}</title><style>"
+        f"@page {{ size: {width}mm {height}mm; margin: 0; }} "
+        "body { margin: 0; } "
+        f".page {{ width: {width}mm; height: {height}mm; page-break-after: always; }} "
+        ".page img { width: 100%; height: 100%; object-fit: contain; image-rendering: crisp-edges; }"
+        "</style></head><body>\n"
+    )
+    count = 0
+    for png_bytes in pages:
+        yield f'<div class="page"><img src="data:image/png;base64,{base64.b64encode(png_bytes).decode()}"></div>\n'
+        count += 1
+        if progress:
+            progress(count)
+    yield "<script>window.onload = function() { window.print(); };</script></body></html>\n"
+
+
+def _write_counted(chunks_for, out, progress):
+    count = 0
+
+    def track(done):
+        nonlocal count
+        count = done
+        if progress:
+            progress(done)
+
+    for chunk in chunks_for(track):
+        out.write(chunk)
+    return count
+
+
+def write_pdf(pages, out, progress=None):
+    """Stream PNG pages into a PDF written to binary file `out`; returns the page count"""
+    return _write_counted(lambda track: iter_pdf(pages, track), out, progress)
+
+
+def write_html(pages, out, title="Patient Labels", progress=None, size_mm=(100, 43)):
+    """Stream an HTML print document to text file `out`; returns the page count"""
+    return _write_counted(lambda track: iter_html(pages, title, track, size_mm), out, progress)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Render labels for several PHNs into one print job")
+    parser.add_argument("phns", nargs="+")
+    target = parser.add_mutually_exclusive_group(required=True)
+    target.add_argument("--pdf", help="write a multi-page PDF")
+    target.add_argument("--html", help="write an HTML print document")
+    parser.add_argument("--template", choices=sorted(TEMPLATES), default='patient', help="label layout")
+    args = parser.parse_args(argv)
+
+    conn = mysql.connector.connect(**DB_CONFIG)
+    try:
+        rows, missing = fetch_label_rows(conn, args.phns)
+    finally:
+        conn.close()
+    for phn in missing:
+        print(f"Not found: {phn}", file=sys.stderr)
+
+    pages = iter_label_pages(rows, template=args.template)
+    if args.pdf:
+        with open(args.pdf, 'wb') as out:
+            count = write_pdf(pages, out)
+    else:
+        with open(args.html, 'w', encoding='utf-8') as out:
+            count = write_html(pages, out, size_mm=TEMPLATES[args.template]['size_mm'])
+    print(f"Wrote {count} label(s)")
+    return 0 if not missing else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,92 @@
+"""Server memory held by avatars being edited in many concurrent sessions
+
+Simulates N browser sessions that have each uploaded a 12 MP phone photo,
+and reports the process RSS once every session holds its avatar:
+
+    python benchmarks/bench_avatar_sessions.py --sessions 50
+
+"Before" keeps the decoded full-resolution PIL image per session, as the
+Avatar tab used to. "After" keeps an AvatarDraft (compressed upload plus a
+bounded working image) under the per-session budget. Each mode runs in its
+own subprocess so the two RSS figures don't contaminate each other.
+"""
+import argparse
+import os
+import resource
+import subprocess
+import sys
+import time
+from io import BytesIO
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from PIL import Image
+
+from avatars import AvatarDraft
+
+CAMERA_SIZE = (4032, 3024)
+
+
+def phone_jpeg():
+    """A 12 MP JPEG with noise (so it compresses like a photo) and a rotate-90 EXIF tag"""
+    noise = Image.effect_noise(CAMERA_SIZE, 40).convert('RGB')
+    gradient = Image.linear_gradient('L').resize(CAMERA_SIZE).convert('RGB')
+    frame = Image.blend(noise, gradient, 0.6)
+    exif = frame.getexif()
+    exif[0x0112] = 6
+    buffer = BytesIO()
+    frame.save(buffer, format='JPEG', quality=90, exif=exif.tobytes())
+    return buffer.getvalue()
+
+
+def rss_mb():
+    with open('/proc/self/statm') as f:
+        return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 1024 ** 2
+
+
+def run_mode(mode, sessions):
+    upload = phone_jpeg()
+    baseline = rss_mb()
+    held = []
+    started = time.perf_counter()
+    for _ in range(sessions):
+        data = bytes(upload)  # each session has its own copy of the upload
+        if mode == 'before':
+            img = Image.open(BytesIO(data))
+            img.load()
+            held.append(img)
+        else:
+            draft = AvatarDraft(data)
+            draft.image  # decode the working image, as the Avatar tab does
+            held.append(draft)
+    elapsed_ms = (time.perf_counter() - started) * 1000 / sessions
+    peak_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    print(f"{rss_mb() - baseline:.1f} {peak_mb:.1f} {elapsed_ms:.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sessions", type=int, default=50)
+    parser.add_argument("--mode", choices=("before", "after"), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.mode:
+        run_mode(args.mode, args.sessions)
+        return
+
+    results = {}
+    for mode in ("before", "after"):
+        output = subprocess.run(
+            [sys.executable, __file__, "--mode", mode, "--sessions", str(args.sessions)],
+            check=True, capture_output=True, text=True
+        ).stdout.split()
+        results[mode] = [float(value) for value in output]
+
+    print(f"{args.sessions} sessions, one {CAMERA_SIZE[0]}x{CAMERA_SIZE[1]} upload each")
+    print(f"{'':26s} {'before':>10s} {'after':>10s}")
+    for index, label in enumerate(("Held by sessions (MB)", "Peak RSS (MB)", "Ingest per upload (ms)")):
+        print(f"{label:26s} {results['before'][index]:10.1f} {results['after'][index]:10.1f}")
+
+
+if __name__ == "__main__":
+    main()
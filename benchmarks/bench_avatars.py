@@ -0,0 +1,67 @@
+"""Avatar storage and transfer sizes before/after thumbnails and re-encoding
+
+Uses a synthetic 12 MP camera frame, so it needs no database:
+
+    python benchmarks/bench_avatars.py
+
+"Before" is the old behaviour: full-resolution JPEG stored inline in
+`patients` and returned by every `SELECT *` search hit. "After" is the
+capped avatar in `patient_avatars` plus the thumbnail loaded for the one
+selected search result.
+"""
+import os
+import sys
+import time
+from io import BytesIO
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from PIL import Image
+
+from avatars import encode_avatar
+from patient_search import SEARCH_PAGE_SIZE
+
+CAMERA_SIZE = (4032, 3024)
+# Rough size of the non-BLOB columns of one patients row on the wire
+ROW_BYTES = 400
+
+
+def synthetic_camera_frame():
+    noise = Image.effect_noise(CAMERA_SIZE, 40).convert('RGB')
+    gradient = Image.linear_gradient('L').resize(CAMERA_SIZE).convert('RGB')
+    return Image.blend(noise, gradient, 0.6)
+
+
+def decoded_bytes(jpeg_bytes):
+    img = Image.open(BytesIO(jpeg_bytes))
+    return img.width * img.height * len(img.getbands())
+
+
+def main():
+    frame = synthetic_camera_frame()
+
+    start = time.perf_counter()
+    buffer = BytesIO()
+    frame.save(buffer, format='JPEG')
+    legacy = buffer.getvalue()
+    legacy_ms = (time.perf_counter() - start) * 1000
+
+    start = time.perf_counter()
+    avatar, thumbnail = encode_avatar(frame)
+    encode_ms = (time.perf_counter() - start) * 1000
+
+    rows = [
+        ("Stored avatar bytes", len(legacy), len(avatar)),
+        ("Encode time on save (ms)", legacy_ms, encode_ms),
+        ("Search page over the wire", SEARCH_PAGE_SIZE * (ROW_BYTES + len(legacy)),
+         SEARCH_PAGE_SIZE * ROW_BYTES + len(thumbnail)),
+        ("Decoded image in memory", decoded_bytes(legacy), decoded_bytes(thumbnail)),
+        ("Full avatar on demand", len(legacy), len(avatar)),
+    ]
+    print(f"{'':28s} {'before':>14s} {'after':>14s} {'ratio':>8s}")
+    for label, before, after in rows:
+        print(f"{label:28s} {before:14,.0f} {after:14,.0f} {before / after:7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+"""Barcode and label throughput: python-barcode PNG + LANCZOS vs native Code128
+
+    python benchmarks/bench_barcode.py
+
+The legacy path is reproduced here (ImageWriter -> PNG in BytesIO ->
+Image.open -> LANCZOS resize) since the app no longer uses it. Caches are
+cleared before every render so each iteration does the full work.
+"""
+import os
+import sys
+import time
+from io import BytesIO
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import barcode
+from barcode.writer import ImageWriter
+from PIL import Image
+
+import labels
+
+DURATION = 3.0  # seconds per measurement
+
+
+def legacy_generate_barcode(patient_data, target_width_cm=8.0):
+    clean_phn = patient_data['phn'].replace('-', '')
+    target_width_px = int(target_width_cm / 2.54 * 600)
+    barcode_obj = barcode.get_barcode_class('code128')(clean_phn, writer=ImageWriter())
+    buffer = BytesIO()
+    barcode_obj.write(buffer, options={
+        'module_width': 1.5, 'module_height': 40.0, 'quiet_zone': 12.0, 'font_size': 35,
+        'text_distance': 16, 'background': 'white', 'foreground': 'black', 'write_text': True, 'dpi': 600,
+    })
+    buffer.seek(0)
+    img = Image.open(buffer)
+    scale = target_width_px / img.width
+    return img.resize((target_width_px, int(img.height * scale)), Image.LANCZOS)
+
+
+def patient(n):
+    return {
+        'title': 'Mr.', 'full_name': 'Nimal Perera', 'address_line1': '12 Main Street, Kegalle',
+        'contact_numbers': '0771234567', 'phn': f'PHN-1250-2401011200-{n:04d}',
+    }
+
+
+def throughput(render):
+    count = 0
+    start = time.perf_counter()
+    while time.perf_counter() - start < DURATION:
+        labels.barcode_cache.clear()
+        render(patient(count % 10000))
+        count += 1
+    return count / (time.perf_counter() - start)
+
+
+def main():
+    original = labels.generate_barcode
+    results = {
+        "barcode, legacy": throughput(legacy_generate_barcode),
+        "barcode, native": throughput(original),
+    }
+    labels.generate_barcode = legacy_generate_barcode
+    results["label, legacy"] = throughput(labels.generate_label_image)
+    labels.generate_barcode = original
+    results["label, native"] = throughput(labels.generate_label_image)
+
+    for name, per_second in results.items():
+        print(f"{name:18s} {per_second:8.1f} /sec")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,154 @@
+"""Change feed throughput: events/s through run_feed to a file and a socket sink
+
+    python benchmarks/bench_change_feed.py
+    python benchmarks/bench_change_feed.py --events 200000 --formats jsonl --sinks socket
+    python benchmarks/bench_change_feed.py --db --consumer bench   # read the configured database
+
+Without --db the outbox is an in-memory list of real event payloads, so the
+numbers cover encoding, batching, the reader thread and the sink (file
+fsynced per batch, or a local ReceiverServer over TCP). Also reports the
+save-path cost of building one event payload, and how far the reader gets
+ahead of a deliberately slow sink (it should stop at --prefetch batches).
+"""
+import argparse
+import datetime
+import os
+import sys
+import tempfile
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import mysql.connector
+
+import change_feed
+from bench_search import percentile
+from db_pool import ConnectionPool
+from settings import CHANGE_FEED_BATCH, CHANGE_FEED_PREFETCH, DB_CONFIG
+
+
+def feed_patient(n):
+    return {
+        'title': 'Mrs.', 'full_name': f"Kumari Wijesinghe {n}", 'gender': 'Female',
+        'address_line1': "45 Temple Road", 'address_line2': "Kegalle", 'district': 'Kegalle',
+        'province': 'Sabaragamuwa', 'birthday': datetime.date(1970, 1, 1) + datetime.timedelta(days=n % 20000),
+        'nic': f"{197000000000 + n}", 'phn': f"PHN-1250-{n:09d}-0", 'marital_status': 'Married',
+        'contact_numbers': "0712345678 / 0352222333", 'blood_type': 'O+',
+    }
+
+
+class MemoryFeed:
+    """ChangeFeed stand-in over a list of events; counts reads so prefetch can be observed"""
+
+    def __init__(self, events, batch_size):
+        self.events = events
+        self.batch_size = batch_size
+        self.reads = 0
+        self.saved = 0
+
+    def read(self, after, gaps=None):
+        self.reads += 1
+        return self.events[after:after + self.batch_size]  # event ids are 1..n
+
+    def save_cursor(self, consumer, event_id):
+        self.saved = event_id
+
+
+class SlowSink:
+    def __init__(self, feed, delay):
+        self.feed = feed
+        self.delay = delay
+        self.lead = []  # batches read but not yet written, at each write
+
+    def write(self, data):
+        self.lead.append(self.feed.reads - len(self.lead) - 1)
+        time.sleep(self.delay)
+
+    def close(self):
+        pass
+
+
+def make_events(count):
+    created = datetime.datetime.now(datetime.timezone.utc).isoformat(timespec='milliseconds')
+    return [(n, 'created', created, change_feed.patient_event(n, feed_patient(n))) for n in range(1, count + 1)]
+
+
+def open_bench_sink(kind, directory, receiver):
+    if kind == 'file':
+        return change_feed.FileSink(os.path.join(directory, 'feed.jsonl'))
+    if kind == 'devnull':
+        return change_feed.FileSink(os.devnull, sync=False)
+    return change_feed.SocketSink('127.0.0.1', receiver.port)
+
+
+def bench_payload(count):
+    """Microseconds to build one event payload (the cost added to every save)"""
+    patients = [feed_patient(n) for n in range(count)]
+    samples = []
+    for n, patient in enumerate(patients):
+        started = time.perf_counter()
+        change_feed.patient_event(n, patient)
+        samples.append((time.perf_counter() - started) * 1e6)
+    return percentile(samples, 50), percentile(samples, 99)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--events", type=int, default=100000)
+    parser.add_argument("--batch", type=int, default=CHANGE_FEED_BATCH)
+    parser.add_argument("--prefetch", type=int, default=CHANGE_FEED_PREFETCH)
+    parser.add_argument("--formats", nargs="+", choices=change_feed.FORMATS, default=list(change_feed.FORMATS))
+    parser.add_argument("--sinks", nargs="+", choices=('devnull', 'file', 'socket'), default=['devnull', 'file', 'socket'])
+    parser.add_argument("--db", action="store_true", help="read patient_events from the configured database")
+    parser.add_argument("--consumer", help="with --db: save the position under this consumer")
+    args = parser.parse_args()
+
+    if args.db:
+        pool = ConnectionPool(lambda: mysql.connector.connect(**DB_CONFIG), size=2)
+        feed = change_feed.ChangeFeed(pool.get_connection, batch_size=args.batch)
+        for fmt in args.formats:
+            started = time.perf_counter()
+            delivered, last_event_id = change_feed.run_feed(
+                feed, change_feed.FileSink(os.devnull, sync=False), 0, consumer=args.consumer, fmt=fmt,
+                prefetch=args.prefetch
+            )
+            elapsed = time.perf_counter() - started
+            print(f"db {fmt:5s} {delivered} events up to {last_event_id} in {elapsed:.2f}s, "
+                  f"{delivered / elapsed:,.0f} events/s")
+        return
+
+    p50, p99 = bench_payload(min(args.events, 20000))
+    print(f"event payload on save: p50 {p50:.1f} us, p99 {p99:.1f} us")
+
+    events = make_events(args.events)
+    directory = tempfile.mkdtemp(prefix="bench_change_feed_")
+    receiver = change_feed.ReceiverServer(('127.0.0.1', 0), report=None)
+    threading.Thread(target=receiver.serve_forever, daemon=True).start()
+
+    print(f"{args.events} events, batch {args.batch}")
+    print(f"{'format':6s} {'sink':8s} {'events/s':>12s} {'MB/s':>8s} {'bytes/event':>12s}")
+    for fmt in args.formats:
+        size = sum(len(change_feed.ENCODERS[fmt](event)) for event in events[:1000]) / min(len(events), 1000)
+        for kind in args.sinks:
+            feed = MemoryFeed(events, args.batch)
+            sink = open_bench_sink(kind, directory, receiver)
+            started = time.perf_counter()
+            delivered, _ = change_feed.run_feed(feed, sink, 0, consumer='bench', fmt=fmt, prefetch=args.prefetch)
+            sink.close()
+            elapsed = time.perf_counter() - started
+            assert delivered == len(events) and feed.saved == len(events)
+            print(f"{fmt:6s} {kind:8s} {delivered / elapsed:12,.0f} {delivered * size / elapsed / 1e6:8.1f} "
+                  f"{size:12.0f}")
+
+    feed = MemoryFeed(events[:args.batch * 20], args.batch)
+    sink = SlowSink(feed, 0.02)
+    change_feed.run_feed(feed, sink, 0, prefetch=args.prefetch)
+    print(f"slow sink: reader at most {max(sink.lead)} batches ahead (prefetch {args.prefetch})")
+    receiver.shutdown()
+    receiver.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,47 @@
+"""Label render time with cold and warm font registry
+
+    python benchmarks/bench_label_fonts.py
+
+"Cold" clears the font registry before every render, which is what each
+render used to pay when it called ImageFont.truetype() itself. The barcode
+strip is cached for both runs so only font loading differs.
+"""
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import fonts
+import labels
+
+PATIENT = {
+    'title': 'Mr.', 'full_name': 'Nimal Perera', 'address_line1': '12 Main Street, Kegalle',
+    'contact_numbers': '0771234567', 'phn': 'PHN-1250-2401011200-1234',
+}
+ROUNDS = 30
+
+
+def time_renders(cold):
+    samples = []
+    for _ in range(ROUNDS):
+        if cold:
+            fonts.get_font.cache_clear()
+            fonts.resolve_font_path.cache_clear()
+        start = time.perf_counter()
+        labels.generate_label_image(PATIENT)
+        samples.append((time.perf_counter() - start) * 1000)
+    return samples
+
+
+def main():
+    print(f"fonts: bold={fonts.resolve_font_path('bold')} regular={fonts.resolve_font_path('regular')}")
+    labels.generate_barcode(PATIENT)
+    for label, cold in (("cold fonts", True), ("warm fonts", False)):
+        samples = time_renders(cold)
+        print(f"{label:12s} median {statistics.median(samples):7.2f} ms   min {min(samples):7.2f} ms")
+
+
+if __name__ == "__main__":
+    main()
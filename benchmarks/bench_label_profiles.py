@@ -0,0 +1,91 @@
+"""Label render time, memory and PNG size per render profile (LABEL_PROFILE)
+
+    python benchmarks/bench_label_profiles.py
+    python benchmarks/bench_label_profiles.py --profiles 600-rgb 203-mono 300-mono --duration 5
+
+Each profile runs in its own process (the profile is fixed at import), with
+the barcode cache cleared before every render so each iteration draws the
+whole label. Canvas MB is Pillow's in-memory size of one label image.
+"""
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from bench_search import percentile
+
+DEFAULT_PROFILES = ['600-rgb', '600-gray', '600-mono', '300-gray', '300-mono', '203-mono']
+BYTES_PER_PIXEL = {'RGB': 4, 'L': 1, '1': 1}  # Pillow stores RGB pixels in 4 bytes
+
+
+def label_patient(n):
+    return {'title': 'Mr.', 'full_name': f"Nimal Perera {n}", 'address_line1': "12 Main Street, Kegalle",
+            'contact_numbers': "0771234567", 'phn': f"PHN-1250-{n:09d}-0"}
+
+
+def run_profile(duration):
+    """Child process: measure the profile in LABEL_PROFILE and print the result as JSON"""
+    import labels
+
+    labels.generate_label_image(label_patient(0))  # load fonts
+    rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    render_ms, encode_ms, png_sizes = [], [], []
+    deadline = time.perf_counter() + duration
+    while time.perf_counter() < deadline or len(render_ms) < 5:
+        labels.barcode_cache.clear()
+        started = time.perf_counter()
+        img = labels.generate_label_image(label_patient(len(render_ms)), with_timestamp=False)
+        rendered = time.perf_counter()
+        png_sizes.append(len(labels.encode_png(img)))
+        render_ms.append((rendered - started) * 1000)
+        encode_ms.append((time.perf_counter() - rendered) * 1000)
+
+    print(json.dumps({
+        'profile': os.environ['LABEL_PROFILE'], 'size': list(img.size), 'mode': img.mode, 'n': len(render_ms),
+        'canvas_mb': img.width * img.height * BYTES_PER_PIXEL[img.mode] / 1024 ** 2,
+        'peak_growth_mb': (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - rss_before) / 1024,
+        'render_p50_ms': percentile(render_ms, 50), 'encode_p50_ms': percentile(encode_ms, 50),
+        'png_kb': sum(png_sizes) / len(png_sizes) / 1024,
+    }))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--profiles", nargs="+", default=DEFAULT_PROFILES)
+    parser.add_argument("--duration", type=float, default=3.0, help="seconds per profile")
+    parser.add_argument("--out", help="write results JSON here")
+    parser.add_argument("--run-profile", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run_profile:
+        run_profile(args.duration)
+        return
+
+    results = []
+    print(f"{'profile':10s} {'pixels':>11s} {'canvas MB':>10s} {'render ms':>10s} {'encode ms':>10s} "
+          f"{'labels/s':>9s} {'PNG KB':>8s}")
+    for profile in args.profiles:
+        output = subprocess.run(
+            [sys.executable, __file__, "--run-profile", "--duration", str(args.duration)],
+            env=dict(os.environ, LABEL_PROFILE=profile), check=True, capture_output=True, text=True
+        ).stdout
+        result = json.loads(output.strip().splitlines()[-1])
+        results.append(result)
+        per_label = result['render_p50_ms'] + result['encode_p50_ms']
+        print(f"{profile:10s} {result['size'][0]:5d}x{result['size'][1]:<5d} {result['canvas_mb']:10.2f} "
+              f"{result['render_p50_ms']:10.2f} {result['encode_p50_ms']:10.2f} {1000 / per_label:9.1f} "
+              f"{result['png_kb']:8.1f}")
+
+    if args.out:
+        with open(args.out, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+"""Render time per label template, with the static layer pre-drawn
+
+    python benchmarks/bench_label_templates.py
+    LABEL_PROFILE=203-mono python benchmarks/bench_label_templates.py --duration 5
+
+For each template in label_templates: the one-off compile time (fonts,
+geometry, base layer), then the per-label render and PNG encode time with
+the barcode cache cleared before every render, so each iteration measures a
+first print. Long names and addresses are mixed in so width fitting is
+exercised.
+"""
+import argparse
+import datetime
+import os
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import labels
+from bench_search import percentile
+from label_templates import TEMPLATES
+from settings import LABEL_PROFILE
+
+
+def label_patient(n):
+    long_name = n % 4 == 0
+    return {
+        'title': 'Mr.', 'gender': 'Male', 'birthday': datetime.date(1980, 1, 1) + datetime.timedelta(days=n),
+        'full_name': "Wickramasinghe Mudiyanselage Ranasinghe Bandara" if long_name else f"Nimal Perera {n}",
+        'address_line1': "No. 1234/5A, Sri Jayawardenepura Kotte Road, Battaramulla" if long_name else "12 Main Street",
+        'contact_numbers': "0771234567", 'phn': f"PHN-1250-{n:09d}-0",
+    }
+
+
+def bench(template, duration):
+    started = time.perf_counter()
+    compiled = labels.get_template(template)
+    compile_ms = (time.perf_counter() - started) * 1000
+
+    render_ms, encode_ms = [], []
+    deadline = time.perf_counter() + duration
+    while time.perf_counter() < deadline or len(render_ms) < 5:
+        labels.barcode_cache.clear()
+        started = time.perf_counter()
+        img = labels.generate_label_image(label_patient(len(render_ms)), with_timestamp=True, template=template)
+        rendered = time.perf_counter()
+        labels.encode_png(img)
+        render_ms.append((rendered - started) * 1000)
+        encode_ms.append((time.perf_counter() - rendered) * 1000)
+    return compiled, compile_ms, render_ms, encode_ms
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--templates", nargs="+", choices=sorted(TEMPLATES), default=list(TEMPLATES))
+    parser.add_argument("--duration", type=float, default=3.0, help="seconds per template")
+    args = parser.parse_args()
+
+    print(f"profile {LABEL_PROFILE}")
+    print(f"{'template':10s} {'pixels':>11s} {'compile ms':>11s} {'render p50':>11s} {'render p99':>11s} "
+          f"{'encode p50':>11s} {'labels/s':>9s}")
+    for template in args.templates:
+        compiled, compile_ms, render_ms, encode_ms = bench(template, args.duration)
+        per_label = percentile(render_ms, 50) + percentile(encode_ms, 50)
+        print(f"{template:10s} {compiled.width:5d}x{compiled.height:<5d} {compile_ms:11.1f} "
+              f"{percentile(render_ms, 50):11.2f} {percentile(render_ms, 99):11.2f} "
+              f"{percentile(encode_ms, 50):11.2f} {1000 / per_label:9.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+"""Label throughput of the shared worker pool as worker processes are added
+
+Starts label_worker.py locally with 1, 2, 4... processes and drives it from
+several client threads (standing in for app replicas), each rendering
+distinct patients so every request is a cache miss:
+
+    python benchmarks/bench_label_workers.py --workers 1 2 4 --clients 8 --duration 10
+
+Rendering is CPU-bound, so throughput can only scale up to the number of
+cores on this machine; the core count is printed with the results.
+"""
+import argparse
+import http.client
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from bench_search import percentile
+
+
+def wait_until_ready(port, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            conn = http.client.HTTPConnection('127.0.0.1', port, timeout=1)
+            conn.request('GET', '/health')
+            if conn.getresponse().status == 200:
+                return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError(f"label worker on port {port} did not start")
+
+
+def client(port, client_id, deadline, latencies):
+    conn = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+    serial = 0
+    while time.monotonic() < deadline:
+        serial += 1
+        body = json.dumps({
+            'phn': f"PHN-1250-{client_id:03d}{serial:06d}-0", 'title': 'Mr.',
+            'full_name': f"Bench Patient {client_id} {serial}", 'address_line1': "No. 12, Main Street",
+            'contact_numbers': "0771234567",
+        })
+        started = time.perf_counter()
+        conn.request('POST', '/label', body, {'Content-Type': 'application/json'})
+        response = conn.getresponse()
+        response.read()
+        if response.status != 200:
+            raise RuntimeError(f"worker answered {response.status}")
+        latencies.append((time.perf_counter() - started) * 1000)
+
+
+def run(workers, clients, duration, port):
+    env = dict(os.environ, LABEL_WORKER_URL='')
+    server = subprocess.Popen(
+        [sys.executable, os.path.join(ROOT, 'label_worker.py'), '--port', str(port), '--workers', str(workers)],
+        cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    try:
+        wait_until_ready(port)
+        latencies = []
+        deadline = time.monotonic() + duration
+        threads = [threading.Thread(target=client, args=(port, n, deadline, latencies)) for n in range(clients)]
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - started
+    finally:
+        server.terminate()
+        server.wait()
+    return len(latencies) / elapsed, percentile(latencies, 50), percentile(latencies, 99)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--workers", type=int, nargs='+', default=[1, 2, 4])
+    parser.add_argument("--clients", type=int, default=8, help="concurrent client threads (replicas)")
+    parser.add_argument("--duration", type=float, default=10.0, help="seconds per worker count")
+    parser.add_argument("--port", type=int, default=8790)
+    args = parser.parse_args()
+
+    print(f"{os.cpu_count()} CPU cores, {args.clients} clients, {args.duration:.0f}s per run")
+    print(f"{'workers':>8s} {'labels/s':>10s} {'speedup':>8s} {'p50 ms':>8s} {'p99 ms':>8s}")
+    base = None
+    for workers in args.workers:
+        throughput, p50, p99 = run(workers, args.clients, args.duration, args.port)
+        base = base or throughput
+        print(f"{workers:8d} {throughput:10.1f} {throughput / base:7.2f}x {p50:8.1f} {p99:8.1f}")
+
+
+if __name__ == "__main__":
+    main()
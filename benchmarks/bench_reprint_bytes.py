@@ -0,0 +1,73 @@
+"""Bytes sent to the browser per label reprint: base64-inlined vs cached media URL
+
+    python benchmarks/bench_reprint_bytes.py --patients 20 --reprints 5
+
+Before: every reprint sends the label PNG as a Streamlit media file for the
+preview, the same PNG again as base64 inside the print component, and the
+PNG a third time if the download button is used. After: the print component
+carries only the media URL; the browser fetches the PNG once per patient
+from the API and answers later reprints from its cache (or a 304 when it
+revalidates). Sizes come from real renders of the configured label layout.
+"""
+import argparse
+import base64
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from label_media import print_controls_html
+from labels import get_label_png
+
+MEDIA_BASE = "https://registration.example/api"
+
+
+def label_patient(n):
+    return {'title': 'Mrs.', 'full_name': f"Kumari Wijesinghe {n}", 'address_line1': "45 Temple Road, Kegalle",
+            'contact_numbers': "0712345678", 'phn': f"PHN-1250-{n:09d}-0"}
+
+
+def timestamp_html(timestamp_top):
+    if timestamp_top is None:
+        return ""
+    return f'<div class="timestamp" style="top: {timestamp_top * 100:.2f}%;">2026-01-01 09:00:00</div>'
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--patients", type=int, default=20)
+    parser.add_argument("--reprints", type=int, default=5, help="reprints per patient")
+    parser.add_argument("--no-download", action="store_true", help="assume the download button is never used")
+    args = parser.parse_args()
+
+    before = {'websocket': 0, 'http': 0}
+    after = {'websocket': 0, 'http': 0}
+    png_total = 0
+    for n in range(args.patients):
+        patient = label_patient(n)
+        png_bytes, timestamp_top = get_label_png(patient)
+        png_total += len(png_bytes)
+        data_uri = "data:image/png;base64," + base64.b64encode(png_bytes).decode()
+        url = f"{MEDIA_BASE}/media/label/{patient['phn']}/{'0' * 32}.png"
+        inline_html = print_controls_html(patient['phn'], data_uri, timestamp_html(timestamp_top))
+        url_html = print_controls_html(patient['phn'], url, timestamp_html(timestamp_top), download=True)
+        for reprint in range(args.reprints):
+            before['websocket'] += len(inline_html)
+            before['http'] += len(png_bytes) * (1 if args.no_download else 2)  # preview (+ download)
+            after['websocket'] += len(url_html)
+            if reprint == 0:
+                after['http'] += len(png_bytes)  # first fetch; preview, print and download share it
+
+    reprints = args.patients * args.reprints
+    print(f"{args.patients} patients x {args.reprints} reprints, mean label PNG {png_total / args.patients / 1024:.1f} KiB")
+    print(f"{'':8s} {'websocket':>12s} {'http':>12s} {'total':>12s}   (bytes per reprint)")
+    for name, totals in (('before', before), ('after', after)):
+        print(f"{name:8s} {totals['websocket'] / reprints:12.0f} {totals['http'] / reprints:12.0f} "
+              f"{(totals['websocket'] + totals['http']) / reprints:12.0f}")
+    saved = 1 - (after['websocket'] + after['http']) / (before['websocket'] + before['http'])
+    print(f"reduction {saved:.1%}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,140 @@
+"""EXPLAIN plans, latency and table size before/after the schema overhaul (migration 6)
+
+Builds a throwaway database at schema version 5, seeds it with synthetic
+patients, records plans and timings for the real query patterns, applies
+migration 6 and measures again:
+
+    python benchmarks/bench_schema.py --rows 1000000
+
+The database is dropped and recreated on every run; the live database is
+never touched.
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import mysql.connector
+
+from bench_search import DISTRICTS, FIRST_NAMES, percentile, seed
+from migrations import LATEST_VERSION, connect_server, migrate
+from patient_search import SEARCH_COLUMNS, SEARCH_PAGE_SIZE, search_patients
+from settings import DB_CONFIG
+
+SCHEMA_BENCH_DB = 'digital_health_schema_bench'
+BEFORE_VERSION = 5
+
+COLUMNS = ', '.join(SEARCH_COLUMNS)
+PAGE = f"ORDER BY full_name, id LIMIT {SEARCH_PAGE_SIZE + 1}"
+
+# label -> (query before migration 6, query after), both taking query_params()
+QUERIES = {
+    "District + birthday": (
+        f"SELECT {COLUMNS} FROM patients WHERE district = %s AND birthday = %s {PAGE}",
+        f"SELECT {COLUMNS} FROM patients WHERE district = %s AND birthday = %s {PAGE}",
+    ),
+    "Contact number": (
+        f"SELECT {COLUMNS} FROM patients WHERE contact_numbers LIKE %s {PAGE}",
+        f"SELECT {COLUMNS} FROM patients WHERE id IN "
+        f"(SELECT patient_id FROM patient_contacts WHERE contact_number = %s) {PAGE}",
+    ),
+    "Name prefix (unchanged)": (
+        f"SELECT {COLUMNS} FROM patients WHERE full_name LIKE %s {PAGE}",
+        f"SELECT {COLUMNS} FROM patients WHERE full_name LIKE %s {PAGE}",
+    ),
+}
+
+
+def query_params(label, rng, rows, after):
+    n = rng.randrange(rows)
+    if label == "District + birthday":
+        return (rng.choice(DISTRICTS), f"{1940 + n % 80}-{1 + n % 12:02d}-{1 + n % 28:02d}")
+    if label == "Contact number":
+        number = f"07{n % 100000000:08d}"
+        return (number,) if after else (f"%{number}%",)
+    return (rng.choice(FIRST_NAMES)[:3] + '%',)
+
+
+def explain(cursor, query, params):
+    cursor.execute("EXPLAIN " + query, params)
+    columns = [column[0] for column in cursor.description]
+    return [dict(zip(columns, row)) for row in cursor.fetchall()]
+
+
+def table_size_mb(cursor):
+    cursor.execute(
+        "SELECT table_name, (data_length + index_length) / 1048576 FROM information_schema.tables "
+        "WHERE table_schema = %s ORDER BY table_name", (SCHEMA_BENCH_DB,)
+    )
+    return {name: float(size) for name, size in cursor.fetchall()}
+
+
+def measure(conn, rows, queries, after):
+    cursor = conn.cursor()
+    stage = "after" if after else "before"
+    rng = random.Random(rows)
+    for label, pair in QUERIES.items():
+        query = pair[1] if after else pair[0]
+        print(f"\n  [{stage}] {label}")
+        for plan in explain(cursor, query, query_params(label, rng, rows, after)):
+            print(f"    {plan['table']:18s} type={plan['type']!s:8s} key={plan['key']!s:32s} "
+                  f"rows={plan['rows']!s:>9s}  {plan['Extra'] or ''}")
+
+        samples = []
+        for _ in range(queries):
+            params = query_params(label, rng, rows, after)
+            start = time.perf_counter()
+            cursor.execute(query, params)
+            cursor.fetchall()
+            samples.append((time.perf_counter() - start) * 1000)
+        print(f"    p50 {statistics.median(samples):8.2f} ms   p99 {percentile(samples, 99):8.2f} ms   (n={queries})")
+
+    for table, size in table_size_mb(cursor).items():
+        print(f"  [{stage}] {table:24s} {size:10.1f} MB")
+    cursor.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=1000000)
+    parser.add_argument("--queries", type=int, default=100, help="timed queries per pattern and stage")
+    args = parser.parse_args()
+
+    server = connect_server()
+    try:
+        server.cursor().execute(f"DROP DATABASE IF EXISTS `{SCHEMA_BENCH_DB}`")
+        migrate(server, target=BEFORE_VERSION, database=SCHEMA_BENCH_DB)
+    finally:
+        server.close()
+
+    conn = mysql.connector.connect(**dict(DB_CONFIG, database=SCHEMA_BENCH_DB))
+    try:
+        seed(conn, args.rows)
+        measure(conn, args.rows, args.queries, after=False)
+
+        start = time.perf_counter()
+        migrate(conn, target=LATEST_VERSION, database=SCHEMA_BENCH_DB)
+        print(f"\n  migration 6 on {args.rows:,} rows took {time.perf_counter() - start:.1f}s")
+        cursor = conn.cursor()
+        cursor.execute("ANALYZE TABLE patients, patient_contacts")
+        cursor.fetchall()
+        cursor.close()
+
+        measure(conn, args.rows, args.queries, after=True)
+
+        # The app's own search path for the new lookup
+        rng = random.Random(1)
+        start = time.perf_counter()
+        for _ in range(args.queries):
+            search_patients(conn, "Contact", f"07{rng.randrange(args.rows) % 100000000:08d}")
+        print(f"\n  search_patients('Contact') mean {(time.perf_counter() - start) * 1000 / args.queries:.2f} ms")
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,123 @@
+"""Latency benchmark for Reprint tab searches at 1M and 10M patients
+
+Seeds a separate benchmark database (never the live one) with synthetic
+patients, then reports p50/p99 latency for each search type:
+
+    python benchmarks/bench_search.py --rows 1000000 10000000
+
+Seeding is incremental, so running a larger scale reuses the rows already
+inserted for a smaller one.
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import mysql.connector
+
+from migrations import connect_server, migrate
+from patient_search import search_patients
+from settings import DB_CONFIG
+
+BENCH_DB = 'digital_health_bench'
+SEED_BATCH = 5000
+
+FIRST_NAMES = ["Nimal", "Kamal", "Sunil", "Ruwan", "Chamara", "Saman", "Nuwan", "Kasun",
+               "Dilani", "Nadeesha", "Chathuri", "Ishara", "Malsha", "Tharushi", "Kumari", "Anoma"]
+LAST_NAMES = ["Perera", "Fernando", "Silva", "Jayasinghe", "Bandara", "Wickramasinghe",
+              "Rajapaksa", "Dissanayake", "Herath", "Gunawardena", "Senanayake", "Kumara"]
+DISTRICTS = ["Kegalle", "Gampaha", "Kalutara", "Kandy", "Galle", "Matara", "Colombo", "Ratnapura"]
+
+
+def synthetic_patient(n):
+    rng = random.Random(n)
+    full_name = f"{rng.choice(FIRST_NAMES)} {rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}"
+    return (
+        'Mr.', full_name, rng.choice(LAST_NAMES), 'Male', f"{n % 500} Main Street",
+        rng.choice(DISTRICTS), f"{1940 + n % 80}-{1 + n % 12:02d}-{1 + n % 28:02d}",
+        f"{200000000000 + n}", f"PHN-1250-BENCH-{n:09d}", f"07{n % 100000000:08d}",
+    )
+
+
+def seed(conn, rows):
+    cursor = conn.cursor()
+    cursor.execute("SELECT COUNT(*) FROM patients")
+    existing = cursor.fetchone()[0]
+    columns = "(title, full_name, other_names, gender, address_line1, district, birthday, nic, phn, contact_numbers)"
+    placeholders = "(%s, %s, %s, %s, %s, %s, %s, %s, %s, %s)"
+
+    for start in range(existing, rows, SEED_BATCH):
+        batch = [synthetic_patient(n) for n in range(start, min(start + SEED_BATCH, rows))]
+        values = ", ".join([placeholders] * len(batch))
+        cursor.execute(f"INSERT INTO patients {columns} VALUES {values}",
+                       [field for row in batch for field in row])
+        conn.commit()
+        print(f"\r  seeded {start + len(batch):,}/{rows:,}", end="", flush=True)
+    if existing < rows:
+        print()
+        cursor.execute("ANALYZE TABLE patients")
+        cursor.fetchall()
+
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+def time_search(conn, search_by, terms, pages=1):
+    samples = []
+    for term in terms:
+        after = None
+        for _ in range(pages):
+            start = time.perf_counter()
+            _, after = search_patients(conn, search_by, term, after=after)
+            samples.append((time.perf_counter() - start) * 1000)
+            if after is None:
+                break
+    return samples
+
+
+def run(rows, queries):
+    conn = mysql.connector.connect(**dict(DB_CONFIG, database=BENCH_DB))
+    try:
+        seed(conn, rows)
+        rng = random.Random(rows)
+        cases = {
+            "PHN exact": ("PHN", [f"PHN-1250-BENCH-{rng.randrange(rows):09d}" for _ in range(queries)], 1),
+            "NIC exact": ("NIC", [f"{200000000000 + rng.randrange(rows)}" for _ in range(queries)], 1),
+            "Name prefix (2 chars)": ("Name", [rng.choice(FIRST_NAMES)[:2] for _ in range(queries)], 1),
+            "Name full-text": ("Name", [f"{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}"
+                                        for _ in range(queries)], 1),
+            "Name full-text, pages 1-10": ("Name", [rng.choice(LAST_NAMES) for _ in range(queries // 10 or 1)], 10),
+        }
+        print(f"\n{rows:,} patients")
+        for label, (search_by, terms, pages) in cases.items():
+            samples = time_search(conn, search_by, terms, pages)
+            print(f"  {label:28s} p50 {statistics.median(samples):8.2f} ms"
+                  f"   p99 {percentile(samples, 99):8.2f} ms   (n={len(samples)})")
+    finally:
+        conn.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, nargs="+", default=[1000000, 10000000])
+    parser.add_argument("--queries", type=int, default=200, help="queries per search type")
+    args = parser.parse_args()
+
+    server = connect_server()
+    try:
+        migrate(server, database=BENCH_DB)
+    finally:
+        server.close()
+
+    for rows in sorted(args.rows):
+        run(rows, args.queries)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+"""Load test for the JSON API: keep-alive clients hammering one endpoint
+
+Start the API (python api.py --workers 4), then:
+
+    python benchmarks/load_test_api.py --path /patients/PHN-1250-000000001-8 --concurrency 64 --duration 10
+    python benchmarks/load_test_api.py --method POST --path /patients/lookup --body '{"phns": ["..."]}'
+
+Each client is one HTTP/1.1 keep-alive connection sending requests back to
+back; the report gives throughput, latency percentiles and status counts.
+"""
+import argparse
+import asyncio
+import collections
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bench_search import percentile
+
+
+async def read_response(reader):
+    status_line = await reader.readline()
+    if not status_line:
+        raise ConnectionError("server closed the connection")
+    status = int(status_line.split()[1])
+    length, chunked = 0, False
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b''):
+            break
+        name, _, value = line.decode('latin-1').partition(':')
+        name = name.strip().lower()
+        if name == 'content-length':
+            length = int(value)
+        elif name == 'transfer-encoding' and 'chunked' in value.lower():
+            chunked = True
+    if chunked:
+        while True:
+            size = int((await reader.readline()).split(b';')[0], 16)
+            await reader.readexactly(size + 2)
+            if size == 0:
+                break
+    else:
+        await reader.readexactly(length)
+    return status
+
+
+async def client(args, request, deadline, latencies, statuses):
+    reader, writer = await asyncio.open_connection(args.host, args.port)
+    try:
+        while time.perf_counter() < deadline:
+            started = time.perf_counter()
+            writer.write(request)
+            status = await read_response(reader)
+            latencies.append((time.perf_counter() - started) * 1000)
+            statuses[status] += 1
+    finally:
+        writer.close()
+
+
+def build_request(args):
+    body = args.body.encode() if args.body else b''
+    headers = [f"{args.method} {args.path} HTTP/1.1", f"Host: {args.host}:{args.port}",
+               f"Content-Length: {len(body)}", "Content-Type: application/json"]
+    if args.token:
+        headers.append(f"Authorization: Bearer {args.token}")
+    return ("\r\n".join(headers) + "\r\n\r\n").encode() + body
+
+
+async def run(args):
+    request = build_request(args)
+    latencies, statuses = [], collections.Counter()
+    started = time.perf_counter()
+    deadline = started + args.duration
+    await asyncio.gather(*(client(args, request, deadline, latencies, statuses) for _ in range(args.concurrency)))
+    elapsed = time.perf_counter() - started
+
+    print(f"{args.method} {args.path}  concurrency={args.concurrency}  {elapsed:.1f}s")
+    print(f"  requests   {len(latencies):10d}")
+    print(f"  req/s      {len(latencies) / elapsed:10.1f}")
+    for pct in (50, 95, 99):
+        print(f"  p{pct:<9d} {percentile(latencies, pct):10.2f} ms")
+    print(f"  statuses   {dict(statuses)}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8600)
+    parser.add_argument("--method", default="GET")
+    parser.add_argument("--path", default="/health")
+    parser.add_argument("--body", default="", help="JSON request body")
+    parser.add_argument("--token", default=os.environ.get('API_TOKEN', ''))
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--duration", type=float, default=10.0, help="seconds")
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+"""Stress test: issue 100k PHNs from many processes and threads, expect zero collisions
+
+    python benchmarks/stress_phn.py                    # SQLite-backed sequence
+    python benchmarks/stress_phn.py --mysql            # id_sequences in MySQL
+
+Every process runs its own PHNAllocator (as each app server process does)
+with several threads drawing from it. The script fails if any PHN repeats
+or has a bad check digit.
+"""
+import argparse
+import multiprocessing
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from phn import PHNAllocator, is_valid_phn, reserve_phn_block
+
+
+def sqlite_reserver(path):
+    conn = sqlite3.connect(path, timeout=60, isolation_level=None, check_same_thread=False)
+
+    def reserve(size):
+        conn.execute("BEGIN IMMEDIATE")
+        (start,) = conn.execute("SELECT next_value FROM id_sequences WHERE name = 'phn'").fetchone()
+        conn.execute("UPDATE id_sequences SET next_value = ? WHERE name = 'phn'", (start + size,))
+        conn.execute("COMMIT")
+        return start
+    return reserve
+
+
+def mysql_reserver():
+    import mysql.connector
+    from settings import DB_CONFIG
+    conn = mysql.connector.connect(**DB_CONFIG)
+    return lambda size: reserve_phn_block(conn, size)
+
+
+def worker(args):
+    count, threads, block_size, sqlite_path = args
+    reserve = sqlite_reserver(sqlite_path) if sqlite_path else mysql_reserver()
+    allocator = PHNAllocator(reserve, block_size=block_size)
+    per_thread = count // threads
+    with ThreadPoolExecutor(threads) as pool:
+        batches = pool.map(lambda _: [allocator.next_phn() for _ in range(per_thread)], range(threads))
+        phns = [phn for batch in batches for phn in batch]
+    return phns, allocator.blocks_reserved
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--total", type=int, default=100000)
+    parser.add_argument("--processes", type=int, default=8)
+    parser.add_argument("--threads", type=int, default=4)
+    parser.add_argument("--block-size", type=int, default=50)
+    parser.add_argument("--mysql", action="store_true")
+    args = parser.parse_args()
+
+    sqlite_path = None
+    if not args.mysql:
+        sqlite_path = os.path.join(tempfile.mkdtemp(), "phn_sequence.db")
+        conn = sqlite3.connect(sqlite_path)
+        conn.execute("CREATE TABLE id_sequences (name TEXT PRIMARY KEY, next_value INTEGER NOT NULL)")
+        conn.execute("INSERT INTO id_sequences VALUES ('phn', 1)")
+        conn.commit()
+        conn.close()
+
+    per_process = args.total // args.processes
+    jobs = [(per_process, args.threads, args.block_size, sqlite_path)] * args.processes
+
+    start = time.perf_counter()
+    with multiprocessing.get_context('spawn').Pool(args.processes) as pool:
+        results = pool.map(worker, jobs)
+    elapsed = time.perf_counter() - start
+
+    phns = [phn for batch, _ in results for phn in batch]
+    blocks = sum(blocks for _, blocks in results)
+    duplicates = len(phns) - len(set(phns))
+    invalid = sum(1 for phn in phns if not is_valid_phn(phn))
+
+    print(f"issued     {len(phns):,} PHNs from {args.processes} processes x {args.threads} threads")
+    print(f"elapsed    {elapsed:.2f} s ({len(phns) / elapsed:,.0f} PHNs/s incl. process start)")
+    print(f"blocks     {blocks:,} reservations (1 per {len(phns) / blocks:.0f} PHNs)")
+    print(f"duplicates {duplicates}")
+    print(f"invalid    {invalid}")
+    return 1 if duplicates or invalid else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,357 @@
+"""Benchmark suite: registration, search and label generation, with a regression check
+
+Runs every case in its own subprocess (so peak memory is per case) and
+writes machine-readable results:
+
+    python benchmarks/suite.py --out results.json                     # everything, 10k and 100k patients
+    python benchmarks/suite.py --scales 10000 1000000 --out results.json
+    python benchmarks/suite.py --no-db --out results.json             # label/barcode cases only
+    python benchmarks/suite.py --baseline benchmarks/baseline.json --save-baseline
+
+Database cases use a separate database (digital_health_suite, never the live
+one) seeded with synthetic patients up to each scale. With --baseline, any
+case whose p50 latency or peak memory grew, or whose throughput fell, by
+more than --tolerance is reported and the exit status is 1.
+"""
+import argparse
+import base64
+import json
+import os
+import platform
+import random
+import resource
+import subprocess
+import sys
+import time
+from datetime import datetime
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import mysql.connector
+
+import change_feed
+import labels
+from bench_search import FIRST_NAMES, percentile, seed, synthetic_patient
+from label_templates import TEMPLATES
+from metrics import span
+from migrations import connect_server, migrate
+from patient_search import search_patients
+from patients import index_all_contact_numbers, normalize_patient
+from phn import PHNAllocator, reserve_phn_block
+from services import write_patient
+from settings import DB_CONFIG
+
+SUITE_DB = 'digital_health_suite'
+SUITE_PHN_PREFIX = 'PHN-1250-SUITE-'
+
+CASES = {}  # name -> (needs_db, setup); setup(conn, rows, rng) returns (op(i), cleanup or None)
+
+
+def case(name, db=False):
+    def register(setup):
+        CASES[name] = (db, setup)
+        return setup
+    return register
+
+
+def label_patient(n):
+    return {'title': 'Mr.', 'full_name': f"Nimal Perera {n}", 'address_line1': "12 Main Street, Kegalle",
+            'contact_numbers': "0771234567", 'phn': f"PHN-1250-{n:09d}-0"}
+
+
+@case("generate_barcode")
+def setup_barcode(conn, rows, rng):
+    def op(i):
+        labels.barcode_cache.clear()
+        labels.generate_barcode(label_patient(i))
+    return op, None
+
+
+@case("generate_label_image")
+def setup_label_image(conn, rows, rng):
+    def op(i):
+        labels.barcode_cache.clear()
+        labels.generate_label_image(label_patient(i))
+    return op, None
+
+
+def template_case(template):
+    @case(f"label_template_{template}")
+    def setup(conn, rows, rng):
+        labels.get_template(template)  # compile outside the timed loop
+
+        def op(i):
+            labels.barcode_cache.clear()
+            labels.generate_label_image(dict(label_patient(i), birthday='1980-01-01', gender='Male'), template=template)
+        return op, None
+
+
+for template_name in TEMPLATES:
+    template_case(template_name)
+
+
+@case("print_encode")
+def setup_print_encode(conn, rows, rng):
+    """What print_barcode_web does with a rendered label: 600 DPI PNG, then base64 for the print page"""
+    img = labels.generate_label_image(label_patient(0))
+
+    def op(i):
+        base64.b64encode(labels.encode_png(img)).decode()
+    return op, None
+
+
+@case("label_png_cached")
+def setup_label_png_cached(conn, rows, rng):
+    patients = [label_patient(n) for n in range(20)]
+    for patient in patients:
+        labels.get_label_png(patient)
+
+    def op(i):
+        labels.get_label_png(patients[i % len(patients)])
+    return op, None
+
+
+@case("metrics_span_x1000")
+def setup_metrics_span(conn, rows, rng):
+    """Instrumentation overhead: 1000 empty spans per iteration (so p50 in ms = microseconds per span)"""
+    def op(i):
+        for _ in range(1000):
+            with span("suite.empty"):
+                pass
+    return op, None
+
+
+@case("change_feed_encode_x500")
+def setup_change_feed_encode(conn, rows, rng):
+    """One change-feed batch: build 500 event payloads as the save path does, then encode them as JSON lines"""
+    patients = [normalize_patient(dict(label_patient(n), gender='Male', birthday='1980-01-01')) for n in range(500)]
+
+    def op(i):
+        b''.join(change_feed.encode_jsonl((n, 'created', '2026-01-01T00:00:00.000+00:00',
+                                            change_feed.patient_event(n, patient)))
+                 for n, patient in enumerate(patients, 1))
+    return op, None
+
+
+@case("generate_phn", db=True)
+def setup_generate_phn(conn, rows, rng):
+    allocator = PHNAllocator(lambda size: reserve_phn_block(conn, size))
+
+    def op(i):
+        allocator.next_phn()
+    return op, None
+
+
+@case("insert_patient", db=True)
+def setup_insert(conn, rows, rng):
+    cursor = conn.cursor()
+
+    def op(i):
+        patient = normalize_patient({
+            'title': 'Mr.', 'full_name': f"Suite Patient {i}", 'gender': 'Male', 'address_line1': "1 Main Street",
+            'district': 'Kegalle', 'province': 'Sabaragamuwa', 'birthday': '1990-01-01',
+            'phn': f"{SUITE_PHN_PREFIX}{i:09d}", 'contact_numbers': f"07{rng.randrange(10 ** 8):08d}",
+        })
+        write_patient(cursor, patient)
+        conn.commit()
+
+    def cleanup():
+        cursor.execute("DELETE FROM patients WHERE phn LIKE %s", (SUITE_PHN_PREFIX + '%',))
+        cursor.execute(
+            "DELETE e FROM patient_events e LEFT JOIN patients p ON p.id = e.patient_id WHERE p.id IS NULL"
+        )
+        conn.commit()
+    return op, cleanup
+
+
+def search_case(name, search_by, term):
+    @case(name, db=True)
+    def setup(conn, rows, rng):
+        def op(i):
+            search_patients(conn, search_by, term(rng, rows))
+        return op, None
+
+
+search_case("search_phn", "PHN", lambda rng, rows: synthetic_patient(rng.randrange(rows))[8])
+search_case("search_nic", "NIC", lambda rng, rows: synthetic_patient(rng.randrange(rows))[7])
+search_case("search_name_prefix", "Name", lambda rng, rows: rng.choice(FIRST_NAMES)[:3])
+search_case("search_contact", "Contact", lambda rng, rows: synthetic_patient(rng.randrange(rows))[9])
+
+
+def rss_mb():
+    with open('/proc/self/statm') as f:
+        return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 1024 ** 2
+
+
+def run_case(name, rows, iterations, duration, warmup):
+    """Child process: time one case and print its result as JSON"""
+    needs_db, setup = CASES[name]
+    conn = mysql.connector.connect(**dict(DB_CONFIG, database=SUITE_DB)) if needs_db else None
+    try:
+        op, cleanup = setup(conn, rows, random.Random(rows or 0))
+        for i in range(warmup):
+            op(i)
+        rss_before = rss_mb()
+        samples = []
+        started = time.perf_counter()
+        deadline = started + duration
+        while len(samples) < iterations and (time.perf_counter() < deadline or len(samples) < 5):
+            op_started = time.perf_counter()
+            op(warmup + len(samples))
+            samples.append((time.perf_counter() - op_started) * 1000)
+        elapsed = time.perf_counter() - started
+        peak_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+        if cleanup:
+            cleanup()
+    finally:
+        if conn is not None:
+            conn.close()
+
+    print(json.dumps({
+        'case': name, 'scale': rows, 'n': len(samples),
+        'mean_ms': sum(samples) / len(samples),
+        'p50_ms': percentile(samples, 50), 'p95_ms': percentile(samples, 95), 'p99_ms': percentile(samples, 99),
+        'ops_per_s': len(samples) / elapsed,
+        'peak_rss_mb': peak_mb, 'peak_growth_mb': max(0.0, peak_mb - rss_before),
+    }))
+
+
+def prepare_database(scales):
+    """Create the suite database and make sure it holds no more than the smallest scale"""
+    server = connect_server()
+    try:
+        migrate(server, database=SUITE_DB)
+    finally:
+        server.close()
+    conn = mysql.connector.connect(**dict(DB_CONFIG, database=SUITE_DB))
+    try:
+        cursor = conn.cursor()
+        cursor.execute("DELETE FROM patients WHERE phn LIKE %s", (SUITE_PHN_PREFIX + '%',))
+        cursor.execute("SELECT COUNT(*) FROM patients")
+        if cursor.fetchone()[0] > min(scales):
+            cursor.execute("DELETE FROM patients")
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def seed_scale(rows):
+    conn = mysql.connector.connect(**dict(DB_CONFIG, database=SUITE_DB))
+    try:
+        cursor = conn.cursor()
+        cursor.execute("SELECT COALESCE(MAX(patient_id), 0) FROM patient_contacts")
+        indexed = cursor.fetchone()[0]
+        seed(conn, rows)
+        # seed() writes patients only; the Contact search needs patient_contacts too
+        index_all_contact_numbers(cursor, after_id=indexed)
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def spawn_case(name, rows, args):
+    command = [sys.executable, __file__, "--run-case", name, "--iterations", str(args.iterations),
+               "--duration", str(args.duration), "--warmup", str(args.warmup)]
+    if rows is not None:
+        command += ["--run-scale", str(rows)]
+    output = subprocess.run(command, check=True, capture_output=True, text=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def find_regressions(results, baseline, tolerance):
+    previous = {(r['case'], r['scale']): r for r in baseline['results']}
+    regressions = []
+    for result in results:
+        base = previous.get((result['case'], result['scale']))
+        if base is None:
+            continue
+        checks = (
+            ('p50_ms', result['p50_ms'] > base['p50_ms'] * (1 + tolerance)),
+            ('ops_per_s', result['ops_per_s'] < base['ops_per_s'] * (1 - tolerance)),
+            # A few MB of allocator noise is not a regression
+            ('peak_growth_mb', result['peak_growth_mb'] > base['peak_growth_mb'] * (1 + tolerance) + 5),
+        )
+        for metric, regressed in checks:
+            if regressed:
+                regressions.append({'case': result['case'], 'scale': result['scale'], 'metric': metric,
+                                    'baseline': base[metric], 'current': result[metric]})
+    return regressions
+
+
+def git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, check=True,
+                              capture_output=True, text=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--scales", type=int, nargs="+", default=[10000, 100000], help="patients in the database")
+    parser.add_argument("--cases", nargs="+", choices=sorted(CASES), help="run only these cases")
+    parser.add_argument("--no-db", action="store_true", help="skip cases that need MySQL")
+    parser.add_argument("--iterations", type=int, default=500, help="max timed iterations per case")
+    parser.add_argument("--duration", type=float, default=10.0, help="max seconds per case")
+    parser.add_argument("--warmup", type=int, default=3)
+    parser.add_argument("--out", help="write results JSON here")
+    parser.add_argument("--baseline", help="baseline results JSON to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed relative change (0.2 = 20%%)")
+    parser.add_argument("--save-baseline", action="store_true", help="write these results to --baseline")
+    parser.add_argument("--run-case", help=argparse.SUPPRESS)
+    parser.add_argument("--run-scale", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run_case:
+        run_case(args.run_case, args.run_scale, args.iterations, args.duration, args.warmup)
+        return
+
+    names = args.cases or sorted(CASES)
+    cpu_cases = [name for name in names if not CASES[name][0]]
+    db_cases = [] if args.no_db else [name for name in names if CASES[name][0]]
+
+    results = []
+    for name in cpu_cases:
+        results.append(spawn_case(name, None, args))
+        print(f"  {name:22s} {'-':>9s}  p50 {results[-1]['p50_ms']:8.2f} ms  {results[-1]['ops_per_s']:9.1f}/s")
+    if db_cases:
+        scales = sorted(args.scales)
+        prepare_database(scales)
+        for rows in scales:
+            seed_scale(rows)
+            for name in db_cases:
+                results.append(spawn_case(name, rows, args))
+                print(f"  {name:22s} {rows:9d}  p50 {results[-1]['p50_ms']:8.2f} ms  {results[-1]['ops_per_s']:9.1f}/s")
+
+    report = {
+        'meta': {
+            'timestamp': datetime.now().isoformat(timespec='seconds'), 'git': git_revision(),
+            'python': platform.python_version(), 'platform': platform.platform(), 'cpu_count': os.cpu_count(),
+            'iterations': args.iterations, 'duration': args.duration,
+        },
+        'results': results,
+    }
+
+    regressions = []
+    if args.baseline and not args.save_baseline:
+        if os.path.exists(args.baseline):
+            with open(args.baseline) as f:
+                regressions = find_regressions(results, json.load(f), args.tolerance)
+            report['regressions'] = regressions
+            for r in regressions:
+                print(f"REGRESSION {r['case']} @ {r['scale']}: {r['metric']} {r['baseline']:.2f} -> {r['current']:.2f}")
+        else:
+            print(f"No baseline at {args.baseline}; run with --save-baseline to create one")
+
+    if args.out:
+        with open(args.out, 'w') as f:
+            json.dump(report, f, indent=2)
+    if args.save_baseline and args.baseline:
+        with open(args.baseline, 'w') as f:
+            json.dump(report, f, indent=2)
+    sys.exit(1 if regressions else 0)
+
+
+if __name__ == "__main__":
+    main()
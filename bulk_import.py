@@ -0,0 +1,291 @@
+"""Streaming bulk import of legacy patient records (CSV, JSON Lines or JSON array)
+
+    python bulk_import.py legacy_his.csv --batch-size 2000
+    python bulk_import.py export.jsonl --assign-phn
+
+Rows are validated with the same required-field rules as the registration
+form, normalized, and written with multi-row `executemany` inserts, one
+transaction per batch. After every committed batch the position is saved to
+`<file>.checkpoint.json`, so an interrupted import resumes where it stopped.
+Invalid rows go to `<file>.rejects.csv` and rows whose PHN or NIC already
+exists go to `<file>.duplicates.csv`; neither stops the import. Input is
+read incrementally, so memory use does not grow with file size.
+"""
+import argparse
+import csv
+import json
+import os
+import sys
+import time
+
+import mysql.connector
+
+from change_feed import record_patient_events
+from duplicates import blocking_keys
+from patients import (
+    INSERT_PATIENT_SQL, missing_required_fields, normalize_patient, patient_values, split_contact_numbers
+)
+from phn import PHNAllocator, reserve_phn_block
+from settings import DB_CONFIG
+
+DEFAULT_BATCH_SIZE = 1000
+JSON_CHUNK_SIZE = 64 * 1024
+
+
+def iter_csv(path):
+    with open(path, newline='', encoding='utf-8-sig') as f:
+        yield from csv.DictReader(f)
+
+
+def iter_json(path):
+    """Yield records from JSON Lines, or from a top-level JSON array without loading it whole"""
+    decoder = json.JSONDecoder()
+    with open(path, encoding='utf-8') as f:
+        buffer = f.read(JSON_CHUNK_SIZE).lstrip()
+        if not buffer.startswith('['):
+            # JSON Lines: one object per line
+            f.seek(0)
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+            return
+
+        buffer = buffer[1:]
+        eof = False
+        while True:
+            buffer = buffer.lstrip().lstrip(',').lstrip()
+            if buffer.startswith(']'):
+                return
+            try:
+                record, end = decoder.raw_decode(buffer)
+            except json.JSONDecodeError:
+                if eof:
+                    raise
+                chunk = f.read(JSON_CHUNK_SIZE)
+                eof = not chunk
+                buffer += chunk
+                continue
+            yield record
+            buffer = buffer[end:]
+
+
+def iter_records(path):
+    if path.lower().endswith('.csv'):
+        return iter_csv(path)
+    return iter_json(path)
+
+
+class ReportWriter:
+    """Appends one CSV line per problem row; opened lazily"""
+
+    def __init__(self, path, header):
+        self.path = path
+        self.header = header
+        self._file = None
+        self._writer = None
+
+    def write(self, row):
+        if self._file is None:
+            new_file = not os.path.exists(self.path)
+            self._file = open(self.path, 'a', newline='', encoding='utf-8')
+            self._writer = csv.writer(self._file)
+            if new_file:
+                self._writer.writerow(self.header)
+        self._writer.writerow(row)
+
+    def flush(self):
+        if self._file:
+            self._file.flush()
+            os.fsync(self._file.fileno())
+
+    def close(self):
+        if self._file:
+            self._file.close()
+
+
+def load_checkpoint(path):
+    if path and os.path.exists(path):
+        with open(path) as f:
+            return json.load(f)
+    return {'rows_done': 0, 'inserted': 0, 'duplicates': 0, 'rejected': 0}
+
+
+def save_checkpoint(path, state):
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(state, f)
+    os.replace(tmp_path, path)
+
+
+def _existing_keys(cursor, patients):
+    """PHNs and NICs from this batch that are already in the database"""
+    phns = [p['phn'] for _, p in patients]
+    nics = [p['nic'] for _, p in patients if p['nic']]
+    clauses, params = ["phn IN (%s)" % ", ".join(["%s"] * len(phns))], phns
+    if nics:
+        clauses.append("nic IN (%s)" % ", ".join(["%s"] * len(nics)))
+        params = phns + nics
+    cursor.execute(f"SELECT phn, nic FROM patients WHERE {' OR '.join(clauses)}", params)
+    rows = cursor.fetchall()
+    return {phn for phn, _ in rows}, {nic for _, nic in rows if nic}
+
+
+def _index_batch(cursor, patients):
+    """Add contact numbers, duplicate-detection blocking keys and change-feed events for the rows just inserted"""
+    phns = [p['phn'] for p in patients]
+    if not phns:
+        return
+    cursor.execute(f"SELECT id, phn FROM patients WHERE phn IN ({', '.join(['%s'] * len(phns))})", phns)
+    ids = dict((phn, patient_id) for patient_id, phn in cursor.fetchall())
+    keys = [(key, ids[p['phn']]) for p in patients if p['phn'] in ids for key in blocking_keys(p)]
+    if keys:
+        cursor.executemany("INSERT IGNORE INTO patient_blocking_keys (key_value, patient_id) VALUES (%s, %s)", keys)
+    contacts = [(ids[p['phn']], position, number) for p in patients if p['phn'] in ids
+                for position, number in enumerate(split_contact_numbers(p['contact_numbers']))]
+    if contacts:
+        cursor.executemany(
+            "INSERT IGNORE INTO patient_contacts (patient_id, position, contact_number) VALUES (%s, %s, %s)", contacts
+        )
+    record_patient_events(cursor, [(ids[p['phn']], p) for p in patients if p['phn'] in ids])
+
+
+def write_batch(conn, batch, duplicates, rejects):
+    """Insert one batch; returns (inserted, duplicate_count, rejected_count)"""
+    cursor = conn.cursor()
+    existing_phns, existing_nics = _existing_keys(cursor, batch)
+
+    to_insert, seen_phns, seen_nics, duplicate_count = [], set(), set(), 0
+    for row_number, patient in batch:
+        nic = patient['nic'] or None
+        if patient['phn'] in existing_phns or patient['phn'] in seen_phns:
+            reason = "PHN already exists"
+        elif nic and (nic in existing_nics or nic in seen_nics):
+            reason = "NIC already exists"
+        else:
+            to_insert.append((row_number, patient))
+            seen_phns.add(patient['phn'])
+            if nic:
+                seen_nics.add(nic)
+            continue
+        duplicates.write([row_number, patient['phn'], patient['nic'], reason])
+        duplicate_count += 1
+
+    rejected_count = 0
+    if not to_insert:
+        cursor.close()
+        return 0, duplicate_count, rejected_count
+
+    try:
+        cursor.executemany(INSERT_PATIENT_SQL, [patient_values(p) for _, p in to_insert])
+        inserted = [p for _, p in to_insert]
+    except (mysql.connector.IntegrityError, mysql.connector.DataError):
+        # A concurrent writer took a key since the check, or a value the server
+        # won't store: fall back to row by row so only the bad rows are left out
+        conn.rollback()
+        inserted = []
+        for row_number, patient in to_insert:
+            try:
+                cursor.execute(INSERT_PATIENT_SQL, patient_values(patient))
+                inserted.append(patient)
+            except mysql.connector.IntegrityError as err:
+                duplicates.write([row_number, patient['phn'], patient['nic'], err.msg])
+                duplicate_count += 1
+            except mysql.connector.DataError as err:
+                rejects.write([row_number, err.msg, json.dumps(patient, default=str)])
+                rejected_count += 1
+    _index_batch(cursor, inserted)
+    cursor.close()
+    return len(inserted), duplicate_count, rejected_count
+
+
+def import_file(conn, path, batch_size=DEFAULT_BATCH_SIZE, allocator=None, resume=True, log=print):
+    """Import `path` in batches; returns the final counters"""
+    checkpoint_path = path + '.checkpoint.json'
+    state = load_checkpoint(checkpoint_path if resume else None)
+    rejects = ReportWriter(path + '.rejects.csv', ['row', 'reason', 'record'])
+    duplicates = ReportWriter(path + '.duplicates.csv', ['row', 'phn', 'nic', 'reason'])
+
+    if state['rows_done']:
+        log(f"Resuming after row {state['rows_done']:,}")
+
+    started = time.perf_counter()
+    start_row = state['rows_done']
+    batch = []
+
+    def flush(last_row):
+        if batch:
+            inserted, duplicate_count, rejected_count = write_batch(conn, batch, duplicates, rejects)
+            state['inserted'] += inserted
+            state['duplicates'] += duplicate_count
+            state['rejected'] += rejected_count
+        rejects.flush()
+        duplicates.flush()
+        conn.commit()
+        state['rows_done'] = last_row
+        save_checkpoint(checkpoint_path, state)
+        batch.clear()
+        elapsed = time.perf_counter() - started
+        rate = (last_row - start_row) / elapsed if elapsed else 0
+        log(f"row {last_row:,}: {state['inserted']:,} inserted, {state['duplicates']:,} duplicates, "
+            f"{state['rejected']:,} rejected ({rate:,.0f} rows/s)")
+
+    row_number = state['rows_done']
+    try:
+        for row_number, record in enumerate(iter_records(path), 1):
+            if row_number <= state['rows_done']:
+                continue
+            try:
+                patient = normalize_patient(record)
+                if not patient['phn'] and allocator is not None:
+                    patient['phn'] = allocator.next_phn()
+                missing = missing_required_fields(patient)
+                if missing:
+                    raise ValueError(f"missing {', '.join(missing)}")
+            except ValueError as err:
+                rejects.write([row_number, str(err), json.dumps(record, default=str)])
+                state['rejected'] += 1
+                continue
+
+            batch.append((row_number, patient))
+            if len(batch) >= batch_size:
+                flush(row_number)
+        flush(row_number)
+    finally:
+        rejects.close()
+        duplicates.close()
+
+    state['seconds'] = round(time.perf_counter() - started, 2)
+    return state
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Bulk import patients from CSV or JSON")
+    parser.add_argument("path")
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE)
+    parser.add_argument("--assign-phn", action="store_true", help="issue new PHNs for rows without one")
+    parser.add_argument("--restart", action="store_true", help="ignore an existing checkpoint")
+    args = parser.parse_args(argv)
+
+    conn = mysql.connector.connect(**DB_CONFIG)
+    # PHN blocks are reserved on their own connection so they commit independently
+    sequence_conn = mysql.connector.connect(**DB_CONFIG) if args.assign_phn else None
+    try:
+        allocator = None
+        if sequence_conn is not None:
+            allocator = PHNAllocator(lambda size: reserve_phn_block(sequence_conn, size))
+        state = import_file(conn, args.path, args.batch_size, allocator, resume=not args.restart)
+    except mysql.connector.Error as err:
+        print(f"Import stopped: {err} (re-run to resume from the last checkpoint)", file=sys.stderr)
+        return 1
+    finally:
+        conn.close()
+        if sequence_conn is not None:
+            sequence_conn.close()
+
+    print(f"Done: {state['inserted']:,} inserted, {state['duplicates']:,} duplicates, "
+          f"{state['rejected']:,} rejected in {state['seconds']}s")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,81 @@
+"""Small thread-safe LRU cache with a byte budget, TTL and hit/miss counters"""
+import threading
+import time
+from collections import OrderedDict
+
+
+class LRUCache:
+    """Least-recently-used cache bounded by total size and entry age
+
+    Callers pass the size of each value to put(); entries are evicted oldest
+    first once the total exceeds `max_bytes`, and expire `ttl` seconds after
+    they were stored.
+    """
+
+    def __init__(self, max_bytes, ttl=None, name="cache"):
+        self.name = name
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._entries = OrderedDict()  # key -> (value, size, stored_at)
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._metrics = {'hits': 0, 'misses': 0, 'evictions': 0, 'expired': 0}
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self._metrics['misses'] += 1
+                return default
+
+            value, size, stored_at = entry
+            if self.ttl is not None and time.monotonic() - stored_at > self.ttl:
+                self._remove(key)
+                self._metrics['expired'] += 1
+                self._metrics['misses'] += 1
+                return default
+
+            self._entries.move_to_end(key)
+            self._metrics['hits'] += 1
+            return value
+
+    def put(self, key, value, size):
+        if size > self.max_bytes:
+            return  # Never let a single oversized value flush the whole cache
+
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (value, size, time.monotonic())
+            self._bytes += size
+
+            while self._bytes > self.max_bytes:
+                oldest = next(iter(self._entries))
+                self._remove(oldest)
+                self._metrics['evictions'] += 1
+
+    def invalidate(self, key):
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def _remove(self, key):
+        _, size, _ = self._entries.pop(key)
+        self._bytes -= size
+
+    def stats(self):
+        with self._lock:
+            lookups = self._metrics['hits'] + self._metrics['misses']
+            return {
+                'entries': len(self._entries),
+                'bytes': self._bytes,
+                'max_bytes': self.max_bytes,
+                'ttl': self.ttl,
+                **self._metrics,
+                'hit_rate': self._metrics['hits'] / lookups if lookups else 0.0,
+            }
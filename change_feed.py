@@ -0,0 +1,498 @@
+"""Change feed of patient registrations for downstream systems
+
+Every save path (the form, the save queue, the API and the bulk importer)
+writes a compact event to the `patient_events` outbox in the same
+transaction as the patient row, so an event exists exactly when the
+registration committed. Events carry the PATIENT_FIELDS that are set plus
+the patient id; never the avatar.
+
+Consumers read the outbox in event_id order and keep their position in
+`change_feed_cursors`:
+
+    python change_feed.py --consumer lab --sink tcp:lab-gw:9400 --follow
+    python change_feed.py --consumer billing --sink /data/feed/billing.jsonl --format fhir --follow
+    python change_feed.py --after 0 --sink - | head         # replay to stdout, no cursor
+    python change_feed.py --receive 9400 --out events.jsonl  # local socket sink for testing
+    python change_feed.py --purge                            # drop consumed events past retention
+
+Output is one JSON object per line: the event (jsonl) or a FHIR Patient
+resource (fhir, i.e. FHIR bulk-data NDJSON). A batch is read, written to
+the sink and flushed (fsync for files) before the consumer's cursor moves
+past it, so delivery is at-least-once: after a crash or a dropped socket
+the events after the saved cursor may arrive again, and receivers should
+ignore event ids they have already seen. Reading runs a few batches ahead
+of the sink in a background thread and blocks when the sink falls behind.
+
+Event ids are taken at insert but become visible at commit, so a slow save
+can commit into an id gap after newer events went out. Such a gap is held
+for CHANGE_FEED_GAP_WAIT, then stepped over but looked up again on every
+read until its event shows up (delivered late, out of id order) or it is
+CHANGE_FEED_GAP_EXPIRE old; rolled-back saves leave gaps that never fill.
+A saved cursor never moves past an unresolved gap, so a restart looks
+again too.
+"""
+import argparse
+import json
+import logging
+import os
+import queue
+import socket
+import socketserver
+import sys
+import threading
+import time
+from datetime import date, datetime, timezone
+
+import mysql.connector
+
+from db_pool import ConnectionPool
+from metrics import count, span
+from patients import PATIENT_FIELDS, split_contact_numbers
+from settings import (
+    CHANGE_FEED_BATCH, CHANGE_FEED_GAP_EXPIRE, CHANGE_FEED_GAP_WAIT, CHANGE_FEED_NIC_SYSTEM, CHANGE_FEED_PHN_SYSTEM,
+    CHANGE_FEED_POLL_INTERVAL, CHANGE_FEED_PREFETCH, CHANGE_FEED_RETENTION_DAYS, DB_CONFIG,
+)
+
+logger = logging.getLogger(__name__)
+
+INSERT_EVENT_SQL = "INSERT INTO patient_events (patient_id, event_type, payload) VALUES (%s, %s, %s)"
+PURGE_CHUNK = 10000
+PENDING_GAPS_MAX = 10000  # unresolved event ids tracked per reader (the newest are kept)
+SINK_RETRY_MAX = 30.0  # seconds between attempts to reach a failed sink
+FORMATS = ('jsonl', 'fhir')
+
+GENDER_CODES = {'Male': 'male', 'Female': 'female', 'Prefer not to say': 'unknown'}
+
+
+def patient_event(patient_id, patient_data):
+    """Compact JSON payload for a patient: the id and every non-empty PATIENT_FIELD"""
+    event = {'id': patient_id}
+    for field in PATIENT_FIELDS:
+        value = patient_data.get(field)
+        if value is None or value == '':
+            continue
+        event[field] = value.isoformat() if isinstance(value, date) else value
+    return json.dumps(event, ensure_ascii=False, separators=(',', ':'))
+
+
+def record_patient_events(cursor, patients, event_type='created'):
+    """Write outbox events for (patient_id, patient_data) pairs, inside the caller's transaction"""
+    rows = [(patient_id, event_type, patient_event(patient_id, patient_data)) for patient_id, patient_data in patients]
+    if rows:
+        cursor.executemany(INSERT_EVENT_SQL, rows)
+
+
+def backfill_patient_events(cursor, chunk=5000, after_id=0):
+    """Migration step: a 'snapshot' event for every patient registered before the outbox existed"""
+    last_id = after_id
+    while True:
+        cursor.execute(
+            f"SELECT id, {', '.join(PATIENT_FIELDS)} FROM patients WHERE id > %s ORDER BY id LIMIT %s",
+            (last_id, chunk)
+        )
+        rows = cursor.fetchall()
+        if not rows:
+            return
+        record_patient_events(cursor, [(row[0], dict(zip(PATIENT_FIELDS, row[1:]))) for row in rows], 'snapshot')
+        last_id = rows[-1][0]
+
+
+def encode_jsonl(event):
+    """One event as a JSON line; the stored payload is embedded without re-parsing"""
+    event_id, event_type, created, payload = event
+    return f'{{"event_id":{event_id},"type":"{event_type}","time":"{created}","patient":{payload}}}\n'.encode()
+
+
+def fhir_patient(event_id, created, patient):
+    """FHIR R4 Patient resource for a decoded event payload"""
+    resource = {
+        'resourceType': 'Patient',
+        'id': str(patient['id']),
+        'meta': {'versionId': str(event_id), 'lastUpdated': created},
+        'identifier': [{'system': CHANGE_FEED_PHN_SYSTEM, 'value': patient['phn']}],
+        'name': [{'use': 'official', 'text': patient.get('full_name', '')}],
+    }
+    if patient.get('nic'):
+        resource['identifier'].append({'system': CHANGE_FEED_NIC_SYSTEM, 'value': patient['nic']})
+    if patient.get('title'):
+        resource['name'][0]['prefix'] = [patient['title']]
+    if patient.get('other_names'):
+        resource['name'].append({'use': 'usual', 'text': patient['other_names']})
+    if patient.get('gender'):
+        resource['gender'] = GENDER_CODES.get(patient['gender'], 'other')
+    if patient.get('birthday'):
+        resource['birthDate'] = patient['birthday']
+    numbers = split_contact_numbers(patient.get('contact_numbers'))
+    if numbers:
+        resource['telecom'] = [{'system': 'phone', 'value': number, 'rank': rank}
+                               for rank, number in enumerate(numbers, 1)]
+    lines = [patient[field] for field in ('address_line1', 'address_line2') if patient.get(field)]
+    address = {'use': 'home', 'country': 'LK'}
+    if lines:
+        address['line'] = lines
+    if patient.get('district'):
+        address['district'] = patient['district']
+    if patient.get('province'):
+        address['state'] = patient['province']
+    if len(address) > 2:
+        resource['address'] = [address]
+    if patient.get('marital_status'):
+        resource['maritalStatus'] = {'text': patient['marital_status']}
+    return resource
+
+
+def encode_fhir(event):
+    event_id, _, created, payload = event
+    resource = fhir_patient(event_id, created, json.loads(payload))
+    return (json.dumps(resource, ensure_ascii=False, separators=(',', ':')) + '\n').encode()
+
+
+ENCODERS = {'jsonl': encode_jsonl, 'fhir': encode_fhir}
+
+
+class ChangeFeed:
+    """Reads the outbox and stores consumer cursors through `connect` (a pooled connection factory)"""
+
+    def __init__(self, connect, batch_size=CHANGE_FEED_BATCH, gap_wait=CHANGE_FEED_GAP_WAIT,
+                 gap_expire=CHANGE_FEED_GAP_EXPIRE):
+        self.connect = connect
+        self.batch_size = batch_size
+        self.gap_wait = gap_wait
+        self.gap_expire = gap_expire
+
+    def read(self, after, gaps=None):
+        """Committed events after event id `after`, oldest first: [(event_id, type, time, payload)]
+
+        Stops short of an id gap younger than gap_wait: AUTO_INCREMENT ids are
+        taken at insert, not at commit, so a slower concurrent save may still
+        commit into it. An older gap is stepped over and its ids are added to
+        `gaps` ({event_id: time of the event after it}, updated in place);
+        those ids are read again on every call, and an event that fills one is
+        returned with the batch, until the gap is gap_expire old.
+        """
+        gaps = {} if gaps is None else gaps
+        pending = sorted(gaps)
+        conn = self.connect()
+        try:
+            cursor = conn.cursor()
+            cursor.execute(
+                "SELECT event_id, event_type, UNIX_TIMESTAMP(created_at), payload, UNIX_TIMESTAMP(NOW(6)) "
+                "FROM patient_events WHERE event_id > %s"
+                + (f" OR event_id IN ({', '.join(['%s'] * len(pending))})" if pending else "")
+                + " ORDER BY event_id LIMIT %s",
+                (after, *pending, self.batch_size)
+            )
+            rows = cursor.fetchall()
+            cursor.close()
+        finally:
+            conn.close()
+
+        events = []
+        expected = after + 1
+        now = None
+        for event_id, event_type, created, payload, now in rows:
+            if gaps.pop(event_id, None) is None:
+                if event_id != expected:
+                    if float(now) - float(created) < self.gap_wait:
+                        break
+                    for missing in range(max(expected, event_id - PENDING_GAPS_MAX), event_id):
+                        gaps[missing] = float(created)
+                expected = event_id + 1
+            created = datetime.fromtimestamp(float(created), timezone.utc).isoformat(timespec='milliseconds')
+            events.append((event_id, event_type, created, payload.decode() if isinstance(payload, bytes) else payload))
+
+        if now is not None:
+            expired = [event_id for event_id, seen in gaps.items() if float(now) - seen >= self.gap_expire]
+            for event_id in expired:
+                del gaps[event_id]
+            overflow = sorted(gaps)[:max(len(gaps) - PENDING_GAPS_MAX, 0)]
+            for event_id in overflow:
+                del gaps[event_id]
+            expired += overflow
+            if expired:
+                logger.warning("change feed: gave up waiting for %d event id(s) from %d", len(expired), min(expired))
+        return events
+
+    def get_cursor(self, consumer):
+        """Last event id delivered to `consumer` (0 for a new consumer)"""
+        conn = self.connect()
+        try:
+            cursor = conn.cursor()
+            cursor.execute("SELECT event_id FROM change_feed_cursors WHERE consumer = %s", (consumer,))
+            row = cursor.fetchone()
+            cursor.close()
+        finally:
+            conn.close()
+        return row[0] if row else 0
+
+    def save_cursor(self, consumer, event_id):
+        conn = self.connect()
+        try:
+            cursor = conn.cursor()
+            cursor.execute(
+                "INSERT INTO change_feed_cursors (consumer, event_id) VALUES (%s, %s) "
+                "ON DUPLICATE KEY UPDATE event_id = VALUES(event_id)",
+                (consumer, event_id)
+            )
+            conn.commit()
+            cursor.close()
+        finally:
+            conn.close()
+
+    def purge(self, retention_days=CHANGE_FEED_RETENTION_DAYS):
+        """Delete events older than the retention that every consumer has read; returns the count"""
+        conn = self.connect()
+        try:
+            cursor = conn.cursor()
+            cursor.execute("SELECT MIN(event_id) FROM change_feed_cursors")
+            oldest_cursor = cursor.fetchone()[0]
+            deleted = 0
+            while True:
+                cursor.execute(
+                    "DELETE FROM patient_events WHERE created_at < NOW() - INTERVAL %s DAY AND event_id <= %s "
+                    "ORDER BY event_id LIMIT %s",
+                    (retention_days, oldest_cursor if oldest_cursor is not None else 2 ** 63 - 1, PURGE_CHUNK)
+                )
+                conn.commit()
+                deleted += cursor.rowcount
+                if cursor.rowcount < PURGE_CHUNK:
+                    break
+            cursor.close()
+        finally:
+            conn.close()
+        return deleted
+
+
+class FileSink:
+    """Appends to a file, fsynced after every batch when `sync` is set"""
+
+    def __init__(self, path, sync=True):
+        self.path = path
+        self.sync = sync
+        self._file = None
+
+    def write(self, data):
+        if self._file is None:
+            self._file = open(self.path, 'ab')
+        self._file.write(data)
+        self._file.flush()
+        if self.sync:
+            os.fsync(self._file.fileno())
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+class SocketSink:
+    """Streams lines over TCP, reconnecting on the next write after a failure"""
+
+    def __init__(self, host, port, timeout=30.0):
+        self.address = (host, port)
+        self.timeout = timeout
+        self._sock = None
+
+    def write(self, data):
+        if self._sock is None:
+            self._sock = socket.create_connection(self.address, timeout=self.timeout)
+        self._sock.sendall(data)
+
+    def close(self):
+        if self._sock is not None:
+            self._sock.close()
+            self._sock = None
+
+
+class StreamSink:
+    def __init__(self, stream):
+        self.stream = stream
+
+    def write(self, data):
+        self.stream.write(data)
+        self.stream.flush()
+
+    def close(self):
+        pass
+
+
+def open_sink(spec, sync=True):
+    """'-' for stdout, 'tcp:HOST:PORT' for a socket, otherwise a file path (optionally 'file:PATH')"""
+    if spec == '-':
+        return StreamSink(sys.stdout.buffer)
+    if spec.startswith('tcp:'):
+        host, _, port = spec[len('tcp:'):].rpartition(':')
+        if not host or not port.isdigit():
+            raise ValueError(f"expected tcp:HOST:PORT, got {spec!r}")
+        return SocketSink(host, int(port))
+    return FileSink(spec[len('file:'):] if spec.startswith('file:') else spec, sync=sync)
+
+
+def run_feed(feed, sink, after, consumer=None, fmt='jsonl', follow=False, prefetch=CHANGE_FEED_PREFETCH,
+             poll_interval=CHANGE_FEED_POLL_INTERVAL, stop=None):
+    """Copy events after `after` to `sink` until caught up (or `stop` is set, when following)
+
+    Saves the consumer's cursor after each batch the sink accepted, never
+    past an id gap the feed is still watching. A sink error is retried with
+    backoff, re-sending the whole batch. Returns (events_delivered, cursor).
+    """
+    encode = ENCODERS[fmt]
+    stop = stop or threading.Event()
+    batches = queue.Queue(maxsize=prefetch)
+
+    def offer(item):
+        # Blocks while the sink is behind, which pauses reading: the backpressure
+        while not stop.is_set():
+            try:
+                batches.put(item, timeout=0.5)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def reader():
+        position, gaps = after, {}
+        try:
+            while not stop.is_set():
+                with span("change_feed.read"):
+                    events = feed.read(position, gaps)
+                if events:
+                    # Events filling a gap sort first; a batch may hold nothing else
+                    position = max(position, events[-1][0])
+                    resume_after = min(gaps) - 1 if gaps else position
+                    if not offer((b''.join(encode(event) for event in events), resume_after, len(events))):
+                        return
+                elif not follow:
+                    break
+                else:
+                    stop.wait(poll_interval)
+        except Exception as exc:
+            offer(exc)
+            return
+        offer(None)
+
+    thread = threading.Thread(target=reader, name="change-feed-reader", daemon=True)
+    thread.start()
+    delivered, last_event_id = 0, after
+    try:
+        while True:
+            try:
+                item = batches.get(timeout=0.5)
+            except queue.Empty:
+                if stop.is_set():
+                    break
+                continue
+            if item is None:
+                break
+            if isinstance(item, Exception):
+                raise item
+            data, position, size = item
+            deliver(sink, data, stop)
+            if consumer:
+                feed.save_cursor(consumer, position)
+            delivered += size
+            last_event_id = position
+            count('events', 'change_feed', size)
+    finally:
+        stop.set()
+        thread.join()
+    return delivered, last_event_id
+
+
+def deliver(sink, data, stop):
+    """Write one batch, retrying with backoff until it goes through or `stop` is set"""
+    delay = 0.5
+    while True:
+        try:
+            with span("change_feed.write", bytes=len(data)):
+                sink.write(data)
+            return
+        except OSError as err:
+            sink.close()
+            logger.warning("change feed sink failed (%s), retrying in %.1fs", err, delay)
+            if stop.wait(delay):
+                raise
+            delay = min(delay * 2, SINK_RETRY_MAX)
+
+
+class _ReceiveHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        lines = 0
+        for line in self.rfile:
+            lines += 1
+            if self.server.out is not None:
+                with self.server.out_lock:
+                    self.server.out.write(line)
+        if self.server.out is not None:
+            self.server.out.flush()
+        if self.server.report is not None:
+            self.server.report(f"{self.client_address[0]}:{self.client_address[1]} sent {lines} events")
+
+
+class ReceiverServer(socketserver.ThreadingTCPServer):
+    """Local socket sink: accepts feed connections and appends their lines to `out` (a binary file)
+
+    `report` is called with a summary line as each connection closes.
+    """
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address, out=None, report=print):
+        super().__init__(address, _ReceiveHandler)
+        self.out = out
+        self.report = report
+        self.out_lock = threading.Lock()
+
+    @property
+    def port(self):
+        return self.server_address[1]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Stream patient registration events to a file or socket")
+    parser.add_argument("--consumer", help="name to keep a resumable cursor under (e.g. lab, billing)")
+    parser.add_argument("--after", type=int, help="start after this event id instead of the saved cursor")
+    parser.add_argument("--sink", default='-', help="'-' (stdout), a file path, or tcp:HOST:PORT")
+    parser.add_argument("--format", choices=FORMATS, default='jsonl')
+    parser.add_argument("--batch", type=int, default=CHANGE_FEED_BATCH, help="events per read and write")
+    parser.add_argument("--follow", action="store_true", help="keep polling for new events")
+    parser.add_argument("--no-fsync", action="store_true", help="don't fsync file sinks after each batch")
+    parser.add_argument("--purge", action="store_true", help="delete consumed events older than the retention")
+    parser.add_argument("--receive", type=int, metavar="PORT", help="run a local socket sink on PORT instead")
+    parser.add_argument("--out", help="with --receive: append received lines to this file")
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s", stream=sys.stderr)
+
+    if args.receive is not None:
+        out = open(args.out, 'ab') if args.out else None
+        with ReceiverServer(('0.0.0.0', args.receive), out) as server:
+            print(f"Receiving change feed on port {server.port}")
+            server.serve_forever()
+        return 0
+    if args.after is None and not args.consumer and not args.purge:
+        parser.error("give --consumer to resume from a saved cursor, or --after to replay")
+
+    pool = ConnectionPool(lambda: mysql.connector.connect(**DB_CONFIG), size=2)
+    feed = ChangeFeed(pool.get_connection, batch_size=args.batch)
+    if args.purge:
+        print(f"Purged {feed.purge()} events", file=sys.stderr)
+        return 0
+
+    after = args.after if args.after is not None else feed.get_cursor(args.consumer)
+    sink = open_sink(args.sink, sync=not args.no_fsync)
+    started = time.monotonic()
+    try:
+        delivered, last_event_id = run_feed(feed, sink, after, consumer=args.consumer, fmt=args.format,
+                                            follow=args.follow)
+    except KeyboardInterrupt:
+        return 130
+    finally:
+        sink.close()
+    elapsed = time.monotonic() - started
+    print(f"Delivered {delivered} events up to event {last_event_id} in {elapsed:.1f}s", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
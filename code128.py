@@ -0,0 +1,140 @@
+"""Code128 rendering straight from the module pattern
+
+python-barcode is used only to encode the data (code set switching and the
+check symbol) into its bar/space module string. Bars are then drawn directly
+at the output resolution with a whole number of pixels per module, so every
+edge is pixel-exact and no PNG round-trip or resampling is needed. The same
+modules can be emitted as SVG, or as ZPL for thermal printers.
+"""
+from itertools import groupby
+from xml.sax.saxutils import escape
+
+import barcode
+from PIL import Image, ImageDraw
+
+QUIET_ZONE_MODULES = 10  # minimum required by the Code128 spec
+
+
+def code128_modules(data):
+    """Return the module pattern for `data`, e.g. '11010010000...' (1 = bar)"""
+    return barcode.get_barcode_class('code128')(data).build()[0]
+
+
+def _bar_runs(modules):
+    """Yield (start_module, width_in_modules) for each bar"""
+    position = 0
+    for bit, run in groupby(modules):
+        width = len(list(run))
+        if bit == '1':
+            yield position, width
+        position += width
+
+
+def module_width_px(modules, width_px):
+    """Largest whole pixels-per-module that fits the bars plus both quiet zones"""
+    return max(1, width_px // (len(modules) + 2 * QUIET_ZONE_MODULES))
+
+
+def render_code128(data, width_px, bar_height_px, text=None, font=None,
+                   top_px=0, text_gap_px=0, height_px=None, mode='L'):
+    """Draw a Code128 symbol centered on a white `width_px`-wide canvas
+
+    Bars are `bar_height_px` tall starting at `top_px`; `text` is centered
+    below them using `font`. The canvas is `height_px` tall (defaults to just
+    fitting the content).
+    """
+    modules = code128_modules(data)
+    module_px = module_width_px(modules, width_px)
+    bars_width = len(modules) * module_px
+    left = (width_px - bars_width) // 2
+
+    if height_px is None:
+        height_px = top_px + bar_height_px
+        if text:
+            text_bbox = font.getbbox(text)
+            height_px += text_gap_px + text_bbox[3]
+
+    ink = 0 if mode in ('1', 'L') else (0, 0, 0)
+    paper = 1 if mode == '1' else (255 if mode == 'L' else (255, 255, 255))
+    img = Image.new(mode, (width_px, height_px), paper)
+    draw = ImageDraw.Draw(img)
+
+    for start, width in _bar_runs(modules):
+        x0 = left + start * module_px
+        draw.rectangle([x0, top_px, x0 + width * module_px - 1, top_px + bar_height_px - 1], fill=ink)
+
+    if text:
+        text_width = draw.textlength(text, font=font)
+        draw.text(((width_px - text_width) / 2, top_px + bar_height_px + text_gap_px), text, font=font, fill=ink)
+
+    return img
+
+
+def code128_svg(data, module_width_mm=0.33, bar_height_mm=11.0, text=None, font_size_mm=3.0):
+    """Vector SVG of the symbol, sized in millimetres"""
+    modules = code128_modules(data)
+    total_modules = len(modules) + 2 * QUIET_ZONE_MODULES
+    width_mm = total_modules * module_width_mm
+    height_mm = bar_height_mm + (font_size_mm * 1.5 if text else 0)
+
+    rects = "".join(
+        f'<rect x="{(QUIET_ZONE_MODULES + start) * module_width_mm:.3f}" y="0" '
+        f'width="{width * module_width_mm:.3f}" height="{bar_height_mm:.3f}"/>'
+        for start, width in _bar_runs(modules)
+    )
+    label = ""
+    if text:
+        label = (
+            f'<text x="{width_mm / 2:.3f}" y="{bar_height_mm + font_size_mm * 1.2:.3f}" '
+            f'font-family="monospace" font-size="{font_size_mm:.3f}" text-anchor="middle">{escape(text)}</text>'
+        )
+    return (
+        f'<svg xmlns="http://www.w3.org/2000/svg" width="{width_mm:.3f}mm" height="{height_mm:.3f}mm" '
+        f'viewBox="0 0 {width_mm:.3f} {height_mm:.3f}" shape-rendering="crispEdges">'
+        f'<rect width="100%" height="100%" fill="white"/><g fill="black">{rects}</g>{label}</svg>'
+    )
+
+
+# Code128 symbol values that start or switch code sets, and the ZPL
+# invocation codes for them (^BC with no mode reads these from the field data)
+_ZPL_START = {103: ('A', '>9'), 104: ('B', '>:'), 105: ('C', '>;')}
+_ZPL_SWITCH = {99: ('C', '>5'), 100: ('B', '>6'), 101: ('A', '>7')}
+
+
+def code128_symbols(data):
+    """Symbol values (start code first, no checksum or stop) python-barcode encodes `data` as"""
+    return barcode.get_barcode_class('code128')(data).encoded
+
+
+def zpl_code128_data(data):
+    """^FD data for ^BC that spells out the code sets chosen by code128_modules
+
+    Left to itself the printer picks its own code sets (subset B unless told
+    otherwise), which draws a wider symbol than the one sized from
+    code128_modules. Explicit start and switch codes make it draw the same one.
+    """
+    symbols = code128_symbols(data)
+    code_set, field = _ZPL_START[symbols[0]]
+    for value in symbols[1:]:
+        if value in _ZPL_SWITCH and _ZPL_SWITCH[value][0] != code_set:
+            code_set, invocation = _ZPL_SWITCH[value]
+            field += invocation
+        elif code_set == 'C':
+            field += f"{value:02d}"
+        elif (value < 64 or code_set == 'B' and value < 96) and chr(value + 32) not in '^~':
+            field += '><' if value == 30 else chr(value + 32)  # '>' is ZPL's escape character
+        else:
+            raise ValueError(f"can't express Code128 value {value} in set {code_set} as ZPL field data")
+    return field
+
+
+def code128_zpl(data, x_dots, y_dots, module_dots=2, bar_height_dots=100, print_text=True):
+    """ZPL fragment that has the printer render the symbol natively (^BC)
+
+    The symbol is len(code128_modules(data)) * module_dots wide.
+    """
+    interpretation = 'Y' if print_text else 'N'
+    return (
+        f"^FO{x_dots},{y_dots}^BY{module_dots}"
+        f"^BCN,{bar_height_dots},{interpretation},N,N,N^FD{zpl_code128_data(data)}^FS"
+    )
@@ -0,0 +1,175 @@
+"""Process-wide database connection pool shared by all Streamlit sessions"""
+import queue
+import threading
+import time
+
+from metrics import TimedCursor, timed
+
+
+class PoolTimeout(Exception):
+    """Raised when no connection becomes free within the checkout timeout"""
+
+
+def ping_connection(conn):
+    """Check a connection is usable, reconnecting it in place when supported"""
+    try:
+        if hasattr(conn, 'ping'):
+            # mysql.connector: re-establishes a stale connection or raises
+            conn.ping(reconnect=True, attempts=1, delay=0)
+        else:
+            # DB-API fallback (e.g. the sqlite3 shim used in local testing)
+            cursor = conn.cursor()
+            cursor.execute("SELECT 1")
+            cursor.fetchall()
+            cursor.close()
+        return True
+    except Exception:
+        return False
+
+
+class PooledConnection:
+    """Proxy around a raw connection; close() returns it to the pool"""
+
+    def __init__(self, pool, conn):
+        self._pool = pool
+        self._conn = conn
+
+    def __getattr__(self, name):
+        if self._conn is None:
+            raise AttributeError(f"connection already returned to pool: {name}")
+        return getattr(self._conn, name)
+
+    def cursor(self, *args, **kwargs):
+        """A cursor whose statements are timed as db.select, db.insert, ... spans"""
+        if self._conn is None:
+            raise AttributeError("connection already returned to pool: cursor")
+        return TimedCursor(self._conn.cursor(*args, **kwargs))
+
+    def close(self):
+        if self._conn is not None:
+            conn, self._conn = self._conn, None
+            self._pool.release(conn)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+class ConnectionPool:
+    """Fixed-size pool that opens connections lazily and checks them on checkout
+
+    `connect` is any zero-argument callable returning a DB-API connection, so the
+    pool can be exercised against sqlite3 as well as mysql.connector.
+    """
+
+    def __init__(self, connect, size=5, timeout=10.0, check=ping_connection):
+        self._connect = connect
+        self._check = check
+        self.size = size
+        self.timeout = timeout
+        self._idle = queue.LifoQueue()
+        self._lock = threading.Lock()
+        self._created = 0
+        self._in_use = 0
+        self._metrics = {
+            'checkouts': 0,
+            'timeouts': 0,
+            'reconnects': 0,
+            'wait_time_total': 0.0,
+            'wait_time_max': 0.0,
+        }
+
+    @timed("db.open")
+    def _open(self):
+        try:
+            return self._connect()
+        except Exception:
+            with self._lock:
+                self._created -= 1
+            raise
+
+    @timed("db.connect")
+    def get_connection(self):
+        start = time.monotonic()
+        conn = None
+
+        with self._lock:
+            grow = self._idle.empty() and self._created < self.size
+            if grow:
+                self._created += 1
+
+        if grow:
+            conn = self._open()
+        else:
+            try:
+                conn = self._idle.get(timeout=self.timeout)
+            except queue.Empty:
+                with self._lock:
+                    self._metrics['timeouts'] += 1
+                raise PoolTimeout(
+                    f"No database connection available after {self.timeout:.1f}s "
+                    f"(pool size {self.size})"
+                )
+
+            # Health check on checkout; replace connections that went stale
+            if not self._check(conn):
+                self._discard(conn)
+                with self._lock:
+                    self._created += 1
+                    self._metrics['reconnects'] += 1
+                conn = self._open()
+
+        waited = time.monotonic() - start
+        with self._lock:
+            self._in_use += 1
+            self._metrics['checkouts'] += 1
+            self._metrics['wait_time_total'] += waited
+            self._metrics['wait_time_max'] = max(self._metrics['wait_time_max'], waited)
+
+        return PooledConnection(self, conn)
+
+    def release(self, conn):
+        with self._lock:
+            self._in_use -= 1
+
+        try:
+            # Drop any transaction the caller left open before reuse
+            conn.rollback()
+        except Exception:
+            self._discard(conn)
+            return
+
+        self._idle.put(conn)
+
+    def _discard(self, conn):
+        with self._lock:
+            self._created -= 1
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    def close_all(self):
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            self._discard(conn)
+
+    def stats(self):
+        with self._lock:
+            checkouts = self._metrics['checkouts']
+            return {
+                'size': self.size,
+                'open': self._created,
+                'in_use': self._in_use,
+                'idle': self._idle.qsize(),
+                'checkouts': checkouts,
+                'timeouts': self._metrics['timeouts'],
+                'reconnects': self._metrics['reconnects'],
+                'wait_time_avg_ms': (self._metrics['wait_time_total'] / checkouts * 1000) if checkouts else 0.0,
+                'wait_time_max_ms': self._metrics['wait_time_max'] * 1000,
+            }
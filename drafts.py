@@ -0,0 +1,120 @@
+"""In-progress registrations kept in MySQL so any app replica can resume them
+
+Each browser session's form lives under a random draft id carried in the
+page URL (?draft=...). Every replica reads and writes the same
+`patient_drafts` table, so a reconnect that lands on another replica behind
+the load balancer picks up the half-filled form and avatar; no sticky
+sessions are needed. The avatar is stored as the compressed original plus
+the crop box, and only rewritten when it changes.
+"""
+import json
+import threading
+import time
+from datetime import date
+
+from settings import DRAFT_TTL_HOURS
+
+PURGE_INTERVAL = 3600  # seconds between sweeps of expired drafts, per process
+
+
+def encode_patient_data(patient_data):
+    return json.dumps(patient_data, default=lambda value: value.isoformat(), sort_keys=True)
+
+
+def decode_patient_data(text):
+    patient_data = json.loads(text)
+    if patient_data.get('birthday'):
+        patient_data['birthday'] = date.fromisoformat(patient_data['birthday'])
+    return patient_data
+
+
+class DraftStore:
+    """Load/save/delete drafts through `connect` (a pooled connection factory)"""
+
+    def __init__(self, connect, ttl_hours=DRAFT_TTL_HOURS):
+        self.connect = connect
+        self.ttl_hours = ttl_hours
+        self._lock = threading.Lock()
+        self._last_purge = 0.0
+
+    def load(self, draft_id):
+        """Return {'patient_data', 'avatar', 'avatar_digest', 'avatar_crop'} or None"""
+        conn = self.connect()
+        try:
+            cursor = conn.cursor()
+            cursor.execute(
+                "SELECT patient_data, avatar, avatar_digest, avatar_crop FROM patient_drafts WHERE draft_id = %s",
+                (draft_id,)
+            )
+            row = cursor.fetchone()
+            cursor.close()
+        finally:
+            conn.close()
+        if row is None:
+            return None
+        patient_data, avatar, avatar_digest, avatar_crop = row
+        return {
+            'patient_data': decode_patient_data(patient_data),
+            'avatar': bytes(avatar) if avatar is not None else None,
+            'avatar_digest': avatar_digest,
+            'avatar_crop': tuple(json.loads(avatar_crop)) if avatar_crop else None,
+        }
+
+    def save(self, draft_id, patient_data, avatar=None):
+        """Upsert the form; `avatar` is an AvatarDraft, or None to leave the stored avatar alone
+
+        Pass avatar=False to remove a stored avatar.
+        """
+        values = [draft_id, encode_patient_data(patient_data)]
+        sql = "INSERT INTO patient_drafts (draft_id, patient_data"
+        update = "patient_data = VALUES(patient_data)"
+        if avatar is not None:
+            sql += ", avatar, avatar_digest, avatar_crop"
+            update += ", avatar = VALUES(avatar), avatar_digest = VALUES(avatar_digest), avatar_crop = VALUES(avatar_crop)"
+            if avatar:
+                values += [avatar.original, avatar.digest, json.dumps(avatar.crop_box) if avatar.crop_box else None]
+            else:
+                values += [None, None, None]
+        sql += f") VALUES ({', '.join(['%s'] * len(values))}) ON DUPLICATE KEY UPDATE {update}"
+
+        conn = self.connect()
+        try:
+            cursor = conn.cursor()
+            cursor.execute(sql, values)
+            conn.commit()
+            cursor.close()
+        finally:
+            conn.close()
+        self._maybe_purge()
+
+    def delete(self, draft_id):
+        conn = self.connect()
+        try:
+            cursor = conn.cursor()
+            cursor.execute("DELETE FROM patient_drafts WHERE draft_id = %s", (draft_id,))
+            conn.commit()
+            cursor.close()
+        finally:
+            conn.close()
+
+    def purge(self):
+        """Delete drafts untouched for longer than the TTL; returns the number removed"""
+        conn = self.connect()
+        try:
+            cursor = conn.cursor()
+            cursor.execute(
+                "DELETE FROM patient_drafts WHERE updated_at < NOW() - INTERVAL %s HOUR", (self.ttl_hours,)
+            )
+            removed = cursor.rowcount
+            conn.commit()
+            cursor.close()
+        finally:
+            conn.close()
+        return removed
+
+    def _maybe_purge(self):
+        with self._lock:
+            if time.monotonic() - self._last_purge < PURGE_INTERVAL:
+                return
+            self._last_purge = time.monotonic()
+        self.purge()
@@ -0,0 +1,296 @@
+"""Duplicate patient detection
+
+Patients are never compared against the whole table. Each patient gets a
+handful of blocking keys (phonetic name codes combined with birthday or
+district, normalized contact numbers, normalized NIC) stored in
+`patient_blocking_keys`; only patients sharing at least one key are scored.
+Keys are written in the same transaction as every save, so the index stays
+current without rebuilds.
+
+Check the form being edited with find_duplicate_candidates(); scan the whole
+table with:
+
+    python duplicates.py --out duplicate_pairs.csv
+"""
+import argparse
+import csv
+import re
+import sys
+from difflib import SequenceMatcher
+from itertools import combinations
+
+import mysql.connector
+
+from patients import split_contact_numbers
+from settings import DB_CONFIG
+
+CANDIDATE_LIMIT = 50
+MATCH_THRESHOLD = 0.75
+# Blocks larger than this are too generic to be useful (e.g. one very common name + district)
+MAX_BLOCK_SIZE = 200
+SCAN_CHUNK = 10000  # blocking-key rows read per query by the full-table scan
+
+SCORE_WEIGHTS = {'name': 0.45, 'nic': 0.25, 'birthday': 0.15, 'contact': 0.15}
+CANDIDATE_COLUMNS = "id, full_name, other_names, birthday, district, nic, phn, contact_numbers"
+
+SOUNDEX_CODES = {
+    **dict.fromkeys('BFPV', '1'), **dict.fromkeys('CGJKQSXZ', '2'), **dict.fromkeys('DT', '3'),
+    'L': '4', **dict.fromkeys('MN', '5'), 'R': '6',
+}
+
+
+def soundex(word):
+    """American Soundex code, e.g. 'Perera' -> 'P660'"""
+    word = re.sub(r'[^A-Z]', '', word.upper())
+    if not word:
+        return ''
+    code, previous = word[0], SOUNDEX_CODES.get(word[0], '')
+    for char in word[1:]:
+        digit = SOUNDEX_CODES.get(char, '')
+        if digit and digit != previous:
+            code += digit
+        if char not in 'HW':
+            previous = digit
+    return (code + '000')[:4]
+
+
+def name_tokens(*names):
+    return [token for name in names if name for token in re.split(r'[^A-Za-z]+', name.upper()) if len(token) > 1]
+
+
+def normalize_nic(nic):
+    """Old 9-digit+V NICs and new 12-digit NICs map to the same 12-digit form"""
+    nic = re.sub(r'[^0-9VX]', '', (nic or '').upper())
+    if re.fullmatch(r'\d{9}[VX]', nic):
+        return f"19{nic[:5]}0{nic[5:9]}"
+    return nic if re.fullmatch(r'\d{12}', nic) else ''
+
+
+def normalize_phones(contact_numbers):
+    """Last 9 digits of each number (drops 0 / +94 prefixes)"""
+    return sorted({number[-9:] for number in split_contact_numbers(contact_numbers)})
+
+
+def blocking_keys(patient):
+    """Keys under which this patient must be compared with others"""
+    tokens = name_tokens(patient.get('full_name'), patient.get('other_names'))
+    codes = sorted({soundex(token) for token in tokens})
+    birthday = str(patient.get('birthday') or '')
+    district = (patient.get('district') or '').upper()
+
+    keys = set()
+    if tokens:
+        first, last = soundex(tokens[0]), soundex(tokens[-1])
+        if birthday:
+            keys.add(f"nb:{'|'.join(sorted({first, last}))}|{birthday}")
+            keys.add(f"sb:{last}|{birthday}")
+        if district:
+            keys.add(f"nd:{'|'.join(codes)}|{district}")
+    keys.update(f"c:{phone}" for phone in normalize_phones(patient.get('contact_numbers')))
+    nic = normalize_nic(patient.get('nic'))
+    if nic:
+        keys.add(f"nic:{nic}")
+    return sorted(key[:120] for key in keys)
+
+
+def index_patient(cursor, patient_id, patient):
+    """(Re)write a patient's blocking keys inside the caller's transaction"""
+    cursor.execute("DELETE FROM patient_blocking_keys WHERE patient_id = %s", (patient_id,))
+    keys = blocking_keys(patient)
+    if keys:
+        cursor.executemany(
+            "INSERT IGNORE INTO patient_blocking_keys (key_value, patient_id) VALUES (%s, %s)",
+            [(key, patient_id) for key in keys]
+        )
+
+
+def index_all_patients(cursor, chunk=1000):
+    """Migration step: build blocking keys for every existing patient"""
+    last_id = 0
+    while True:
+        cursor.execute(
+            f"SELECT {CANDIDATE_COLUMNS} FROM patients WHERE id > %s ORDER BY id LIMIT %s", (last_id, chunk)
+        )
+        columns = [column[0] for column in cursor.description]
+        rows = [dict(zip(columns, row)) for row in cursor.fetchall()]
+        if not rows:
+            return
+        cursor.executemany(
+            "INSERT IGNORE INTO patient_blocking_keys (key_value, patient_id) VALUES (%s, %s)",
+            [(key, row['id']) for row in rows for key in blocking_keys(row)]
+        )
+        last_id = rows[-1]['id']
+
+
+def _similarity(a, b):
+    return SequenceMatcher(None, a, b).ratio()
+
+
+def score_pair(a, b):
+    """Return (score 0..1, reasons) comparing two patients on the fields both have"""
+    parts, reasons = {}, []
+
+    name_a = ' '.join(sorted(name_tokens(a.get('full_name'), a.get('other_names'))))
+    name_b = ' '.join(sorted(name_tokens(b.get('full_name'), b.get('other_names'))))
+    if name_a and name_b:
+        parts['name'] = _similarity(name_a, name_b)
+        reasons.append(f"name {parts['name']:.0%}")
+
+    nic_a, nic_b = normalize_nic(a.get('nic')), normalize_nic(b.get('nic'))
+    if nic_a and nic_b:
+        parts['nic'] = 1.0 if nic_a == nic_b else _similarity(nic_a, nic_b) * 0.8
+        reasons.append("same NIC" if nic_a == nic_b else f"NIC {parts['nic']:.0%}")
+
+    if a.get('birthday') and b.get('birthday'):
+        parts['birthday'] = 1.0 if str(a['birthday']) == str(b['birthday']) else 0.0
+        if parts['birthday']:
+            reasons.append("same birthday")
+
+    phones_a, phones_b = set(normalize_phones(a.get('contact_numbers'))), set(normalize_phones(b.get('contact_numbers')))
+    if phones_a and phones_b:
+        parts['contact'] = 1.0 if phones_a & phones_b else 0.0
+        if parts['contact']:
+            reasons.append("shared phone")
+
+    if not parts:
+        return 0.0, reasons
+    total_weight = sum(SCORE_WEIGHTS[name] for name in parts)
+    score = sum(SCORE_WEIGHTS[name] * value for name, value in parts.items()) / total_weight
+    return score, reasons
+
+
+def usable_keys(cursor, keys):
+    """The keys whose blocks are no larger than MAX_BLOCK_SIZE (each count stops at MAX_BLOCK_SIZE + 1)"""
+    cursor.execute(
+        " UNION ALL ".join(
+            ["SELECT %s AS key_value, COUNT(*) AS size FROM "
+             "(SELECT 1 FROM patient_blocking_keys WHERE key_value = %s LIMIT %s) AS block"] * len(keys)
+        ),
+        [value for key in keys for value in (key, key, MAX_BLOCK_SIZE + 1)]
+    )
+    return [row['key_value'] for row in cursor.fetchall() if row['size'] <= MAX_BLOCK_SIZE]
+
+
+def find_duplicate_candidates(conn, patient, exclude_id=None, threshold=MATCH_THRESHOLD):
+    """Scored candidates for one (possibly unsaved) patient, best first"""
+    keys = blocking_keys(patient)
+    if not keys:
+        return []
+
+    cursor = conn.cursor(dictionary=True)
+    keys = usable_keys(cursor, keys)
+    if not keys:
+        cursor.close()
+        return []
+    placeholders = ", ".join(["%s"] * len(keys))
+    cursor.execute(
+        f"SELECT patient_id, COUNT(*) AS shared FROM patient_blocking_keys "
+        f"WHERE key_value IN ({placeholders}) GROUP BY patient_id ORDER BY shared DESC LIMIT %s",
+        (*keys, CANDIDATE_LIMIT)
+    )
+    ids = [row['patient_id'] for row in cursor.fetchall() if row['patient_id'] != exclude_id]
+    if not ids:
+        cursor.close()
+        return []
+
+    cursor.execute(
+        f"SELECT {CANDIDATE_COLUMNS} FROM patients WHERE id IN ({', '.join(['%s'] * len(ids))})", ids
+    )
+    candidates = []
+    for row in cursor.fetchall():
+        score, reasons = score_pair(patient, row)
+        if score >= threshold:
+            candidates.append({**row, 'score': round(score, 3), 'reasons': ', '.join(reasons)})
+    cursor.close()
+    return sorted(candidates, key=lambda c: c['score'], reverse=True)
+
+
+def iter_blocks(conn, oversized):
+    """Yield (key_value, patient_ids) for every block of 2..MAX_BLOCK_SIZE patients, in key order
+
+    Reads the key index in primary-key order, SCAN_CHUNK rows at a time.
+    Keys with more than MAX_BLOCK_SIZE patients are added to `oversized`.
+    """
+    cursor = conn.cursor()
+    position = ('', 0)
+    key, ids = None, []
+    while True:
+        cursor.execute(
+            "SELECT key_value, patient_id FROM patient_blocking_keys WHERE (key_value, patient_id) > (%s, %s) "
+            "ORDER BY key_value, patient_id LIMIT %s", (*position, SCAN_CHUNK)
+        )
+        rows = cursor.fetchall()
+        for key_value, patient_id in rows:
+            if key_value != key:
+                if MAX_BLOCK_SIZE >= len(ids) >= 2:
+                    yield key, ids
+                key, ids = key_value, []
+            if len(ids) <= MAX_BLOCK_SIZE:
+                ids.append(patient_id)
+                if len(ids) > MAX_BLOCK_SIZE:
+                    oversized.add(key)
+        if len(rows) < SCAN_CHUNK:
+            break
+        position = rows[-1]
+    cursor.close()
+    if MAX_BLOCK_SIZE >= len(ids) >= 2:
+        yield key, ids
+
+
+def find_all_duplicates(conn, threshold=MATCH_THRESHOLD):
+    """Yield (score, reasons, patient_a, patient_b) for every likely duplicate pair in the table
+
+    A pair sharing several keys is scored once, in the block of the first
+    (lowest) key they share that isn't oversized, so no table-wide set of
+    seen pairs is needed.
+    """
+    oversized = set()
+    cursor = conn.cursor(dictionary=True)
+    for key, ids in iter_blocks(conn, oversized):
+        placeholders = ', '.join(['%s'] * len(ids))
+        cursor.execute(
+            f"SELECT patient_id, key_value FROM patient_blocking_keys "
+            f"WHERE patient_id IN ({placeholders}) AND key_value < %s", (*ids, key)
+        )
+        earlier_keys = {}
+        for row in cursor.fetchall():
+            if row['key_value'] not in oversized:
+                earlier_keys.setdefault(row['patient_id'], set()).add(row['key_value'])
+        cursor.execute(f"SELECT {CANDIDATE_COLUMNS} FROM patients WHERE id IN ({placeholders})", ids)
+        patients = {row['id']: row for row in cursor.fetchall()}
+        for id_a, id_b in combinations(ids, 2):
+            if earlier_keys.get(id_a, set()) & earlier_keys.get(id_b, set()):
+                continue  # already scored under an earlier shared key
+            if id_a in patients and id_b in patients:
+                score, reasons = score_pair(patients[id_a], patients[id_b])
+                if score >= threshold:
+                    yield score, reasons, patients[id_a], patients[id_b]
+    cursor.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Find likely duplicate patients across the whole table")
+    parser.add_argument("--out", default="duplicate_pairs.csv")
+    parser.add_argument("--threshold", type=float, default=MATCH_THRESHOLD)
+    args = parser.parse_args(argv)
+
+    conn = mysql.connector.connect(**DB_CONFIG)
+    count = 0
+    try:
+        with open(args.out, 'w', newline='', encoding='utf-8') as f:
+            writer = csv.writer(f)
+            writer.writerow(['score', 'reasons', 'phn_a', 'name_a', 'phn_b', 'name_b'])
+            for score, reasons, a, b in find_all_duplicates(conn, args.threshold):
+                writer.writerow([f"{score:.3f}", ', '.join(reasons), a['phn'], a['full_name'], b['phn'], b['full_name']])
+                count += 1
+    except mysql.connector.Error as err:
+        print(f"Duplicate scan failed: {err}", file=sys.stderr)
+        return 1
+    finally:
+        conn.close()
+    print(f"Wrote {count} candidate pair(s) to {args.out}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
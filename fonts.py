@@ -0,0 +1,70 @@
+"""Font registry for label rendering
+
+Each (face, size) pair is resolved and loaded once per process. Faces are
+looked up by file name in LABEL_FONT_DIRS, the repo's fonts/ directory and
+the usual system font folders. If none of the candidates exist, or the file
+found cannot be loaded, get_font() raises FontNotFoundError: labels are never
+rendered in a substitute typeface.
+"""
+import os
+from functools import lru_cache
+
+from PIL import ImageFont
+
+from settings import LABEL_FONT_DIRS
+
+# Candidate font files per face, in order of preference
+FONT_FACES = {
+    'regular': ('arial.ttf', 'Arial.ttf', 'LiberationSans-Regular.ttf', 'DejaVuSans.ttf'),
+    'bold': ('arialbd.ttf', 'Arial Bold.ttf', 'LiberationSans-Bold.ttf', 'DejaVuSans-Bold.ttf'),
+    'mono': ('cour.ttf', 'Courier New.ttf', 'LiberationMono-Regular.ttf', 'DejaVuSansMono.ttf'),
+}
+
+BUNDLED_FONT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fonts')
+
+SYSTEM_FONT_DIRS = (
+    os.path.join(os.environ.get('WINDIR', r'C:\Windows'), 'Fonts'),
+    '/Library/Fonts',
+    '/System/Library/Fonts/Supplemental',
+    '/usr/share/fonts/truetype/msttcorefonts',
+    '/usr/share/fonts/truetype/liberation',
+    '/usr/share/fonts/truetype/liberation2',
+    '/usr/share/fonts/truetype/dejavu',
+    '/usr/share/fonts/TTF',
+)
+
+
+class FontNotFoundError(RuntimeError):
+    """No usable scalable font for a label face"""
+
+
+def font_search_dirs():
+    return [*LABEL_FONT_DIRS, BUNDLED_FONT_DIR, *SYSTEM_FONT_DIRS]
+
+
+@lru_cache(maxsize=None)
+def resolve_font_path(face):
+    """Return the first existing font file for `face`"""
+    if face not in FONT_FACES:
+        raise FontNotFoundError(f"Unknown font face: {face!r}")
+
+    for directory in font_search_dirs():
+        for file_name in FONT_FACES[face]:
+            path = os.path.join(directory, file_name)
+            if os.path.isfile(path):
+                return path
+
+    raise FontNotFoundError(
+        f"No {face} font found (tried {', '.join(FONT_FACES[face])} in {', '.join(font_search_dirs())}); "
+        f"install one or add its directory to LABEL_FONT_DIRS"
+    )
+
+
+@lru_cache(maxsize=None)
+def get_font(face, size):
+    """Load a label font once per process and reuse it for every render"""
+    path = resolve_font_path(face)
+    try:
+        return ImageFont.truetype(path, size)
+    except OSError as err:
+        raise FontNotFoundError(f"Cannot load {face} font at size {size}: {err}") from err
@@ -0,0 +1,76 @@
+"""Job table shared by the background queues (printing, journaled saves)
+
+Keeps the status of recent jobs for the UI in submission order, hands the
+worker the oldest queued job whose retry delay has passed, and forgets the
+oldest finished jobs beyond the history limit.
+"""
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+
+
+class JobQueue:
+    """Base for a single-worker queue; subclasses run `_next_job()` in their thread
+
+    A job is queued until the worker takes it (status `active_status`), and the
+    subclass then sets it to a finished status or back to queued with a later
+    `next_attempt`. Fields listed in `hidden_fields` are not reported.
+    """
+
+    active_status = 'running'
+    finished_statuses = ('done', 'failed')
+    hidden_fields = ('next_attempt',)
+
+    def __init__(self, history=200):
+        self.history = history
+        self._jobs = OrderedDict()
+        self._lock = threading.Lock()
+        self._ready = threading.Condition(self._lock)
+
+    def _add_job(self, job_id, **fields):
+        """Record a new queued job and wake the worker; call with `_lock` held"""
+        job = {'id': job_id, **fields}
+        job.update({
+            'status': 'queued',
+            'attempts': 0,
+            'error': None,
+            'submitted_at': datetime.now().strftime('%H:%M:%S'),
+            'next_attempt': 0.0,
+        })
+        self._jobs[job_id] = job
+        # Forget the oldest finished jobs beyond the history limit
+        while len(self._jobs) > self.history:
+            oldest = next(iter(self._jobs))
+            if self._jobs[oldest]['status'] not in self.finished_statuses:
+                break
+            del self._jobs[oldest]
+        self._ready.notify()
+        return job
+
+    def _public(self, job):
+        return {k: v for k, v in job.items() if k not in self.hidden_fields}
+
+    def status(self, job_id):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return self._public(job) if job else None
+
+    def jobs(self):
+        with self._lock:
+            return [self._public(job) for job in reversed(self._jobs.values())]
+
+    def _next_job(self):
+        """Wait for the oldest queued job whose retry delay has passed"""
+        with self._lock:
+            while True:
+                now = time.monotonic()
+                waiting = [job for job in self._jobs.values() if job['status'] == 'queued']
+                due = [job for job in waiting if job['next_attempt'] <= now]
+                if due:
+                    job = due[0]
+                    job['status'] = self.active_status
+                    job['attempts'] += 1
+                    return job
+                timeout = min((job['next_attempt'] - now for job in waiting), default=None)
+                self._ready.wait(timeout)
@@ -0,0 +1,163 @@
+"""Label images for the browser: content-addressed media URLs and the print controls
+
+With LABEL_MEDIA_URL set, the UI no longer base64-inlines a label into the
+page for every reprint. It points the preview, the print popup and the
+download at one URL served by the API:
+
+    GET {LABEL_MEDIA_URL}/media/{kind}/{phn}/{digest}.png
+
+The digest covers everything printed on the image, render profile (DPI and
+mode) included (label_cache_key, barcode_cache_key), so a URL never changes
+meaning and is served with a long immutable Cache-Control and an ETag: a
+browser or proxy that has seen it once never downloads it again. Labels
+with the timestamp burnt in (LABEL_TIMESTAMP=image) differ on every print
+and keep the inline path, as does everything while LABEL_MEDIA_SECRET is
+unset (the API refuses /media then).
+"""
+import hashlib
+import hmac
+import json
+from urllib.parse import quote
+
+from labels import barcode_cache_key, encode_png, generate_barcode, get_label_png, label_cache_key
+from settings import LABEL_MEDIA_SECRET, LABEL_MEDIA_URL, LABEL_TIMESTAMP
+
+MEDIA_KINDS = ('label', 'barcode')  # full patient label, or the bare barcode strip
+DIGEST_LENGTH = 32
+
+
+def media_digest(kind, patient_data):
+    """Content digest for a patient's media image (keyed with LABEL_MEDIA_SECRET)"""
+    key = label_cache_key(patient_data) if kind == 'label' else barcode_cache_key(patient_data)
+    message = repr((kind,) + key).encode()
+    return hmac.new(LABEL_MEDIA_SECRET.encode(), message, hashlib.sha256).hexdigest()[:DIGEST_LENGTH]
+
+
+def media_url(kind, patient_data):
+    """URL of the patient's label or barcode image, or None when it must be inlined"""
+    if not LABEL_MEDIA_URL or not LABEL_MEDIA_SECRET or (kind == 'label' and LABEL_TIMESTAMP == 'image'):
+        return None
+    phn = quote(patient_data['phn'], safe='')
+    return f"{LABEL_MEDIA_URL}/media/{kind}/{phn}/{media_digest(kind, patient_data)}.png"
+
+
+def render_media(kind, patient_data):
+    """PNG bytes behind media_url(kind, patient_data)"""
+    if kind == 'label':
+        png_bytes, _ = get_label_png(patient_data)
+        return png_bytes
+    return encode_png(generate_barcode(patient_data))
+
+
+def print_controls_html(patient_phn, img_src, timestamp_html="", download=False):
+    """Print button (and, with `download`, a download button) for the label at img_src
+
+    img_src is a data: URI or a media URL. The download fetches the same URL,
+    so it comes from the browser cache once the preview has loaded.
+    """
+    download_button = """
+            <button onclick="downloadLabel()"
+                    style="padding: 12px 24px; background-color: #1976D2; color: white; border: none; border-radius: 4px; cursor: pointer; font-size: 16px;">
+                📥 Download
+            </button>""" if download else ""
+
+    return f"""
+        <div style="text-align: center; margin: 15px 0;">
+            <button onclick="printDirectImage()"
+                    style="padding: 12px 24px; background-color: #4CAF50; color: white; border: none; border-radius: 4px; cursor: pointer; font-size: 16px;">
+                🖨️ Print Ultra High-Quality Barcode
+            </button>{download_button}
+        </div>
+
+        <script>
+        var labelSrc = {json.dumps(img_src)};
+
+        function printDirectImage() {{
+            // Create a new window for printing
+            var printWindow = window.open('', '_blank');
+
+            if (!printWindow) {{
+                alert('Please allow pop-ups for this site to print the barcode.');
+                return;
+            }}
+
+            // Write the HTML content with exact dimensions for 10cm x 4.3cm
+            printWindow.document.write(`
+                <!DOCTYPE html>
+                <html>
+                <head>
+                    <title>Print Barcode - {patient_phn}</title>
+                    <style>
+                        @page {{
+                            size: 100mm 43mm;
+                            margin: 0;
+                            padding: 0;
+                        }}
+                        body {{
+                            margin: 0;
+                            padding: 0;
+                            width: 100mm;
+                            height: 43mm;
+                            display: flex;
+                            justify-content: center;
+                            align-items: center;
+                            background: white;
+                        }}
+                        .barcode-container {{
+                            position: relative;
+                            width: 100%;
+                            height: 100%;
+                            display: flex;
+                            justify-content: center;
+                            align-items: center;
+                        }}
+                        .timestamp {{
+                            position: absolute;
+                            left: 0;
+                            right: 0;
+                            text-align: center;
+                            font: bold 2.7mm/1 Arial, Helvetica, sans-serif;
+                        }}
+                        img {{
+                            width: 100%;
+                            height: 100%;
+                            object-fit: contain;
+                            image-rendering: crisp-edges;
+                        }}
+                    </style>
+                </head>
+                <body>
+                    <div class="barcode-container">
+                        <img src="${{labelSrc}}"
+                             alt="Patient Barcode: {patient_phn}"
+                             onload="setTimeout(function() {{
+                                 window.print();
+                                 setTimeout(function() {{ window.close(); }}, 100);
+                             }}, 500)">
+                        {timestamp_html}
+                    </div>
+                </body>
+                </html>
+            `);
+
+            printWindow.document.close();
+        }}
+
+        function downloadLabel() {{
+            fetch(labelSrc).then(function(response) {{
+                if (!response.ok) {{ throw new Error(response.status); }}
+                return response.blob();
+            }}).then(function(blob) {{
+                var link = document.createElement('a');
+                link.href = URL.createObjectURL(blob);
+                link.download = 'barcode_{patient_phn}.png';
+                document.body.appendChild(link);
+                link.click();
+                link.remove();
+                setTimeout(function() {{ URL.revokeObjectURL(link.href); }}, 1000);
+            }}).catch(function() {{
+                window.open(labelSrc, '_blank');
+            }});
+        }}
+        </script>
+        """
@@ -0,0 +1,81 @@
+"""Declarative label layouts, compiled by labels.LabelTemplate
+
+Each template is a page size plus a list of elements. Measurements are in
+600 DPI pixels (scaled to the render profile when compiled), fonts are
+(face, size) pairs for fonts.get_font, and text is a format string over
+patient fields:
+
+    {'text': "Tel: {contact_numbers}", 'font': ('bold', 80), 'advance': 80}
+
+Elements without an explicit 'y' are stacked top to bottom from the
+template's 'top', each moving the next down by its 'advance' (a barcode
+advances by its own height); 'dy' nudges one element without moving the
+rest. An 'optional' element is skipped, with no advance, when its fields
+are empty. Text without fields is static: it is drawn once into the
+template's base layer, as long as no optional element comes before it.
+
+Text is centred in its box ('x' and 'width', default the full label) unless
+'align' is 'left'. Too-wide text is fitted by measured width: 'fit' of
+'shrink' first steps the font down to 'min_size', then anything still too
+wide is cut with an ellipsis.
+
+Element types: 'text' (default), 'barcode' (the PHN, 'width_cm' wide and
+'height_cm' tall) and 'timestamp' (print time, drawn when the timestamp is
+burnt in; its position is the print-page overlay otherwise).
+"""
+
+HOSPITAL_NAME = "GENERAL HOSPITAL ABCDEFG"
+
+TEMPLATES = {
+    # The original 10cm x 4.3cm registration label
+    'patient': {
+        'size_mm': (100, 43),
+        'top': 60,
+        'elements': (
+            {'text': HOSPITAL_NAME, 'font': ('bold', 80), 'advance': 100},
+            {'text': "{title} {full_name}", 'font': ('bold', 64), 'advance': 80, 'fit': 'shrink', 'min_size': 48},
+            {'text': "{address_line1}", 'font': ('bold', 64), 'advance': 70, 'optional': True},
+            {'text': "Tel: {contact_numbers}", 'font': ('bold', 80), 'advance': 80},
+            {'type': 'barcode', 'width_cm': 8.0},
+            {'type': 'timestamp', 'font': ('bold', 64), 'dy': -40},
+        ),
+    },
+    # Adult wristband insert: details on the left, barcode on the right
+    'wristband': {
+        'size_mm': (120, 25),
+        'top': 30,
+        'elements': (
+            {'text': "{title} {full_name}", 'font': ('bold', 72), 'advance': 95, 'x': 50, 'width': 1450,
+             'align': 'left', 'fit': 'shrink', 'min_size': 48},
+            {'text': "DOB: {birthday}   {gender}", 'font': ('bold', 56), 'advance': 80, 'x': 50, 'width': 1450,
+             'align': 'left'},
+            {'text': "PHN: {phn}", 'font': ('bold', 56), 'advance': 80, 'x': 50, 'width': 1450, 'align': 'left'},
+            {'text': HOSPITAL_NAME, 'font': ('regular', 44), 'x': 50, 'width': 1450, 'align': 'left', 'y': 470},
+            {'type': 'barcode', 'width_cm': 5.5, 'height_cm': 1.6, 'x': 1520, 'width': 1300, 'y': 100},
+        ),
+    },
+    # Specimen tube: small enough to wrap a 13mm tube
+    'specimen': {
+        'size_mm': (50, 25),
+        'top': 25,
+        'elements': (
+            {'text': "{title} {full_name}", 'font': ('bold', 52), 'advance': 65, 'fit': 'shrink', 'min_size': 36},
+            {'text': "{birthday}  {gender}", 'font': ('regular', 40), 'advance': 60},
+            {'type': 'barcode', 'width_cm': 4.6, 'height_cm': 1.3},
+            {'type': 'timestamp', 'font': ('regular', 40), 'dy': 10},
+        ),
+    },
+    # Medical records folder spine/front label
+    'folder': {
+        'size_mm': (102, 51),
+        'top': 50,
+        'elements': (
+            {'text': HOSPITAL_NAME, 'font': ('bold', 56), 'advance': 95},
+            {'text': "{full_name}", 'font': ('bold', 104), 'advance': 135, 'fit': 'shrink', 'min_size': 64},
+            {'text': "PHN: {phn}", 'font': ('bold', 80), 'advance': 110},
+            {'text': "{address_line1}", 'font': ('regular', 56), 'advance': 80, 'optional': True},
+            {'text': "DOB: {birthday}   Tel: {contact_numbers}", 'font': ('regular', 56), 'advance': 90},
+            {'type': 'barcode', 'width_cm': 8.5},
+        ),
+    },
+}
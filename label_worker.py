@@ -0,0 +1,104 @@
+"""Label rendering service shared by every app replica
+
+    python label_worker.py --port 8700 --workers 4
+
+App and API replicas set LABEL_WORKER_URL=http://<host>:8700 (several
+comma-separated URLs are used round-robin) and send label renders here
+instead of spending web-process CPU on them. Any replica can submit to any
+worker: requests carry only the printed fields, and each worker process
+keeps its own label cache, so a patient reprinted from different replicas
+is rendered once per worker.
+
+    POST /label?template=...   label fields                   -> PNG, X-Timestamp-Top header
+    POST /page    {"patient", "with_timestamp", "template"}    -> PNG page for batch printing
+    GET  /health                                      -> cache stats
+    GET  /metrics                                     -> Prometheus metrics
+
+Rendering is CPU-bound, so run one worker process per core.
+"""
+import argparse
+
+import uvicorn
+from starlette.applications import Starlette
+from starlette.concurrency import run_in_threadpool
+from starlette.responses import JSONResponse, PlainTextResponse, Response
+from starlette.routing import Route
+
+from batch_labels import render_label_page
+from label_templates import TEMPLATES
+from labels import LABEL_FIELDS, barcode_cache, get_label_png, label_png_cache
+from metrics import register_gauges, render_prometheus
+from settings import API_HOST, LABEL_WORKER_PORT
+
+
+def template_name(source):
+    template = source.get('template') or 'patient'
+    if template not in TEMPLATES:
+        raise ValueError(f"unknown label template {template!r}")
+    return template
+
+
+async def label_fields(request):
+    body = await request.json()
+    if not isinstance(body, dict) or not body.get('phn'):
+        raise ValueError("expected a JSON object with at least 'phn'")
+    return {field: body.get(field) for field in LABEL_FIELDS}
+
+
+async def render_label(request):
+    png_bytes, timestamp_top = await run_in_threadpool(
+        get_label_png, await label_fields(request), local=True, template=template_name(request.query_params)
+    )
+    headers = {'X-Timestamp-Top': repr(timestamp_top)} if timestamp_top is not None else None
+    return Response(png_bytes, media_type='image/png', headers=headers)
+
+
+async def render_page(request):
+    body = await request.json()
+    patient = body.get('patient') if isinstance(body, dict) else None
+    if not isinstance(patient, dict) or not patient.get('phn'):
+        raise ValueError("expected {'patient': {...}, 'with_timestamp': bool}")
+    png_bytes = await run_in_threadpool(
+        render_label_page, patient, bool(body.get('with_timestamp')), template_name(body)
+    )
+    return Response(png_bytes, media_type='image/png')
+
+
+async def health(request):
+    return JSONResponse({'status': 'ok', 'label_png_cache': label_png_cache.stats(),
+                         'barcode_cache': barcode_cache.stats()})
+
+
+async def metrics(request):
+    return PlainTextResponse(render_prometheus(), media_type='text/plain; version=0.0.4')
+
+
+async def bad_request(request, exc):
+    return JSONResponse({'error': str(exc)}, status_code=400)
+
+
+app = Starlette(
+    routes=[
+        Route('/label', render_label, methods=['POST']),
+        Route('/page', render_page, methods=['POST']),
+        Route('/health', health, methods=['GET']),
+        Route('/metrics', metrics, methods=['GET']),
+    ],
+    exception_handlers={ValueError: bad_request},
+)
+
+register_gauges('barcode_cache', barcode_cache.stats)
+register_gauges('label_png_cache', label_png_cache.stats)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run a label rendering worker pool")
+    parser.add_argument("--host", default=API_HOST)
+    parser.add_argument("--port", type=int, default=LABEL_WORKER_PORT)
+    parser.add_argument("--workers", type=int, default=1, help="worker processes (one per core)")
+    args = parser.parse_args(argv)
+    uvicorn.run("label_worker:app", host=args.host, port=args.port, workers=args.workers, access_log=False)
+
+
+if __name__ == "__main__":
+    main()
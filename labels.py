@@ -0,0 +1,366 @@
+"""Patient label and barcode rendering
+
+Rendered barcode strips and finished label PNGs are kept in process-wide LRU
+caches keyed by the PHN, the template, the patient fields printed on it and
+LABEL_LAYOUT_VERSION, so reprinting the same patient skips rendering and PNG
+encoding entirely. Bump LABEL_LAYOUT_VERSION whenever the drawing code changes.
+
+Layouts are declared in label_templates (patient, wristband, specimen,
+folder) and compiled once per process into a LabelTemplate, whose static
+text is pre-drawn into a base layer. Labels are drawn directly at the
+LABEL_PROFILE resolution and colour mode (e.g. '203-mono': 1-bit at a
+thermal printer's native 203 DPI); the templates are specified in 600 DPI
+pixels and scaled by layout_px(), and barcode modules are sized in whole
+pixels at the target DPI, so bars stay crisp.
+
+When LABEL_WORKER_URL is set, cache misses are rendered by the shared label
+worker pool (label_worker.py) instead of in this process, falling back to
+local rendering if no worker answers.
+"""
+import functools
+import itertools
+import json
+import string
+import urllib.request
+from datetime import datetime
+from io import BytesIO
+
+from PIL import Image, ImageDraw
+
+from cache import LRUCache
+from code128 import render_code128
+from fonts import get_font
+from label_templates import TEMPLATES
+from metrics import span, timed
+from settings import (
+    LABEL_CACHE_MAX_MB, LABEL_CACHE_TTL, LABEL_PROFILE, LABEL_TIMESTAMP, LABEL_WORKER_TIMEOUT, LABEL_WORKER_URLS
+)
+
+LABEL_LAYOUT_VERSION = 4
+LAYOUT_DPI = 600  # the pixel measurements in label_templates are at this resolution
+FIT_MARGIN = 40  # layout px kept clear on each side of fitted text
+
+# Render profile modes: full colour (the original output), 8-bit grey, or 1-bit
+# black/white for thermal printers (smallest canvas, bilevel PNG)
+PROFILE_MODES = {'rgb': 'RGB', 'gray': 'L', 'mono': '1'}
+
+
+def parse_render_profile(profile):
+    """'203-mono' -> (203, '1'); raises ValueError for anything else"""
+    dpi, _, mode = profile.partition('-')
+    if not dpi.isdigit() or int(dpi) < 100 or mode not in PROFILE_MODES:
+        raise ValueError(
+            f"LABEL_PROFILE must be '<dpi>-<{'|'.join(PROFILE_MODES)}>' with dpi >= 100, e.g. '203-mono'; got {profile!r}"
+        )
+    return int(dpi), PROFILE_MODES[mode]
+
+
+LABEL_DPI, LABEL_MODE = parse_render_profile(LABEL_PROFILE)
+
+
+def cm_to_px(cm, dpi=LABEL_DPI):
+    return int(round(cm / 2.54 * dpi))
+
+
+def layout_px(px):
+    """A 600 DPI layout measurement (offset, font size) at the render profile's DPI"""
+    return int(round(px * LABEL_DPI / LAYOUT_DPI))
+
+
+INK, PAPER = {'RGB': ((0, 0, 0), (255, 255, 255)), 'L': (0, 255), '1': (0, 1)}[LABEL_MODE]
+BARCODE_MODE = 'L' if LABEL_MODE == 'RGB' else LABEL_MODE  # black/white either way; L is a third of RGB
+
+# Barcode strip geometry (the strip is 1.76cm tall, as the old python-barcode image was)
+BARCODE_TOP_CM = 0.025
+BARCODE_BAR_HEIGHT_CM = 1.1
+BARCODE_TEXT_GAP_CM = 0.1
+BARCODE_TEXT_CM = 0.37
+BARCODE_HEIGHT_CM = 1.76
+
+barcode_cache = LRUCache(LABEL_CACHE_MAX_MB * 1024 * 1024 // 2, ttl=LABEL_CACHE_TTL, name="barcode")
+label_png_cache = LRUCache(LABEL_CACHE_MAX_MB * 1024 * 1024 // 2, ttl=LABEL_CACHE_TTL, name="label_png")
+
+
+class BarcodeError(ValueError):
+    """The PHN could not be encoded as a Code128 barcode"""
+
+
+_label_workers = itertools.cycle(LABEL_WORKER_URLS) if LABEL_WORKER_URLS else None
+
+
+def label_cache_key(patient_data, template='patient'):
+    """Everything that affects the rendered label: layout version, render profile, template and printed fields"""
+    return (LABEL_LAYOUT_VERSION, LABEL_DPI, LABEL_MODE, template) + tuple(
+        str(patient_data.get(field) or '') for field in TEMPLATE_FIELDS[template]
+    )
+
+
+def barcode_cache_key(patient_data, target_width_cm=8.0, height_cm=BARCODE_HEIGHT_CM):
+    """Everything that affects the rendered barcode strip: layout version, render profile, PHN and size"""
+    return (LABEL_LAYOUT_VERSION, LABEL_DPI, LABEL_MODE, patient_data.get('phn') or "PHN-NOT-FOUND",
+            target_width_cm, height_cm)
+
+
+@timed("label.encode_png")
+def encode_png(img):
+    """Encode a label or barcode image as a PNG tagged with the profile DPI (1-bit images stay bilevel)"""
+    buffer = BytesIO()
+    img.save(buffer, format="PNG", dpi=(LABEL_DPI, LABEL_DPI))
+    return buffer.getvalue()
+
+
+def _text_fields(text):
+    return [field for _, field, _, _ in string.Formatter().parse(text) if field]
+
+
+# Patient fields each template prints (the barcode prints the PHN); any change to these must produce a new render
+TEMPLATE_FIELDS = {
+    name: tuple(dict.fromkeys(['phn'] + [field for element in spec['elements']
+                                         for field in _text_fields(element.get('text', ''))]))
+    for name, spec in TEMPLATES.items()
+}
+LABEL_FIELDS = tuple(dict.fromkeys(field for fields in TEMPLATE_FIELDS.values() for field in fields))
+
+
+class LabelTemplate:
+    """A label_templates entry compiled for the render profile
+
+    Geometry is scaled and fonts loaded once; static text is drawn once into
+    `base`, which every render starts from as a copy, so only the patient's
+    fields are measured and drawn per label.
+    """
+
+    def __init__(self, name, spec):
+        self.name = name
+        self.width, self.height = (cm_to_px(mm / 10) for mm in spec['size_mm'])
+        self.fields = TEMPLATE_FIELDS[name]
+        self.base = Image.new(LABEL_MODE, (self.width, self.height), PAPER)
+        self.elements = [self._compile(element) for element in spec['elements']]
+        self.top = layout_px(spec.get('top', 0))
+
+        # Static text goes into the base layer while its position can't depend on the patient
+        draw = ImageDraw.Draw(self.base)
+        fixed = True
+        for element, y in self._positions(lambda element: True):
+            if element['optional']:
+                fixed = False
+            if element['kind'] == 'text' and not element['fields'] and (fixed or element['absolute']):
+                element['static'] = True
+                self._draw_text(draw, element, element['text'], y)
+
+    def _compile(self, raw):
+        kind = raw.get('type', 'text')
+        x = layout_px(raw.get('x', 0))
+        width = layout_px(raw['width']) if 'width' in raw else self.width - x
+        element = {
+            'kind': kind, 'text': raw.get('text', ''), 'fields': _text_fields(raw.get('text', '')),
+            'x': x, 'width': width, 'align': raw.get('align', 'center'),
+            'absolute': 'y' in raw, 'y': layout_px(raw.get('y', 0)), 'dy': layout_px(raw.get('dy', 0)),
+            'advance': layout_px(raw.get('advance', 0)), 'optional': raw.get('optional', False), 'static': False,
+        }
+        if kind == 'barcode':
+            element['width_cm'] = raw['width_cm']
+            element['height_cm'] = raw.get('height_cm', BARCODE_HEIGHT_CM)
+            element['advance'] = cm_to_px(element['height_cm'])
+        else:
+            face, size = raw['font']
+            sizes = [size]
+            if raw.get('fit') == 'shrink':
+                sizes += range(size - 4, raw.get('min_size', size) - 1, -4)
+            element['fonts'] = [get_font(face, layout_px(size)) for size in sizes]
+            element['fit_width'] = width - 2 * layout_px(FIT_MARGIN)
+        return element
+
+    def _positions(self, present):
+        """Yield (element, y) down the flow, skipping elements for which present(element) is false"""
+        y = self.top
+        for element in self.elements:
+            if not present(element):
+                continue
+            if element['absolute']:
+                yield element, element['y'] + element['dy']
+            else:
+                yield element, y + element['dy']
+                y += element['advance']
+
+    def layout(self, patient_data):
+        """(element, y) for everything on this patient's label"""
+        def present(element):
+            return not element['optional'] or any(patient_data.get(field) for field in element['fields'])
+        return self._positions(present)
+
+    def timestamp_top(self, patient_data):
+        """Position of the timestamp line as a fraction of the label height, or None without one"""
+        for element, y in self.layout(patient_data):
+            if element['kind'] == 'timestamp':
+                return y / self.height
+        return None
+
+    def _fit(self, element, text):
+        """(text, font, width) that fits element['fit_width']: smaller fonts first, then an ellipsis"""
+        for font in element['fonts']:
+            bbox = font.getbbox(text)
+            if bbox[2] - bbox[0] <= element['fit_width']:
+                return text, font, bbox[2] - bbox[0]
+
+        def measure(candidate):
+            bbox = font.getbbox(candidate)
+            return bbox[2] - bbox[0]
+
+        low, high = 0, len(text)  # longest prefix that still fits with the ellipsis
+        while low < high:
+            middle = (low + high + 1) // 2
+            if measure(text[:middle].rstrip() + "...") <= element['fit_width']:
+                low = middle
+            else:
+                high = middle - 1
+        text = text[:low].rstrip() + "..."
+        return text, font, measure(text)
+
+    def _draw_text(self, draw, element, text, y):
+        text, font, text_width = self._fit(element, text)
+        x = element['x'] if element['align'] == 'left' else element['x'] + (element['width'] - text_width) // 2
+        draw.text((x, y), text, font=font, fill=INK)
+
+    def render(self, patient_data, with_timestamp):
+        """Draw the label; returns (image, y position of the timestamp line or None)"""
+        img = self.base.copy()
+        draw = ImageDraw.Draw(img)
+        timestamp_y = None
+        for element, y in self.layout(patient_data):
+            if element['static']:
+                continue
+            if element['kind'] == 'barcode':
+                barcode_img = generate_barcode(patient_data, element['width_cm'], element['height_cm'])
+                img.paste(barcode_img, (element['x'] + (element['width'] - barcode_img.width) // 2, y))
+            elif element['kind'] == 'timestamp':
+                timestamp_y = y
+                if with_timestamp:
+                    self._draw_text(draw, element, datetime.now().strftime('%Y-%m-%d %H:%M:%S'), y)
+            else:
+                values = {field: '' if patient_data.get(field) is None else patient_data.get(field)
+                          for field in element['fields']}
+                self._draw_text(draw, element, element['text'].format(**values), y)
+        return img, timestamp_y
+
+
+@functools.lru_cache(maxsize=None)
+def get_template(name):
+    """The compiled template `name` (compiled on first use, once per process)"""
+    if name not in TEMPLATES:
+        raise ValueError(f"unknown label template {name!r} (choose from {', '.join(TEMPLATES)})")
+    with span("label.compile_template", template=name):
+        return LabelTemplate(name, TEMPLATES[name])
+
+
+@timed("label.generate_label_image")
+def generate_label_image(patient_data, with_timestamp=None, template='patient'):
+    """Render a label from a named template at the profile DPI"""
+    if with_timestamp is None:
+        with_timestamp = LABEL_TIMESTAMP == 'image'
+    img, _ = get_template(template).render(patient_data, with_timestamp)
+    return img
+
+
+def render_label_png(patient_data, template='patient'):
+    """Render (png_bytes, timestamp_top) in this process, bypassing the cache and label workers"""
+    compiled = get_template(template)
+    img, timestamp_y = compiled.render(patient_data, LABEL_TIMESTAMP == 'image')
+    timestamp_top = timestamp_y / compiled.height if LABEL_TIMESTAMP == 'print' and timestamp_y is not None else None
+    return encode_png(img), timestamp_top
+
+
+def label_timestamp_top(patient_data, template='patient'):
+    """The timestamp_top get_label_png would return, worked out from the template layout without rendering"""
+    if LABEL_TIMESTAMP != 'print':
+        return None
+    return get_template(template).timestamp_top(patient_data)
+
+
+def post_to_label_worker(path, payload):
+    """POST JSON to the next label worker; returns (body, headers). Raises OSError when unreachable"""
+    request = urllib.request.Request(
+        next(_label_workers) + path,
+        data=json.dumps(payload, default=str).encode(),
+        headers={'Content-Type': 'application/json'}
+    )
+    with span("label.worker_request", path=path), urllib.request.urlopen(request, timeout=LABEL_WORKER_TIMEOUT) as response:
+        return response.read(), response.headers
+
+
+@timed("label.get_label_png")
+def get_label_png(patient_data, local=False, template='patient'):
+    """Return (png_bytes, timestamp_top) for a patient label, from cache when possible
+
+    timestamp_top is where the print page should overlay the print time, as a
+    fraction of the label height, or None when no overlay is wanted. Misses go
+    to the label workers when configured, unless `local` is set.
+    """
+    burn_timestamp = LABEL_TIMESTAMP == 'image'
+    key = label_cache_key(patient_data, template)
+    if not burn_timestamp:
+        cached = label_png_cache.get(key)
+        if cached is not None:
+            return cached
+
+    result = None
+    if _label_workers is not None and not local:
+        try:
+            png_bytes, headers = post_to_label_worker(
+                f'/label?template={template}', {field: patient_data.get(field) for field in TEMPLATE_FIELDS[template]}
+            )
+            timestamp_top = headers.get('X-Timestamp-Top')
+            result = (png_bytes, float(timestamp_top) if timestamp_top else None)
+        except OSError:
+            pass  # no worker reachable: render here rather than fail the print
+    if result is None:
+        result = render_label_png(patient_data, template)
+
+    if not burn_timestamp:
+        label_png_cache.put(key, result, len(result[0]))
+    return result
+
+
+@timed("label.generate_barcode")
+def generate_barcode(patient_data, target_width_cm=8.0, height_cm=BARCODE_HEIGHT_CM):
+    """Generate a properly sized barcode at the profile DPI, with whole-pixel modules
+
+    The strip is height_cm tall, with bars, gap and text scaled to match.
+    Raises BarcodeError when the PHN can't be encoded; callers report it.
+    """
+    # Get PHN from patient data
+    patient_phn = patient_data.get('phn', '')
+    if not patient_phn:
+        patient_phn = "PHN-NOT-FOUND"
+
+    # Calculate exact pixel dimensions at the profile DPI
+    target_width_px = cm_to_px(target_width_cm)  # Convert cm to pixels
+    target_height = cm_to_px(height_cm)
+    scale = height_cm / BARCODE_HEIGHT_CM
+
+    try:
+        cache_key = barcode_cache_key(patient_data, target_width_cm, height_cm)
+        cached = barcode_cache.get(cache_key)
+        if cached is not None:
+            return cached
+
+        # Remove dashes for barcode encoding
+        clean_phn = patient_phn.replace('-', '')
+
+        # Bars drawn directly at the target width with whole-pixel modules
+        img = render_code128(
+            clean_phn,
+            target_width_px,
+            cm_to_px(BARCODE_BAR_HEIGHT_CM * scale),
+            text=clean_phn,
+            font=get_font('mono', cm_to_px(BARCODE_TEXT_CM * scale)),
+            top_px=cm_to_px(BARCODE_TOP_CM * scale),
+            text_gap_px=cm_to_px(BARCODE_TEXT_GAP_CM * scale),
+            height_px=target_height,
+            mode=BARCODE_MODE
+        )
+        barcode_cache.put(cache_key, img, img.width * img.height * len(img.getbands()))
+        return img
+
+    except Exception as e:
+        raise BarcodeError(f"Barcode generation error for {patient_phn}: {e}") from e
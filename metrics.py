@@ -0,0 +1,277 @@
+"""Timing spans for the hot paths, exported as Prometheus metrics and optional traces
+
+    with span("db.connect"):
+        ...
+
+    @timed("label.generate_barcode")
+    def generate_barcode(...): ...
+
+Every span feeds a per-operation latency histogram, rendered in the
+Prometheus text format by render_prometheus() (served at /metrics by the
+API and label worker, and by start_metrics_server() for the Streamlit
+process when METRICS_PORT is set). Spans slower than SLOW_OP_MS are logged.
+
+With TRACE_FILE and/or TRACE_OTLP_URL set, spans are also exported as
+OpenTelemetry (OTLP/JSON) traces: one ExportTraceServiceRequest per line in
+the file, or POSTed to a collector's /v1/traces. Export happens in
+batches on a background thread from a bounded queue (spans are dropped,
+and counted, rather than slowing requests when the exporter falls behind).
+
+Overhead without tracing is two perf_counter() calls and one short lock
+per span.
+"""
+import bisect
+import contextvars
+import functools
+import json
+import logging
+import os
+import queue
+import threading
+import time
+import urllib.request
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from settings import SLOW_OP_MS, TRACE_FILE, TRACE_OTLP_URL, TRACE_SERVICE_NAME
+
+logger = logging.getLogger(__name__)
+
+METRIC_PREFIX = 'patient_registration'
+# Histogram bucket upper bounds, in seconds
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+TRACE_QUEUE_SIZE = 10000
+TRACE_BATCH_SIZE = 512
+TRACE_FLUSH_INTERVAL = 2.0  # seconds
+
+_lock = threading.Lock()
+_histograms = {}  # operation -> [bucket counts..., +Inf count, sum]
+_counters = {}  # (name, operation) -> value
+_gauge_sources = {}  # prefix -> zero-argument callable returning a dict of numbers
+
+_current_span = contextvars.ContextVar('current_span', default=None)  # (trace_id, span_id)
+_exporter = None
+
+
+def observe(operation, seconds):
+    """Record one duration for `operation` in its histogram"""
+    index = bisect.bisect_left(BUCKETS, seconds)
+    with _lock:
+        histogram = _histograms.get(operation)
+        if histogram is None:
+            histogram = _histograms[operation] = [0] * (len(BUCKETS) + 1) + [0.0]
+        histogram[index] += 1
+        histogram[-1] += seconds
+
+
+def count(name, operation, amount=1):
+    """Add to a counter, e.g. count('payload_bytes', 'print.html', len(html))"""
+    with _lock:
+        key = (name, operation)
+        _counters[key] = _counters.get(key, 0) + amount
+
+
+def register_gauges(prefix, source):
+    """Export the numeric values of source() (e.g. pool.stats) as gauges named <prefix>_<key>"""
+    with _lock:
+        _gauge_sources[prefix] = source
+
+
+@contextmanager
+def span(operation, **attributes):
+    """Time a block: histogram, slow-op log and, when tracing is on, an exported span"""
+    exporter = _exporter
+    token = None
+    if exporter is not None:
+        parent = _current_span.get()
+        trace_id = parent[0] if parent else os.urandom(16).hex()
+        span_id = os.urandom(8).hex()
+        token = _current_span.set((trace_id, span_id))
+        start_ns = time.time_ns()
+    started = time.perf_counter()
+    error = None
+    try:
+        yield
+    except BaseException as exc:
+        error = exc
+        raise
+    finally:
+        elapsed = time.perf_counter() - started
+        observe(operation, elapsed)
+        if elapsed * 1000 >= SLOW_OP_MS:
+            logger.warning("slow %s: %.1f ms %s", operation, elapsed * 1000, attributes or '')
+        if token is not None:
+            _current_span.reset(token)
+            exporter.add(operation, trace_id, span_id, parent[1] if parent else None,
+                         start_ns, start_ns + int(elapsed * 1e9), attributes, error)
+
+
+def timed(operation):
+    """Decorator form of span()"""
+    def decorate(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(operation):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+class TimedCursor:
+    """Cursor proxy timing execute()/executemany() as db.<verb> spans (db.select, db.insert, ...)"""
+
+    def __init__(self, cursor):
+        self._cursor = cursor
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+    def __iter__(self):
+        return iter(self._cursor)
+
+    @staticmethod
+    def _operation(statement):
+        verb = statement.lstrip().split(None, 1)[0].lower() if statement.strip() else 'unknown'
+        return f"db.{verb}"
+
+    def execute(self, statement, *args, **kwargs):
+        with span(self._operation(statement)):
+            return self._cursor.execute(statement, *args, **kwargs)
+
+    def executemany(self, statement, *args, **kwargs):
+        with span(self._operation(statement)):
+            return self._cursor.executemany(statement, *args, **kwargs)
+
+
+def _format_value(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def render_prometheus():
+    """All metrics in the Prometheus text exposition format"""
+    with _lock:
+        histograms = {operation: list(values) for operation, values in _histograms.items()}
+        counters = dict(_counters)
+        sources = dict(_gauge_sources)
+
+    name = f"{METRIC_PREFIX}_operation_duration_seconds"
+    lines = [f"# HELP {name} Duration of instrumented operations", f"# TYPE {name} histogram"]
+    for operation, values in sorted(histograms.items()):
+        cumulative = 0
+        for bound, bucket_count in zip(BUCKETS + ('+Inf',), values[:-1]):
+            cumulative += bucket_count
+            lines.append(f'{name}_bucket{{operation="{operation}",le="{bound}"}} {cumulative}')
+        lines.append(f'{name}_sum{{operation="{operation}"}} {values[-1]!r}')
+        lines.append(f'{name}_count{{operation="{operation}"}} {cumulative}')
+
+    for counter in sorted({key[0] for key in counters}):
+        metric = f"{METRIC_PREFIX}_{counter}_total"
+        lines.append(f"# TYPE {metric} counter")
+        for (counter_name, operation), value in sorted(counters.items()):
+            if counter_name == counter:
+                lines.append(f'{metric}{{operation="{operation}"}} {_format_value(value)}')
+
+    for prefix, source in sorted(sources.items()):
+        try:
+            values = source()
+        except Exception as err:  # a broken source must not take /metrics down
+            logger.warning("metrics source %s failed: %s", prefix, err)
+            continue
+        for key, value in sorted(values.items()):
+            if isinstance(value, (int, float)) and not isinstance(value, bool):
+                metric = f"{METRIC_PREFIX}_{prefix}_{key}"
+                lines.append(f"# TYPE {metric} gauge")
+                lines.append(f"{metric} {_format_value(value)}")
+
+    if _exporter is not None:
+        lines.append(f"# TYPE {METRIC_PREFIX}_trace_spans_dropped_total counter")
+        lines.append(f"{METRIC_PREFIX}_trace_spans_dropped_total {_exporter.dropped}")
+    return "\n".join(lines) + "\n"
+
+
+def reset():
+    """Forget recorded histograms and counters (benchmarks)"""
+    with _lock:
+        _histograms.clear()
+        _counters.clear()
+
+
+class TraceExporter:
+    """Batches finished spans to an OTLP/JSON file and/or collector from a background thread"""
+
+    def __init__(self, path=None, url=None, service_name=TRACE_SERVICE_NAME):
+        self.path = path
+        self.url = url.rstrip('/') + '/v1/traces' if url else None
+        self.service_name = service_name
+        self.dropped = 0
+        self._queue = queue.Queue(TRACE_QUEUE_SIZE)
+        threading.Thread(target=self._run, name="trace-exporter", daemon=True).start()
+
+    def add(self, operation, trace_id, span_id, parent_id, start_ns, end_ns, attributes, error):
+        record = {
+            'traceId': trace_id, 'spanId': span_id, 'name': operation, 'kind': 1,
+            'startTimeUnixNano': str(start_ns), 'endTimeUnixNano': str(end_ns),
+            'attributes': [{'key': key, 'value': {'stringValue': str(value)}} for key, value in attributes.items()],
+            'status': {'code': 2, 'message': repr(error)} if error is not None else {'code': 1},
+        }
+        if parent_id:
+            record['parentSpanId'] = parent_id
+        try:
+            self._queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def _payload(self, spans):
+        return {'resourceSpans': [{
+            'resource': {'attributes': [{'key': 'service.name', 'value': {'stringValue': self.service_name}}]},
+            'scopeSpans': [{'scope': {'name': __name__}, 'spans': spans}],
+        }]}
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + TRACE_FLUSH_INTERVAL
+            while len(batch) < TRACE_BATCH_SIZE:
+                try:
+                    batch.append(self._queue.get(timeout=max(0.0, deadline - time.monotonic())))
+                except queue.Empty:
+                    break
+            body = json.dumps(self._payload(batch), separators=(',', ':'))
+            try:
+                if self.path:
+                    with open(self.path, 'a') as f:
+                        f.write(body + "\n")
+                if self.url:
+                    request = urllib.request.Request(self.url, data=body.encode(),
+                                                     headers={'Content-Type': 'application/json'})
+                    urllib.request.urlopen(request, timeout=5).close()
+            except OSError as err:
+                self.dropped += len(batch)
+                logger.warning("trace export failed, dropped %d spans: %s", len(batch), err)
+
+
+if TRACE_FILE or TRACE_OTLP_URL:
+    _exporter = TraceExporter(TRACE_FILE or None, TRACE_OTLP_URL or None)
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path != '/metrics':
+            self.send_error(404)
+            return
+        body = render_prometheus().encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_metrics_server(port, host='0.0.0.0'):
+    """Serve /metrics on a daemon thread (for processes without their own HTTP routes)"""
+    server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    threading.Thread(target=server.serve_forever, name="metrics-server", daemon=True).start()
+    return server
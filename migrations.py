@@ -0,0 +1,270 @@
+"""Versioned schema migrations for the patient registration database
+
+Apply pending migrations during deployment, before starting the app:
+
+    python migrations.py            # upgrade to the latest version
+    python migrations.py --status   # show current and latest version
+
+Each migration is applied at most once and recorded in `schema_migrations`.
+Runs are serialized per process with a lock and across processes/replicas
+with a MySQL named lock, so concurrent app starts never race on DDL.
+"""
+import argparse
+import sys
+import threading
+
+import mysql.connector
+
+from avatars import compact_stored_avatars
+from change_feed import backfill_patient_events
+from duplicates import index_all_patients
+from patients import index_all_contact_numbers
+from settings import DB_CONFIG, DB_NAME
+
+# (version, description, steps) - append only, never edit an applied entry.
+# A step is either an SQL statement or a callable taking the migration cursor.
+MIGRATIONS = [
+    (1, "Create patients table", [
+        """
+        CREATE TABLE IF NOT EXISTS patients (
+            id INT AUTO_INCREMENT PRIMARY KEY,
+            title VARCHAR(10),
+            full_name VARCHAR(100) NOT NULL,
+            other_names VARCHAR(100),
+            gender VARCHAR(20),
+            address_line1 VARCHAR(100),
+            address_line2 VARCHAR(100),
+            district VARCHAR(50),
+            province VARCHAR(50),
+            mh_division VARCHAR(50),
+            birthday DATE,
+            age VARCHAR(20),
+            nic VARCHAR(20) UNIQUE,
+            phn VARCHAR(50) UNIQUE,
+            marital_status VARCHAR(20),
+            guardian VARCHAR(100),
+            contact_numbers VARCHAR(100),
+            occupation VARCHAR(50),
+            blood_type VARCHAR(10),
+            known_allergies TEXT,
+            chronic_conditions TEXT,
+            primary_physician VARCHAR(100),
+            avatar BLOB,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP
+        )
+        """,
+    ]),
+    (2, "Index patient names for prefix and full-text search", [
+        # Prefix searches (LIKE 'term%') and keyset pagination on (full_name, id)
+        "CREATE INDEX idx_patients_full_name ON patients (full_name)",
+        # Word-prefix searches across both name columns (MATCH ... AGAINST 'term*')
+        "CREATE FULLTEXT INDEX ft_patients_names ON patients (full_name, other_names)",
+    ]),
+    (3, "Move avatars out of patients into patient_avatars with thumbnails", [
+        """
+        CREATE TABLE patient_avatars (
+            patient_id INT PRIMARY KEY,
+            image MEDIUMBLOB NOT NULL,
+            thumbnail BLOB,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+            FOREIGN KEY (patient_id) REFERENCES patients (id) ON DELETE CASCADE
+        )
+        """,
+        "INSERT INTO patient_avatars (patient_id, image) SELECT id, avatar FROM patients WHERE avatar IS NOT NULL",
+        compact_stored_avatars,
+        "ALTER TABLE patients DROP COLUMN avatar",
+    ]),
+    (4, "Add id_sequences for block-reserved PHN serials", [
+        """
+        CREATE TABLE id_sequences (
+            name VARCHAR(30) PRIMARY KEY,
+            next_value BIGINT NOT NULL
+        )
+        """,
+        "INSERT INTO id_sequences (name, next_value) VALUES ('phn', 1)",
+    ]),
+    (5, "Add patient_blocking_keys for duplicate detection", [
+        """
+        CREATE TABLE patient_blocking_keys (
+            key_value VARCHAR(120) NOT NULL,
+            patient_id INT NOT NULL,
+            PRIMARY KEY (key_value, patient_id),
+            KEY idx_blocking_keys_patient (patient_id),
+            FOREIGN KEY (patient_id) REFERENCES patients (id) ON DELETE CASCADE
+        )
+        """,
+        index_all_patients,
+    ]),
+    (6, "Schema overhaul: contact table, district/birthday index, derived age, compressed rows", [
+        # One row per normalized number, so "who has this phone" is an index lookup
+        # instead of a LIKE '%...%' scan over the free-text column (kept for display)
+        """
+        CREATE TABLE patient_contacts (
+            patient_id INT NOT NULL,
+            position TINYINT NOT NULL,
+            contact_number VARCHAR(20) NOT NULL,
+            PRIMARY KEY (patient_id, position),
+            KEY idx_patient_contacts_number (contact_number),
+            FOREIGN KEY (patient_id) REFERENCES patients (id) ON DELETE CASCADE
+        ) ROW_FORMAT=DYNAMIC
+        """,
+        index_all_contact_numbers,
+        # One rebuild of patients: age is derived from birthday, (district, birthday)
+        # serves ward/clinic lists and duplicate review, and compressed pages halve
+        # the I/O of a read-mostly, text-heavy table. Avatars stay DYNAMIC: JPEGs
+        # don't compress further.
+        """
+        ALTER TABLE patients
+            DROP COLUMN age,
+            ADD INDEX idx_patients_district_birthday (district, birthday),
+            ROW_FORMAT=COMPRESSED KEY_BLOCK_SIZE=8
+        """,
+        "ALTER TABLE patient_avatars ROW_FORMAT=DYNAMIC",
+        "ALTER TABLE patient_blocking_keys ROW_FORMAT=COMPRESSED KEY_BLOCK_SIZE=8",
+    ]),
+    (7, "Add patient_drafts so in-progress registrations survive a change of replica", [
+        """
+        CREATE TABLE patient_drafts (
+            draft_id CHAR(32) PRIMARY KEY,
+            patient_data JSON NOT NULL,
+            avatar MEDIUMBLOB,
+            avatar_digest VARCHAR(100),
+            avatar_crop VARCHAR(80),
+            updated_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+            KEY idx_patient_drafts_updated (updated_at)
+        ) ROW_FORMAT=DYNAMIC
+        """,
+    ]),
+    (8, "Add patient_events outbox and change_feed_cursors for the change feed", [
+        """
+        CREATE TABLE patient_events (
+            event_id BIGINT AUTO_INCREMENT PRIMARY KEY,
+            patient_id INT NOT NULL,
+            event_type VARCHAR(20) NOT NULL,
+            payload JSON NOT NULL,
+            created_at TIMESTAMP(6) NOT NULL DEFAULT CURRENT_TIMESTAMP(6),
+            KEY idx_patient_events_created (created_at)
+        ) ROW_FORMAT=DYNAMIC
+        """,
+        """
+        CREATE TABLE change_feed_cursors (
+            consumer VARCHAR(64) PRIMARY KEY,
+            event_id BIGINT NOT NULL,
+            updated_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP
+        )
+        """,
+        backfill_patient_events,
+    ]),
+]
+
+LATEST_VERSION = MIGRATIONS[-1][0]
+MIGRATION_LOCK_TIMEOUT = 60  # seconds
+
+_migration_lock = threading.Lock()
+
+
+def connect_server():
+    """Connect without selecting a database, so it can be created if missing"""
+    config = {key: value for key, value in DB_CONFIG.items() if key != 'database'}
+    return mysql.connector.connect(**config)
+
+
+def get_schema_version(cursor, database=DB_NAME):
+    """Return the highest applied migration version (0 for an empty server)"""
+    cursor.execute(
+        "SELECT COUNT(*) FROM information_schema.tables "
+        "WHERE table_schema = %s AND table_name = 'schema_migrations'",
+        (database,)
+    )
+    if not cursor.fetchone()[0]:
+        return 0
+
+    cursor.execute(f"SELECT COALESCE(MAX(version), 0) FROM `{database}`.schema_migrations")
+    return cursor.fetchone()[0]
+
+
+def migrate(conn=None, target=LATEST_VERSION, database=DB_NAME):
+    """Apply pending migrations up to `target`; returns (old_version, new_version)"""
+    lock_name = f"{database}.schema_migrations"
+    with _migration_lock:
+        own_conn = conn is None
+        if own_conn:
+            conn = connect_server()
+
+        try:
+            cursor = conn.cursor()
+            cursor.execute("SELECT GET_LOCK(%s, %s)", (lock_name, MIGRATION_LOCK_TIMEOUT))
+            if cursor.fetchone()[0] != 1:
+                raise RuntimeError("Timed out waiting for another migration run to finish")
+
+            try:
+                # Re-read the version under the lock: another process may have migrated
+                start_version = get_schema_version(cursor, database)
+                if start_version >= target:
+                    return start_version, start_version
+
+                cursor.execute(f"CREATE DATABASE IF NOT EXISTS `{database}`")
+                cursor.execute(f"USE `{database}`")
+                cursor.execute("""
+                    CREATE TABLE IF NOT EXISTS schema_migrations (
+                        version INT PRIMARY KEY,
+                        description VARCHAR(200) NOT NULL,
+                        applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                    )
+                """)
+
+                for version, description, steps in MIGRATIONS:
+                    if version <= start_version or version > target:
+                        continue
+                    for step in steps:
+                        if callable(step):
+                            step(cursor)
+                        else:
+                            cursor.execute(step)
+                    cursor.execute(
+                        "INSERT INTO schema_migrations (version, description) VALUES (%s, %s)",
+                        (version, description)
+                    )
+                    conn.commit()
+
+                return start_version, get_schema_version(cursor, database)
+            finally:
+                cursor.execute("SELECT RELEASE_LOCK(%s)", (lock_name,))
+                cursor.fetchone()
+        finally:
+            if own_conn:
+                conn.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Apply patient database schema migrations")
+    parser.add_argument("--status", action="store_true", help="show schema version and exit")
+    parser.add_argument("--target", type=int, default=LATEST_VERSION, help="migrate up to this version")
+    args = parser.parse_args(argv)
+
+    try:
+        if args.status:
+            conn = connect_server()
+            try:
+                version = get_schema_version(conn.cursor())
+            finally:
+                conn.close()
+            print(f"Schema version {version} (latest {LATEST_VERSION})")
+            return 0 if version >= LATEST_VERSION else 1
+
+        old_version, new_version = migrate(target=args.target)
+    except (mysql.connector.Error, RuntimeError) as err:
+        print(f"Migration failed: {err}", file=sys.stderr)
+        return 1
+
+    if old_version == new_version:
+        print(f"Schema already at version {new_version}")
+    else:
+        print(f"Migrated schema from version {old_version} to {new_version}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,121 @@
+"""Read-through cache for exact patient lookups by PHN or NIC
+
+The same patients are reprinted again and again through a clinic day, so
+exact PHN/NIC lookups go through a shared cache before MySQL. Only the
+search columns are cached (never avatar BLOBs), bounded by size and TTL.
+Saves invalidate the keys they write. Only found patients are cached, so a
+newly registered patient is never hidden behind a cached miss.
+
+The cache is in-process by default; set PATIENT_CACHE_REDIS_URL (and
+install the `redis` package) to share it between app processes.
+"""
+import json
+import threading
+
+from cache import LRUCache
+from patient_search import search_patients
+from settings import PATIENT_CACHE_MAX_MB, PATIENT_CACHE_REDIS_URL, PATIENT_CACHE_TTL
+
+CACHED_LOOKUPS = {'PHN': 'phn', 'NIC': 'nic'}
+ENTRY_OVERHEAD_BYTES = 200  # dict and key bookkeeping on top of the JSON size
+
+
+def _row_size(row):
+    return len(json.dumps(row, default=str)) + ENTRY_OVERHEAD_BYTES
+
+
+class RedisBackend:
+    """Same get/put/invalidate/stats interface as LRUCache, stored in Redis
+
+    Rows round-trip through JSON, so dates come back as ISO strings.
+    """
+
+    def __init__(self, url, ttl=None, prefix="patient:"):
+        try:
+            import redis
+        except ImportError as err:
+            raise RuntimeError("PATIENT_CACHE_REDIS_URL is set but the redis package is not installed") from err
+        self.client = redis.Redis.from_url(url)
+        self.ttl = ttl
+        self.prefix = prefix
+        self._lock = threading.Lock()
+        self._metrics = {'hits': 0, 'misses': 0}
+
+    def get(self, key, default=None):
+        value = self.client.get(self.prefix + key)
+        with self._lock:
+            self._metrics['hits' if value is not None else 'misses'] += 1
+        return json.loads(value) if value is not None else default
+
+    def put(self, key, value, size):
+        self.client.set(self.prefix + key, json.dumps(value, default=str), ex=self.ttl)
+
+    def invalidate(self, key):
+        self.client.delete(self.prefix + key)
+
+    def stats(self):
+        with self._lock:
+            lookups = self._metrics['hits'] + self._metrics['misses']
+            return {
+                'backend': 'redis',
+                'ttl': self.ttl,
+                **self._metrics,
+                'hit_rate': self._metrics['hits'] / lookups if lookups else 0.0,
+            }
+
+
+class PatientLookupCache:
+    """Exact PHN/NIC lookups, read through `backend` (an LRUCache or RedisBackend)"""
+
+    def __init__(self, backend):
+        self.backend = backend
+
+    @staticmethod
+    def _key(column, value):
+        # Lookups match case-insensitively, so a typed term and the saved PHN/NIC
+        # (both upper case, see normalize_phn and normalize_patient) share one key
+        return f"{column}:{str(value).strip().upper()}"
+
+    def get(self, column, value):
+        return self.backend.get(self._key(column, value))
+
+    def put(self, column, value, row):
+        self.backend.put(self._key(column, value), row, _row_size(row))
+
+    def lookup(self, conn, search_by, term):
+        """Rows matching `term` exactly, in search_patients() form (at most one: both columns are unique)"""
+        column = CACHED_LOOKUPS[search_by]
+        row = self.get(column, term)
+        if row is not None:
+            return [row]
+
+        rows, _ = search_patients(conn, search_by, term, page_size=1)
+        if rows:
+            self.put(column, term, rows[0])
+        return rows
+
+    def invalidate(self, patient_data):
+        """Drop cached rows for the PHN and NIC of a patient that was just written"""
+        for column in CACHED_LOOKUPS.values():
+            if patient_data.get(column):
+                self.backend.invalidate(self._key(column, patient_data[column]))
+
+    def stats(self):
+        return self.backend.stats()
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_patient_cache():
+    """Process-wide lookup cache, backed by Redis when PATIENT_CACHE_REDIS_URL is set"""
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            if PATIENT_CACHE_REDIS_URL:
+                backend = RedisBackend(PATIENT_CACHE_REDIS_URL, ttl=PATIENT_CACHE_TTL)
+            else:
+                backend = LRUCache(PATIENT_CACHE_MAX_MB * 1024 * 1024, ttl=PATIENT_CACHE_TTL, name="patients")
+            _cache = PatientLookupCache(backend)
+        return _cache
@@ -0,0 +1,81 @@
+"""Patient lookup queries for the Reprint tab
+
+Searches select only the columns the result list and the label need, and
+page through matches with a keyset cursor on (full_name, id) so deep pages
+cost the same as the first one. The avatar BLOB is never part of a search.
+"""
+import re
+
+from patients import split_contact_numbers
+
+# Columns shown in the result list and printed on the label
+SEARCH_COLUMNS = (
+    'id', 'title', 'full_name', 'other_names', 'gender', 'birthday',
+    'nic', 'phn', 'address_line1', 'district', 'contact_numbers',
+)
+
+SEARCH_PAGE_SIZE = 20
+
+# InnoDB ignores full-text tokens shorter than innodb_ft_min_token_size (default 3)
+FULLTEXT_MIN_TOKEN = 3
+
+
+def escape_like(term):
+    """Escape LIKE wildcards so user input is matched literally"""
+    return term.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+
+def name_filter(term):
+    """Build the WHERE clause for a name search
+
+    Words long enough for the full-text index become required prefix terms
+    (`+perer*`), so "perera nim" finds "Nimal Perera". Shorter input falls back
+    to an index-backed prefix match on full_name.
+    """
+    words = [word for word in re.split(r'\W+', term) if len(word) >= FULLTEXT_MIN_TOKEN]
+    if words:
+        boolean_query = ' '.join(f'+{word}*' for word in words)
+        return "MATCH(full_name, other_names) AGAINST (%s IN BOOLEAN MODE)", [boolean_query]
+    return "full_name LIKE %s", [escape_like(term) + '%']
+
+
+def search_patients(conn, search_by, term, after=None, page_size=SEARCH_PAGE_SIZE):
+    """Return (rows, next_cursor) for one page of matches
+
+    `after` is the cursor returned for the previous page (None for the first);
+    `next_cursor` is None when there are no further matches.
+    """
+    if search_by == "PHN":
+        where, params = "phn = %s", [term]
+    elif search_by == "NIC":
+        where, params = "nic = %s", [term]
+    elif search_by == "Contact":
+        numbers = split_contact_numbers(term)
+        where = "id IN (SELECT patient_id FROM patient_contacts WHERE contact_number = %s)"
+        params = [numbers[0] if numbers else term]
+    else:
+        where, params = name_filter(term)
+
+    if after is not None:
+        last_name, last_id = after
+        where += " AND (full_name > %s OR (full_name = %s AND id > %s))"
+        params += [last_name, last_name, last_id]
+
+    query = (
+        f"SELECT {', '.join(SEARCH_COLUMNS)} FROM patients "
+        f"WHERE {where} ORDER BY full_name, id LIMIT %s"
+    )
+    # Fetch one extra row to learn whether another page exists
+    params.append(page_size + 1)
+
+    cursor = conn.cursor(dictionary=True)
+    cursor.execute(query, params)
+    rows = cursor.fetchall()
+    cursor.close()
+
+    next_cursor = None
+    if len(rows) > page_size:
+        rows = rows[:page_size]
+        next_cursor = (rows[-1]['full_name'], rows[-1]['id'])
+    return rows, next_cursor
+
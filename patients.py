@@ -0,0 +1,160 @@
+"""Patient record rules shared by the registration form and the bulk importer"""
+import re
+from datetime import date, datetime
+
+from phn import check_phn
+
+# Columns written by INSERT_PATIENT_SQL, in order
+PATIENT_FIELDS = (
+    'title', 'full_name', 'other_names', 'gender', 'address_line1', 'address_line2',
+    'district', 'province', 'mh_division', 'birthday', 'nic', 'phn', 'marital_status',
+    'guardian', 'contact_numbers', 'occupation', 'blood_type', 'known_allergies',
+    'chronic_conditions', 'primary_physician',
+)
+
+# Column sizes in the patients table: VARCHAR limits in characters, TEXT in bytes
+FIELD_MAX_LENGTHS = {
+    'title': 10, 'full_name': 100, 'other_names': 100, 'gender': 20, 'address_line1': 100,
+    'address_line2': 100, 'district': 50, 'province': 50, 'mh_division': 50, 'nic': 20, 'phn': 50,
+    'marital_status': 20, 'guardian': 100, 'contact_numbers': 100, 'occupation': 50, 'blood_type': 10,
+    'primary_physician': 100,
+}
+TEXT_FIELDS = ('known_allergies', 'chronic_conditions')
+TEXT_MAX_BYTES = 65535
+
+REQUIRED_FIELDS = [
+    ('full_name', 'Full Name'),
+    ('gender', 'Gender'),
+    ('phn', 'PHN'),
+    ('address_line1', 'Address Line 1'),
+    ('district', 'District'),
+    ('province', 'Province'),
+    ('contact_numbers', 'Contact Numbers')
+]
+
+INSERT_PATIENT_SQL = (
+    f"INSERT INTO patients ({', '.join(PATIENT_FIELDS)}) "
+    f"VALUES ({', '.join(['%s'] * len(PATIENT_FIELDS))})"
+)
+
+BIRTHDAY_FORMATS = ('%Y-%m-%d', '%d/%m/%Y', '%d-%m-%Y', '%Y/%m/%d')
+
+# A run of digits (spaces/dashes allowed inside) long enough to be a phone number
+CONTACT_NUMBER_PATTERN = re.compile(r'\d[\d\s-]{6,}\d')
+MAX_CONTACT_NUMBERS = 5
+
+
+def missing_required_fields(patient_data):
+    """Display names of required fields that are empty"""
+    return [name for field, name in REQUIRED_FIELDS if not patient_data.get(field)]
+
+
+def parse_birthday(value):
+    if value in (None, ''):
+        return None
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, date):
+        return value
+    for fmt in BIRTHDAY_FORMATS:
+        try:
+            return datetime.strptime(str(value).strip(), fmt).date()
+        except ValueError:
+            continue
+    raise ValueError(f"unrecognised birthday {value!r}")
+
+
+def normalize_patient(record):
+    """Trim and canonicalize a patient record; raises ValueError on bad values
+
+    Scalars (e.g. a NIC or phone number given as a JSON number) become text;
+    nested values and text too long for its column are rejected.
+    """
+    if not isinstance(record, dict):
+        raise ValueError(f"expected a record of fields, got {type(record).__name__}")
+    patient = {}
+    for field in PATIENT_FIELDS:
+        value = record.get(field)
+        if value is None:
+            value = ''
+        elif isinstance(value, (list, dict)):
+            raise ValueError(f"{field} must be a single value")
+        elif not (field == 'birthday' and isinstance(value, date)):
+            value = ' '.join(str(value).split())
+        patient[field] = value
+
+    patient['birthday'] = parse_birthday(patient['birthday'])
+    patient['nic'] = patient['nic'].upper()
+    patient['phn'] = patient['phn'].upper()
+    check_phn(patient['phn'])
+    for field, limit in FIELD_MAX_LENGTHS.items():
+        if len(patient[field]) > limit:
+            raise ValueError(f"{field} is longer than {limit} characters")
+    for field in TEXT_FIELDS:
+        if len(patient[field].encode('utf-8')) > TEXT_MAX_BYTES:
+            raise ValueError(f"{field} is longer than {TEXT_MAX_BYTES} bytes")
+    return patient
+
+
+def age_from_birthday(birthday, today=None):
+    """Age in whole years (age is derived, never stored), or None without a birthday"""
+    birthday = parse_birthday(birthday)
+    if birthday is None:
+        return None
+    today = today or date.today()
+    return today.year - birthday.year - ((today.month, today.day) < (birthday.month, birthday.day))
+
+
+def split_contact_numbers(contact_numbers):
+    """Normalized numbers in a free-text contact field, in national form (0 + 9 digits)
+
+    '077 123 4567 / +94 112 345678' -> ['0771234567', '0112345678']
+    """
+    numbers = []
+    for match in CONTACT_NUMBER_PATTERN.findall(contact_numbers or ''):
+        digits = re.sub(r'\D', '', match)
+        number = '0' + digits[-9:] if len(digits) >= 9 else digits
+        if number not in numbers:
+            numbers.append(number)
+    return numbers[:MAX_CONTACT_NUMBERS]
+
+
+def save_contact_numbers(cursor, patient_id, contact_numbers):
+    """(Re)write a patient's rows in patient_contacts inside the caller's transaction"""
+    cursor.execute("DELETE FROM patient_contacts WHERE patient_id = %s", (patient_id,))
+    numbers = split_contact_numbers(contact_numbers)
+    if numbers:
+        cursor.executemany(
+            "INSERT INTO patient_contacts (patient_id, position, contact_number) VALUES (%s, %s, %s)",
+            [(patient_id, position, number) for position, number in enumerate(numbers)]
+        )
+
+
+def index_all_contact_numbers(cursor, chunk=5000, after_id=0):
+    """Migration step: fill patient_contacts from the free-text column (for patients after `after_id`)"""
+    last_id = after_id
+    while True:
+        cursor.execute(
+            "SELECT id, contact_numbers FROM patients WHERE id > %s ORDER BY id LIMIT %s", (last_id, chunk)
+        )
+        rows = cursor.fetchall()
+        if not rows:
+            return
+        cursor.executemany(
+            "INSERT IGNORE INTO patient_contacts (patient_id, position, contact_number) VALUES (%s, %s, %s)",
+            [(patient_id, position, number)
+             for patient_id, contact_numbers in rows
+             for position, number in enumerate(split_contact_numbers(contact_numbers))]
+        )
+        last_id = rows[-1][0]
+
+
+def patient_values(patient_data):
+    """Parameter tuple for INSERT_PATIENT_SQL
+
+    An empty NIC is stored as NULL: the column is UNIQUE, and '' would let
+    only one patient without a NIC ever be registered.
+    """
+    values = {field: patient_data.get(field, '') for field in PATIENT_FIELDS}
+    values['nic'] = values['nic'] or None
+    return tuple(values[field] for field in PATIENT_FIELDS)
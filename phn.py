@@ -0,0 +1,102 @@
+"""Collision-free PHN allocation
+
+PHNs are `PHN-<hospital>-<serial>-<check>`: a 9-digit serial drawn from a
+database sequence plus a Luhn check digit over hospital id and serial, so
+typos are caught when a PHN is keyed in by hand.
+
+Each app process reserves serials in blocks (one UPDATE per PHN_BLOCK_SIZE
+PHNs) and hands them out from memory, so issuing a PHN normally needs no
+database round-trip. Serials left in a block when a process exits are simply
+never used; PHNs stay unique, only not gap-free.
+"""
+import re
+import threading
+
+from settings import PHN_BLOCK_SIZE, PHN_HOSPITAL_ID
+
+PHN_PATTERN = re.compile(rf'^PHN-(\d{{{len(PHN_HOSPITAL_ID)}}})-(\d{{9}})-(\d)$')
+PHN_SEQUENCE_NAME = 'phn'
+
+
+def luhn_check_digit(digits):
+    """Luhn (mod 10) check digit for a string of digits"""
+    total = 0
+    for position, char in enumerate(reversed(digits)):
+        value = int(char)
+        if position % 2 == 0:
+            value *= 2
+            if value > 9:
+                value -= 9
+        total += value
+    return str((10 - total % 10) % 10)
+
+
+def format_phn(serial, hospital_id=PHN_HOSPITAL_ID):
+    serial_text = f"{serial:09d}"
+    return f"PHN-{hospital_id}-{serial_text}-{luhn_check_digit(hospital_id + serial_text)}"
+
+
+def normalize_phn(phn):
+    """Canonical form PHNs are compared and cached in: trimmed and upper case"""
+    return phn.strip().upper()
+
+
+def is_valid_phn(phn):
+    """True for a well-formed PHN whose check digit matches"""
+    match = PHN_PATTERN.match(phn or '')
+    return bool(match) and luhn_check_digit(match.group(1) + match.group(2)) == match.group(3)
+
+
+def check_phn(phn):
+    """Raise ValueError for a PHN keyed in with a typo: issued form, wrong check digit
+
+    PHNs in any other form (registered before PHNs were issued here) are
+    accepted as they are.
+    """
+    if PHN_PATTERN.match(phn or '') and not is_valid_phn(phn):
+        raise ValueError(f"{phn} is not a valid PHN (check digit mismatch); check it for a typo")
+
+
+def reserve_phn_block(conn, size):
+    """Atomically reserve `size` serials; returns the first one
+
+    Uses MySQL's LAST_INSERT_ID(expr) idiom so the increment and the read
+    are a single statement and safe across any number of app processes.
+    """
+    cursor = conn.cursor()
+    cursor.execute(
+        "UPDATE id_sequences SET next_value = LAST_INSERT_ID(next_value + %s) WHERE name = %s",
+        (size, PHN_SEQUENCE_NAME)
+    )
+    cursor.execute("SELECT LAST_INSERT_ID()")
+    end = cursor.fetchone()[0]
+    conn.commit()
+    cursor.close()
+    return end - size
+
+
+class PHNAllocator:
+    """Thread-safe PHN source backed by block reservations
+
+    `reserve` is a callable taking a block size and returning the first
+    serial of a freshly reserved block (see reserve_phn_block).
+    """
+
+    def __init__(self, reserve, block_size=PHN_BLOCK_SIZE, hospital_id=PHN_HOSPITAL_ID):
+        self._reserve = reserve
+        self.block_size = block_size
+        self.hospital_id = hospital_id
+        self._next = 0
+        self._end = 0
+        self._lock = threading.Lock()
+        self.blocks_reserved = 0
+
+    def next_phn(self):
+        with self._lock:
+            if self._next >= self._end:
+                start = self._reserve(self.block_size)
+                self._next, self._end = start, start + self.block_size
+                self.blocks_reserved += 1
+            serial = self._next
+            self._next += 1
+        return format_phn(serial, self.hospital_id)
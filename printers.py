@@ -0,0 +1,256 @@
+"""Direct-to-printer label output for thermal label printers
+
+Instead of a 600 DPI PNG pushed through the browser print dialog, labels are
+described in the printer's own language (ZPL for Zebra, EPL2 for older
+Zebra/Eltron models), a few hundred bytes per label, and sent over a raw TCP
+socket (port 9100). Jobs go through a PrintQueue that retries failed sends
+and keeps per-job status for the UI.
+
+For local testing run a fake printer that records every job it receives:
+
+    python printers.py --fake --port 9100
+"""
+import argparse
+import itertools
+import socket
+import socketserver
+import threading
+import time
+from datetime import datetime
+
+from code128 import QUIET_ZONE_MODULES, code128_modules, code128_zpl
+from jobs import JobQueue
+from label_templates import HOSPITAL_NAME
+from settings import PRINTER_DPI, PRINTER_HOST, PRINTER_LANGUAGE, PRINTER_PORT
+
+LABEL_WIDTH_MM, LABEL_HEIGHT_MM = 100, 43
+
+
+def mm_to_dots(mm, dpi):
+    return int(round(mm * dpi / 25.4))
+
+
+def _label_lines(patient_data):
+    """The text lines of the label, as drawn by generate_label_image"""
+    name = f"{patient_data.get('title', '')} {patient_data.get('full_name', '')}".strip()
+    address = patient_data.get('address_line1', '') or ''
+    if len(address) > 45:
+        address = address[:42] + "..."
+    contact = f"Tel: {patient_data.get('contact_numbers', '')}"
+    if len(contact) > 35:
+        contact = contact[:32] + "..."
+    return name, address, contact
+
+
+def _zpl_text(text):
+    """Escape ZPL control characters for use after ^FH (hex escapes with _)"""
+    return text.replace('_', '_5F').replace('^', '_5E').replace('~', '_7E')
+
+
+def label_to_zpl(patient_data, dpi=PRINTER_DPI, timestamp=None):
+    """ZPL II for one 100mm x 43mm patient label"""
+    width, height = mm_to_dots(LABEL_WIDTH_MM, dpi), mm_to_dots(LABEL_HEIGHT_MM, dpi)
+    scale = dpi / 600  # layout positions are defined at 600 DPI like the PNG label
+    name, address, contact = _label_lines(patient_data)
+    clean_phn = (patient_data.get('phn') or "PHN-NOT-FOUND").replace('-', '')
+
+    def centered(y, size, text):
+        return (
+            f"^FO0,{int(y * scale)}^FB{width},1,0,C,0"
+            f"^A0N,{int(size * scale)},{int(size * scale)}^FH^FD{_zpl_text(text)}^FS"
+        )
+
+    lines = [f"^XA^CI28^PW{width}^LL{height}", centered(60, 80, HOSPITAL_NAME), centered(160, 64, name)]
+    y = 240
+    if address:
+        lines.append(centered(y, 64, address))
+        y += 70
+    lines.append(centered(y, 80, contact))
+    y += 80
+
+    modules = len(code128_modules(clean_phn)) + 2 * QUIET_ZONE_MODULES
+    module_dots = max(1, mm_to_dots(80, dpi) // modules)
+    barcode_x = (width - modules * module_dots) // 2 + QUIET_ZONE_MODULES * module_dots
+    lines.append(code128_zpl(clean_phn, barcode_x, int(y * scale), module_dots, mm_to_dots(11, dpi)))
+
+    if timestamp:
+        lines.append(centered(y + 376, 64, timestamp))
+    lines.append("^XZ")
+    return "\n".join(lines).encode('utf-8')
+
+
+def _epl_text(text):
+    return text.replace('\\', '\\\\').replace('"', '\\"')
+
+
+def label_to_epl(patient_data, dpi=PRINTER_DPI, timestamp=None):
+    """EPL2 for one 100mm x 43mm patient label (fixed printer fonts, centered by width)"""
+    width, height = mm_to_dots(LABEL_WIDTH_MM, dpi), mm_to_dots(LABEL_HEIGHT_MM, dpi)
+    scale = dpi / 600
+    name, address, contact = _label_lines(patient_data)
+    clean_phn = (patient_data.get('phn') or "PHN-NOT-FOUND").replace('-', '')
+    # EPL resident font 4 is 14 x 24 dots at 203 DPI (incl. spacing), font 3 is 12 x 20
+    font_widths = {3: 12, 4: 14}
+
+    def centered(y, font, text):
+        x = max(0, (width - len(text) * font_widths[font]) // 2)
+        return f'A{x},{int(y * scale)},0,{font},1,1,N,"{_epl_text(text)}"'
+
+    lines = ["", "N", f"q{width}", f"Q{height},24", centered(60, 4, HOSPITAL_NAME), centered(160, 3, name)]
+    y = 240
+    if address:
+        lines.append(centered(y, 3, address))
+        y += 70
+    lines.append(centered(y, 4, contact))
+    y += 80
+
+    modules = len(code128_modules(clean_phn)) + 2 * QUIET_ZONE_MODULES
+    module_dots = max(1, mm_to_dots(80, dpi) // modules)
+    barcode_x = (width - modules * module_dots) // 2 + QUIET_ZONE_MODULES * module_dots
+    lines.append(f'B{barcode_x},{int(y * scale)},0,1,{module_dots},{module_dots * 2},{mm_to_dots(11, dpi)},B,"{clean_phn}"')
+
+    if timestamp:
+        lines.append(centered(y + 376, 3, timestamp))
+    lines.append("P1")
+    return ("\n".join(lines) + "\n").encode('utf-8')
+
+
+LABEL_ENCODERS = {'zpl': label_to_zpl, 'epl': label_to_epl}
+
+
+class RawSocketPrinter:
+    """Printer reachable over a raw TCP socket (JetDirect / port 9100)"""
+
+    def __init__(self, host, port=9100, timeout=5.0):
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+
+    def send(self, payload):
+        with socket.create_connection((self.host, self.port), timeout=self.timeout) as sock:
+            sock.sendall(payload)
+
+    def __str__(self):
+        return f"{self.host}:{self.port}"
+
+
+class PrintQueue(JobQueue):
+    """Background sender with retries; keeps the status of recent jobs
+
+    A job moves through queued -> sending -> done, or back to queued after a
+    failed attempt, and finally to failed after `max_attempts`.
+    """
+
+    active_status = 'sending'
+    hidden_fields = ('payload', 'next_attempt')
+
+    def __init__(self, printer, max_attempts=4, retry_delay=1.0, history=200):
+        super().__init__(history)
+        self.printer = printer
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self._ids = itertools.count(1)
+        self._worker = threading.Thread(target=self._run, name="print-queue", daemon=True)
+        self._worker.start()
+
+    def submit(self, payload, description=""):
+        with self._lock:
+            job_id = next(self._ids)
+            self._add_job(job_id, description=description, payload=payload)
+        return job_id
+
+    def _run(self):
+        while True:
+            job = self._next_job()
+            try:
+                self.printer.send(job['payload'])
+            except OSError as err:
+                with self._lock:
+                    job['error'] = str(err)
+                    if job['attempts'] >= self.max_attempts:
+                        job['status'] = 'failed'
+                    else:
+                        job['status'] = 'queued'
+                        job['next_attempt'] = time.monotonic() + self.retry_delay * 2 ** (job['attempts'] - 1)
+                continue
+
+            with self._lock:
+                job['status'] = 'done'
+                job['error'] = None
+                job['payload'] = None
+
+
+_queue = None
+_queue_lock = threading.Lock()
+
+
+def get_print_queue():
+    """Process-wide queue for the configured printer, or None when none is set"""
+    global _queue
+    if not PRINTER_HOST:
+        return None
+    with _queue_lock:
+        if _queue is None:
+            _queue = PrintQueue(RawSocketPrinter(PRINTER_HOST, PRINTER_PORT))
+        return _queue
+
+
+def print_label_direct(patient_data, with_timestamp=True):
+    """Encode a label in the configured printer language and queue it; returns the job id"""
+    print_queue = get_print_queue()
+    if print_queue is None:
+        raise RuntimeError("No label printer configured (set PRINTER_HOST)")
+    encode = LABEL_ENCODERS[PRINTER_LANGUAGE]
+    timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S') if with_timestamp else None
+    payload = encode(patient_data, timestamp=timestamp)
+    return print_queue.submit(payload, description=patient_data.get('phn', ''))
+
+
+class FakePrinterServer(socketserver.ThreadingTCPServer):
+    """Local stand-in for a port 9100 printer; each connection is recorded as one job"""
+
+    allow_reuse_address = True
+    daemon_threads = True
+
+    def __init__(self, address=('127.0.0.1', 0), on_job=None):
+        self.received = []
+        self.on_job = on_job
+        super().__init__(address, _FakePrinterHandler)
+
+    @property
+    def port(self):
+        return self.server_address[1]
+
+
+class _FakePrinterHandler(socketserver.BaseRequestHandler):
+    def handle(self):
+        chunks = []
+        while True:
+            data = self.request.recv(65536)
+            if not data:
+                break
+            chunks.append(data)
+        job = b"".join(chunks)
+        self.server.received.append(job)
+        if self.server.on_job:
+            self.server.on_job(job)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run a fake raw-socket label printer")
+    parser.add_argument("--fake", action="store_true", required=True, help="record jobs instead of printing")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9100)
+    args = parser.parse_args(argv)
+
+    def show(job):
+        print(f"--- job {datetime.now():%H:%M:%S}, {len(job)} bytes ---")
+        print(job.decode('utf-8', errors='replace'))
+
+    with FakePrinterServer((args.host, args.port), on_job=show) as server:
+        print(f"Fake printer listening on {args.host}:{server.port}")
+        server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,224 @@
+"""Journaled background saves for new patient registrations
+
+Pressing Save only validates the form and writes the record to a local
+write-ahead journal (one fsync'd JSON file per save in SAVE_JOURNAL_DIR),
+so the operator gets the PHN confirmed straight away. A writer thread then
+inserts the patient, its contact numbers, blocking keys and avatar in one
+transaction, and a label thread pre-renders the barcode and label into the
+label caches.
+
+A journal file is deleted only after its transaction commits. While MySQL
+is unreachable the writer keeps retrying with backoff, and journal files
+left behind by a crash or restart are replayed when the queue starts, so an
+accepted registration is never lost. Records rejected by the database (e.g.
+a NIC that is already registered, or a value too long for its column) and
+jobs that fail unexpectedly are moved to `failed/` for follow-up.
+"""
+import base64
+import glob
+import itertools
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+import mysql.connector
+from PIL import Image
+
+from avatars import AVATAR_MAX_SIDE, decode_avatar
+from db_pool import PoolTimeout
+from jobs import JobQueue
+from labels import generate_barcode, get_label_png
+from patient_cache import get_patient_cache
+from services import write_patient
+
+MAX_RETRY_DELAY = 30.0  # seconds between attempts while the database is down
+
+# The record itself was rejected (or is unreadable): keep it for follow-up, don't retry.
+# Other database errors, ProgrammingError included (a missing table or grant is an
+# ops fault, not a bad record), are retried until they are fixed.
+REJECTED_ERRORS = (mysql.connector.IntegrityError, mysql.connector.DataError, OSError, ValueError)
+
+
+def _fsync_dir(path):
+    """Make a rename or unlink inside `path` durable"""
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def _avatar_to_journal(img):
+    """Journal form of an avatar: oriented, bounded to the stored size, fast PNG"""
+    img = decode_avatar(img, AVATAR_MAX_SIDE)
+    buffer = BytesIO()
+    img.save(buffer, format='PNG', compress_level=1)
+    return base64.b64encode(buffer.getvalue()).decode('ascii')
+
+
+def _read_entry(path):
+    """Load a journal file, raising ValueError unless it has the shape submit() writes"""
+    with open(path, encoding='utf-8') as f:
+        entry = json.load(f)
+    if not (isinstance(entry, dict) and isinstance(entry.get('job_id'), str)
+            and isinstance(entry.get('patient_data'), dict)):
+        raise ValueError(f"malformed journal entry {os.path.basename(path)}")
+    return entry
+
+
+def _avatar_from_journal(data):
+    return Image.open(BytesIO(base64.b64decode(data))) if data else None
+
+
+class SaveQueue(JobQueue):
+    """Durable queue of pending patient inserts with per-job status for the UI
+
+    A job moves through queued -> saving -> saved -> done (label rendered);
+    while the database is unreachable it returns to queued with the error
+    shown, and a job the database rejects ends as failed.
+    """
+
+    active_status = 'saving'
+    hidden_fields = ('path', 'next_attempt')
+
+    def __init__(self, journal_dir, connect, retry_delay=1.0, history=200):
+        super().__init__(history)
+        self.journal_dir = journal_dir
+        self.failed_dir = os.path.join(journal_dir, 'failed')
+        self.connect = connect
+        self.retry_delay = retry_delay
+        self._sequence = itertools.count(1)
+        self._labels = ThreadPoolExecutor(1, thread_name_prefix="save-labels")
+
+        os.makedirs(self.failed_dir, exist_ok=True)
+        for path in sorted(glob.glob(os.path.join(journal_dir, '*.json'))):
+            try:
+                entry = _read_entry(path)
+            except (OSError, ValueError):
+                # A file that cannot be read or is malformed must not stop the queue from starting
+                self._move_to_failed(path)
+                continue
+            with self._lock:
+                self._add_job(entry['job_id'], entry['patient_data'], path, replayed=True)
+
+        self._worker = threading.Thread(target=self._run, name="save-queue", daemon=True)
+        self._worker.start()
+
+    def submit(self, patient_data, avatar_img=None):
+        """Journal one registration and queue it; returns the job id once it is on disk"""
+        job_id = f"{time.time_ns()}-{os.getpid()}-{next(self._sequence)}"
+        entry = {
+            'job_id': job_id,
+            'patient_data': dict(patient_data),
+            'avatar': _avatar_to_journal(avatar_img) if avatar_img is not None else None,
+        }
+        path = os.path.join(self.journal_dir, f"{job_id}.json")
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(entry, f, default=str)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+        # The rename is only durable once the directory entry is on disk too
+        _fsync_dir(self.journal_dir)
+
+        with self._lock:
+            self._add_job(job_id, entry['patient_data'], path)
+        return job_id
+
+    def _add_job(self, job_id, patient_data, path, replayed=False):
+        return super()._add_job(
+            job_id, phn=patient_data.get('phn', ''), name=patient_data.get('full_name', ''),
+            replayed=replayed, path=path
+        )
+
+    def pending(self):
+        """Number of registrations not yet committed to the database"""
+        with self._lock:
+            return sum(job['status'] in ('queued', 'saving') for job in self._jobs.values())
+
+    def _write(self, entry, replayed):
+        """Insert one journaled registration in a single transaction"""
+        patient_data = entry['patient_data']
+        conn = self.connect()
+        try:
+            cursor = conn.cursor()
+            try:
+                write_patient(cursor, patient_data, _avatar_from_journal(entry.get('avatar')))
+            except mysql.connector.IntegrityError:
+                if not replayed:
+                    raise
+                # A replayed job may have committed just before the crash that left its file behind
+                conn.rollback()
+                cursor.execute("SELECT id FROM patients WHERE phn = %s", (patient_data['phn'],))
+                if cursor.fetchone():
+                    return
+                raise
+            conn.commit()
+        finally:
+            conn.close()
+        get_patient_cache().invalidate(patient_data)
+
+    def _move_to_failed(self, path):
+        """Keep a journal file for follow-up; it is left in place if even that fails"""
+        try:
+            if os.path.exists(path):
+                os.replace(path, os.path.join(self.failed_dir, os.path.basename(path)))
+                _fsync_dir(self.failed_dir)
+                _fsync_dir(self.journal_dir)
+        except OSError:
+            pass
+
+    def _fail(self, job, err):
+        self._move_to_failed(job['path'])
+        with self._lock:
+            job['status'] = 'failed'
+            job['error'] = getattr(err, 'msg', None) or str(err) or type(err).__name__
+
+    def _run(self):
+        while True:
+            job = self._next_job()
+            try:
+                self._process(job)
+            except Exception as err:
+                # Anything unexpected fails this job only; the worker carries on with the next
+                self._fail(job, err)
+
+    def _process(self, job):
+        try:
+            entry = _read_entry(job['path'])
+            self._write(entry, job['replayed'])
+        except REJECTED_ERRORS as err:
+            self._fail(job, err)
+            return
+        except (mysql.connector.Error, PoolTimeout) as err:
+            with self._lock:
+                job['status'] = 'queued'
+                job['error'] = str(err)
+                delay = self.retry_delay * 2 ** min(job['attempts'] - 1, 10)
+                job['next_attempt'] = time.monotonic() + min(delay, MAX_RETRY_DELAY)
+            return
+
+        try:
+            os.remove(job['path'])
+            _fsync_dir(self.journal_dir)
+            error = None
+        except OSError as err:
+            # Committed already; a file left behind is recognized as saved when replayed
+            error = f"journal cleanup: {err}"
+        with self._lock:
+            job['status'] = 'saved'
+            job['error'] = error
+        self._labels.submit(self._render_label, job, entry['patient_data'])
+
+    def _render_label(self, job, patient_data):
+        """Warm the barcode and label caches so Print after Save is instant"""
+        try:
+            generate_barcode(patient_data)
+            get_label_png(patient_data)
+        finally:
+            with self._lock:
+                job['status'] = 'done'
@@ -0,0 +1,185 @@
+"""Core patient operations shared by the Streamlit UI, the HTTP API and workers
+
+Nothing here knows about Streamlit or HTTP: functions take plain dicts and a
+connection factory, and report problems by raising ServiceError subclasses
+(or mysql.connector / PoolTimeout errors when the database is unavailable).
+"""
+import mysql.connector
+
+from avatars import save_avatar
+from batch_labels import PHN_LOOKUP_CHUNK, iter_html, iter_label_pages, iter_pdf
+from change_feed import record_patient_events
+from duplicates import index_patient
+from label_templates import TEMPLATES
+from labels import get_label_png
+from patient_cache import CACHED_LOOKUPS
+from patient_search import SEARCH_COLUMNS, SEARCH_PAGE_SIZE, search_patients
+from phn import check_phn, normalize_phn
+from patients import INSERT_PATIENT_SQL, missing_required_fields, normalize_patient, patient_values, save_contact_numbers
+
+SEARCH_TYPES = ("PHN", "NIC", "Name", "Contact")
+
+
+class ServiceError(Exception):
+    """Base class for errors caused by the request rather than the server"""
+
+
+class ValidationError(ServiceError):
+    pass
+
+
+class NotFoundError(ServiceError):
+    pass
+
+
+class ConflictError(ServiceError):
+    """The PHN or NIC is already registered"""
+
+
+def check_template(template):
+    if not isinstance(template, str) or template not in TEMPLATES:
+        raise ValidationError(f"'template' must be one of {', '.join(TEMPLATES)}")
+
+
+def write_patient(cursor, patient_data, avatar_img=None):
+    """Insert a patient with its contact numbers, blocking keys, avatar and change-feed event; returns the new id
+
+    Runs inside the caller's transaction; the caller commits.
+    """
+    cursor.execute(INSERT_PATIENT_SQL, patient_values(patient_data))
+    patient_id = cursor.lastrowid
+    index_patient(cursor, patient_id, patient_data)
+    save_contact_numbers(cursor, patient_id, patient_data.get('contact_numbers'))
+    record_patient_events(cursor, [(patient_id, patient_data)])
+    if avatar_img is not None:
+        save_avatar(cursor, patient_id, avatar_img)
+    return patient_id
+
+
+class PatientService:
+    """Registration, lookup and labels on top of a connection factory
+
+    `connect` returns a connection whose close() gives it back (a pooled
+    connection); `allocator` issues PHNs; `cache` is a PatientLookupCache.
+    """
+
+    def __init__(self, connect, allocator, cache):
+        self.connect = connect
+        self.allocator = allocator
+        self.cache = cache
+
+    def generate_phn(self):
+        return self.allocator.next_phn()
+
+    def register(self, record, avatar_img=None):
+        """Validate and insert a new patient; issues a PHN when none is given. Returns {'id', 'phn'}"""
+        try:
+            patient = normalize_patient(record)
+        except ValueError as err:
+            raise ValidationError(str(err)) from err
+        if not patient['phn']:
+            patient['phn'] = self.generate_phn()
+        missing = missing_required_fields(patient)
+        if missing:
+            raise ValidationError(f"missing required fields: {', '.join(missing)}")
+
+        conn = self.connect()
+        try:
+            cursor = conn.cursor()
+            try:
+                patient_id = write_patient(cursor, patient, avatar_img)
+                conn.commit()
+            except mysql.connector.IntegrityError as err:
+                conn.rollback()
+                raise ConflictError(err.msg) from err
+            except mysql.connector.DataError as err:
+                conn.rollback()
+                raise ValidationError(err.msg) from err
+        finally:
+            conn.close()
+        self.cache.invalidate(patient)
+        return {'id': patient_id, 'phn': patient['phn']}
+
+    def search(self, search_by, term, after=None, page_size=SEARCH_PAGE_SIZE):
+        """One page of matches, as (rows, next_cursor); exact PHN/NIC lookups go through the cache"""
+        if search_by not in SEARCH_TYPES:
+            raise ValidationError(f"search_by must be one of {', '.join(SEARCH_TYPES)}")
+        term = (term or '').strip()
+        if not term:
+            raise ValidationError("empty search term")
+        if search_by == 'PHN':
+            try:
+                check_phn(normalize_phn(term))
+            except ValueError as err:
+                raise ValidationError(str(err)) from err
+
+        conn = self.connect()
+        try:
+            if search_by in CACHED_LOOKUPS:
+                return self.cache.lookup(conn, search_by, term), None
+            return search_patients(conn, search_by, term, after=after, page_size=page_size)
+        finally:
+            conn.close()
+
+    def lookup_many(self, phns):
+        """Rows for many PHNs with one query per chunk of cache misses; returns ({phn: row}, missing)
+
+        PHNs are matched in normalized form (see normalize_phn), on the way in
+        and on the rows read back, so keys always agree with the request.
+        """
+        phns = [normalize_phn(phn) for phn in phns]
+        found = {}
+        for phn in phns:
+            row = self.cache.get('phn', phn)
+            if row is not None:
+                found[phn] = row
+
+        misses = [phn for phn in dict.fromkeys(phns) if phn not in found]
+        if misses:
+            conn = self.connect()
+            try:
+                cursor = conn.cursor(dictionary=True)
+                for start in range(0, len(misses), PHN_LOOKUP_CHUNK):
+                    chunk = misses[start:start + PHN_LOOKUP_CHUNK]
+                    cursor.execute(
+                        f"SELECT {', '.join(SEARCH_COLUMNS)} FROM patients "
+                        f"WHERE phn IN ({', '.join(['%s'] * len(chunk))})", chunk
+                    )
+                    for row in cursor.fetchall():
+                        phn = normalize_phn(row['phn'])
+                        found[phn] = row
+                        self.cache.put('phn', phn, row)
+                cursor.close()
+            finally:
+                conn.close()
+
+        return found, [phn for phn in phns if phn not in found]
+
+    def get_patient(self, phn):
+        phn = normalize_phn(phn)
+        found, _ = self.lookup_many([phn])
+        if phn not in found:
+            raise NotFoundError(f"no patient with PHN {phn}")
+        return found[phn]
+
+    def label_png(self, phn, template='patient'):
+        """Label PNG for one patient (from the label cache when possible)"""
+        check_template(template)
+        png_bytes, _ = get_label_png(self.get_patient(phn), template=template)
+        return png_bytes
+
+    def iter_labels(self, phns, fmt='pdf', with_timestamp=None, template='patient'):
+        """Chunks of a multi-label print document, produced while the labels render
+
+        Unknown PHNs raise NotFoundError before anything is produced.
+        """
+        check_template(template)
+        found, missing = self.lookup_many(phns)
+        if missing:
+            raise NotFoundError(f"unknown PHN(s): {', '.join(missing)}")
+        pages = iter_label_pages([found[phn] for phn in phns], with_timestamp=with_timestamp, template=template)
+        if fmt == 'pdf':
+            return iter_pdf(pages)
+        if fmt == 'html':
+            return (chunk.encode('utf-8') for chunk in iter_html(pages, size_mm=TEMPLATES[template]['size_mm']))
+        raise ValidationError("format must be 'pdf' or 'html'")
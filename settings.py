@@ -0,0 +1,121 @@
+"""Deployment settings shared by the Streamlit app and command-line tools"""
+import os
+
+# Database configuration
+DB_NAME = 'digital_health_db'
+
+DB_CONFIG = {
+    'host': 'localhost',
+    'user': 'root',
+    'password': '',
+    'database': DB_NAME
+}
+
+# Connection pool configuration (shared by every browser session in this process)
+DB_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', '5'))
+DB_POOL_TIMEOUT = float(os.environ.get('DB_POOL_TIMEOUT', '10'))
+
+# Apply migrations with `python migrations.py` during deployment; on startup
+# the app only verifies the schema version and refuses to run against an old
+# one. DB_AUTO_MIGRATE=1 lets the app migrate itself (single-node setups only).
+DB_AUTO_MIGRATE = os.environ.get('DB_AUTO_MIGRATE', '0') == '1'
+
+# Label rendering cache (per server process)
+LABEL_CACHE_MAX_MB = int(os.environ.get('LABEL_CACHE_MAX_MB', '64'))
+LABEL_CACHE_TTL = int(os.environ.get('LABEL_CACHE_TTL', '28800'))  # seconds (one clinic day)
+
+# Where the print timestamp goes: 'print' overlays it on the printed page so the
+# label PNG itself can be cached, 'image' burns it into the PNG (never cached),
+# 'none' leaves it off.
+LABEL_TIMESTAMP = os.environ.get('LABEL_TIMESTAMP', 'print')
+
+# Label render profile, '<dpi>-<rgb|gray|mono>': labels are drawn directly at
+# this resolution and colour mode. '600-rgb' is the original output; match a
+# thermal printer with e.g. '203-mono' or '300-mono' (1-bit, bilevel PNG).
+LABEL_PROFILE = os.environ.get('LABEL_PROFILE', '600-rgb')
+
+# Extra directories searched for label fonts (os.pathsep separated), checked
+# before the repo's fonts/ directory and the usual system font locations
+LABEL_FONT_DIRS = [path for path in os.environ.get('LABEL_FONT_DIRS', '').split(os.pathsep) if path]
+
+# Direct thermal label printer (raw TCP, usually port 9100); leave PRINTER_HOST
+# empty to print only through the browser
+PRINTER_HOST = os.environ.get('PRINTER_HOST', '')
+PRINTER_PORT = int(os.environ.get('PRINTER_PORT', '9100'))
+PRINTER_LANGUAGE = os.environ.get('PRINTER_LANGUAGE', 'zpl')  # 'zpl' or 'epl'
+PRINTER_DPI = int(os.environ.get('PRINTER_DPI', '203'))
+
+# PHN allocation: serials are reserved from the database in blocks per process
+PHN_HOSPITAL_ID = os.environ.get('PHN_HOSPITAL_ID', '1250')
+PHN_BLOCK_SIZE = int(os.environ.get('PHN_BLOCK_SIZE', '50'))
+
+# Write-ahead journal for background saves; registrations wait here until
+# they are committed, so keep it on durable local disk
+SAVE_JOURNAL_DIR = os.environ.get('SAVE_JOURNAL_DIR', 'save_journal')
+
+# Memory allowed per browser session for the avatar being edited (compressed
+# original plus decoded working image); beyond it decoded pixels are evicted
+AVATAR_SESSION_BUDGET_MB = int(os.environ.get('AVATAR_SESSION_BUDGET_MB', '16'))
+
+# Read-through cache for exact PHN/NIC lookups in the Reprint tab; in-process
+# unless PATIENT_CACHE_REDIS_URL points at a Redis shared by all app processes
+PATIENT_CACHE_MAX_MB = int(os.environ.get('PATIENT_CACHE_MAX_MB', '8'))
+PATIENT_CACHE_TTL = int(os.environ.get('PATIENT_CACHE_TTL', '3600'))  # seconds
+PATIENT_CACHE_REDIS_URL = os.environ.get('PATIENT_CACHE_REDIS_URL', '')
+
+# Headless JSON API (python api.py); set API_TOKEN to require a bearer token
+API_HOST = os.environ.get('API_HOST', '127.0.0.1')
+API_PORT = int(os.environ.get('API_PORT', '8600'))
+API_TOKEN = os.environ.get('API_TOKEN', '')
+# Concurrent single-PHN lookups arriving within this window share one query
+API_BATCH_WINDOW_MS = float(os.environ.get('API_BATCH_WINDOW_MS', '2'))
+API_BATCH_MAX = int(os.environ.get('API_BATCH_MAX', '200'))
+
+# Label worker pool (python label_worker.py) shared by all app replicas; when
+# set, labels are rendered there instead of in the web process. Several
+# comma-separated URLs are used round-robin.
+LABEL_WORKER_URLS = [url.rstrip('/') for url in os.environ.get('LABEL_WORKER_URL', '').split(',') if url]
+LABEL_WORKER_TIMEOUT = float(os.environ.get('LABEL_WORKER_TIMEOUT', '10'))
+LABEL_WORKER_CONCURRENCY = int(os.environ.get('LABEL_WORKER_CONCURRENCY', '16'))  # in-flight batch pages
+LABEL_WORKER_PORT = int(os.environ.get('LABEL_WORKER_PORT', '8700'))
+
+# Label images for the browser: LABEL_MEDIA_URL is the JSON API's absolute
+# http(s) address as browsers reach it (e.g. https://registration.hospital.lk/api).
+# When set, the UI shows and prints labels from the API's content-addressed
+# /media URLs instead of inlining base64 into every page.
+# LABEL_MEDIA_SECRET makes those URLs unguessable from the PHN alone and is
+# required: while it is unset the API refuses /media and the UI inlines labels.
+LABEL_MEDIA_URL = os.environ.get('LABEL_MEDIA_URL', '').rstrip('/')
+LABEL_MEDIA_SECRET = os.environ.get('LABEL_MEDIA_SECRET', '')
+LABEL_MEDIA_CACHE_CONTROL = os.environ.get('LABEL_MEDIA_CACHE_CONTROL', 'public, max-age=31536000, immutable')
+
+# In-progress registrations are kept in the database (patient_drafts) so any
+# replica can resume them; drafts untouched this long are purged
+DRAFT_TTL_HOURS = int(os.environ.get('DRAFT_TTL_HOURS', '24'))
+
+# Instrumentation: operations slower than SLOW_OP_MS are logged; METRICS_PORT
+# serves Prometheus /metrics from the Streamlit process (0 = off; the API and
+# label worker serve /metrics on their own port). Set TRACE_FILE and/or
+# TRACE_OTLP_URL (an OpenTelemetry collector's OTLP/HTTP address) to export spans.
+SLOW_OP_MS = float(os.environ.get('SLOW_OP_MS', '500'))
+METRICS_PORT = int(os.environ.get('METRICS_PORT', '0'))
+TRACE_FILE = os.environ.get('TRACE_FILE', '')
+TRACE_OTLP_URL = os.environ.get('TRACE_OTLP_URL', '')
+TRACE_SERVICE_NAME = os.environ.get('TRACE_SERVICE_NAME', 'patient-registration')
+
+# Change feed (python change_feed.py): every registration is also written to
+# the patient_events outbox in the same transaction; downstream consumers
+# (lab, pharmacy, billing) read it in event_id order from a saved cursor.
+# An event id newer than a missing one is held back CHANGE_FEED_GAP_WAIT
+# seconds, in case the transaction that took the missing id has yet to commit;
+# after that the missing id is still looked for on every read (and delivered
+# late if it commits) until it is CHANGE_FEED_GAP_EXPIRE seconds old. Keep the
+# expiry above the longest transaction a save can run.
+CHANGE_FEED_BATCH = int(os.environ.get('CHANGE_FEED_BATCH', '500'))
+CHANGE_FEED_PREFETCH = int(os.environ.get('CHANGE_FEED_PREFETCH', '4'))  # batches read ahead of the sink
+CHANGE_FEED_POLL_INTERVAL = float(os.environ.get('CHANGE_FEED_POLL_INTERVAL', '1'))
+CHANGE_FEED_GAP_WAIT = float(os.environ.get('CHANGE_FEED_GAP_WAIT', '5'))
+CHANGE_FEED_GAP_EXPIRE = float(os.environ.get('CHANGE_FEED_GAP_EXPIRE', '3600'))
+CHANGE_FEED_RETENTION_DAYS = int(os.environ.get('CHANGE_FEED_RETENTION_DAYS', '30'))
+CHANGE_FEED_PHN_SYSTEM = os.environ.get('CHANGE_FEED_PHN_SYSTEM', 'urn:patient-registration:phn')
+CHANGE_FEED_NIC_SYSTEM = os.environ.get('CHANGE_FEED_NIC_SYSTEM', 'urn:patient-registration:nic')
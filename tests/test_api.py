@@ -0,0 +1,120 @@
+"""Batched PHN lookups: keys agree however the PHN was typed or stored"""
+import asyncio
+import json
+
+import pytest
+
+import api
+import label_media
+import labels
+from api import LookupBatcher, TokenAuth
+from cache import LRUCache
+from patient_cache import PatientLookupCache
+from services import NotFoundError, PatientService, ValidationError
+
+
+class StoredPhnCursor:
+    """Returns a row for every requested PHN, with the PHN as a legacy row stored it"""
+
+    def execute(self, sql, params):
+        self.params = params
+
+    def fetchall(self):
+        return [{'phn': phn.lower() + ' ', 'full_name': phn} for phn in self.params]
+
+    def close(self):
+        pass
+
+
+class StoredPhnConnection:
+    def cursor(self, dictionary=False):
+        return StoredPhnCursor()
+
+    def close(self):
+        pass
+
+
+def make_service():
+    return PatientService(StoredPhnConnection, None, PatientLookupCache(LRUCache(1 << 20)))
+
+
+def test_lookup_many_keys_rows_by_normalized_phn():
+    found, missing = make_service().lookup_many(['phn-1250-000000001-7', ' PHN-1250-000000002-5'])
+    assert sorted(found) == ['PHN-1250-000000001-7', 'PHN-1250-000000002-5']
+    assert missing == []
+
+
+def test_batcher_resolves_every_spelling_in_one_batch():
+    async def lookups():
+        batcher = LookupBatcher(make_service(), window=0.01)
+        rows = await asyncio.gather(*(batcher.get(phn) for phn in ('phn-1', 'PHN-1 ', 'PHN-2')))
+        return rows, batcher
+
+    rows, batcher = asyncio.run(lookups())
+    assert [row['full_name'] for row in rows] == ['PHN-1', 'PHN-1', 'PHN-2']
+    assert batcher.stats()['batches'] == 1
+    assert not batcher._tasks
+
+
+def test_media_needs_the_secret(monkeypatch):
+    monkeypatch.setattr(api, 'LABEL_MEDIA_SECRET', '')
+    monkeypatch.setattr(label_media, 'LABEL_MEDIA_SECRET', '')
+    monkeypatch.setattr(label_media, 'LABEL_MEDIA_URL', 'https://registration.example/api')
+    assert not TokenAuth.exempt('/media/barcode/PHN-1/abc.png')
+    assert label_media.media_url('barcode', {'phn': 'PHN-1'}) is None
+    with pytest.raises(NotFoundError):
+        asyncio.run(api.media(None))
+
+    monkeypatch.setattr(api, 'LABEL_MEDIA_SECRET', 's3cret')
+    monkeypatch.setattr(label_media, 'LABEL_MEDIA_SECRET', 's3cret')
+    assert TokenAuth.exempt('/media/barcode/PHN-1/abc.png')
+    assert label_media.media_url('barcode', {'phn': 'PHN-1'}).startswith('https://registration.example/api/media/')
+    assert '/media/barcode/OLD%2F12%20A%3F/' in label_media.media_url('barcode', {'phn': 'OLD/12 A?'})
+
+
+@pytest.mark.parametrize("kind", label_media.MEDIA_KINDS)
+def test_media_digest_changes_with_render_profile(monkeypatch, kind):
+    patient = {'phn': 'PHN-1250-000000001-7', 'full_name': "Kumari Wijesinghe"}
+    digests = {label_media.media_digest(kind, patient)}
+    monkeypatch.setattr(labels, 'LABEL_DPI', labels.LABEL_DPI * 2)
+    digests.add(label_media.media_digest(kind, patient))
+    monkeypatch.setattr(labels, 'LABEL_MODE', '1' if labels.LABEL_MODE != '1' else 'L')
+    digests.add(label_media.media_digest(kind, patient))
+    assert len(digests) == 3
+
+
+class FakeRequest:
+    """Just enough of a Starlette request for calling a handler directly"""
+
+    def __init__(self, body=None, **state):
+        self.app = type('App', (), {'state': type('State', (), state)()})()
+        self._body = body
+
+    async def body(self):
+        return b'' if self._body is None else json.dumps(self._body).encode()
+
+    async def json(self):
+        return self._body
+
+
+@pytest.mark.parametrize("count", [True, 0, 101, "2", 1.5])
+def test_issue_phns_rejects_bad_counts(count):
+    with pytest.raises(ValidationError, match="'count'"):
+        asyncio.run(api.issue_phns(FakeRequest({'count': count}, service=make_service())))
+
+
+@pytest.mark.parametrize("template", [['patient'], {'name': 'patient'}, 7])
+def test_label_batch_rejects_non_string_templates(template):
+    request = FakeRequest({'phns': ['PHN-1'], 'template': template}, service=make_service())
+    with pytest.raises(ValidationError, match="'template'"):
+        asyncio.run(api.label_batch(request))
+
+
+def test_health_reports_unhealthy_without_a_service():
+    response = asyncio.run(api.health(FakeRequest(pool=None)))
+    assert response.status_code == 503
+    assert json.loads(response.body)['status'] == 'unhealthy'
+
+    response = asyncio.run(api.health(FakeRequest(service=make_service(), pool=None)))
+    assert response.status_code == 200
+    assert json.loads(response.body)['pool'] is None
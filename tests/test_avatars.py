@@ -0,0 +1,72 @@
+"""Avatar ingest: bounded decode, EXIF orientation, size caps and the session budget"""
+from io import BytesIO
+
+from PIL import Image
+
+from avatars import (
+    AVATAR_MAX_BYTES, AVATAR_MAX_SIDE, THUMBNAIL_SIDE, AvatarDraft, decode_avatar, encode_avatar
+)
+
+
+def jpeg_bytes(size, orientation=None, color='red'):
+    img = Image.new('RGB', size, color)
+    exif = Image.Exif()
+    if orientation:
+        exif[0x0112] = orientation
+    buffer = BytesIO()
+    img.save(buffer, format='JPEG', exif=exif.tobytes())
+    return buffer.getvalue()
+
+
+def test_decode_bounds_large_uploads():
+    img = decode_avatar(jpeg_bytes((4000, 3000)), max_side=1280)
+    assert max(img.size) <= 1280 and img.mode == 'RGB'
+
+
+def test_decode_applies_exif_orientation():
+    # Orientation 6: stored landscape, shown rotated to portrait
+    img = decode_avatar(jpeg_bytes((1600, 1200), orientation=6), max_side=800)
+    assert img.width < img.height
+
+
+def test_decode_leaves_an_open_image_untouched():
+    source = Image.new('RGBA', (300, 200))
+    img = decode_avatar(source, max_side=640)
+    assert img is not source and img.mode == 'RGB'
+    assert source.mode == 'RGBA' and 'exif' not in source.info
+
+
+def test_encode_caps_avatar_and_thumbnail():
+    noise = Image.effect_noise((2000, 2000), 100).convert('RGB')
+    image_bytes, thumbnail_bytes = encode_avatar(noise)
+    assert len(image_bytes) <= AVATAR_MAX_BYTES
+    assert max(Image.open(BytesIO(image_bytes)).size) == AVATAR_MAX_SIDE
+    assert max(Image.open(BytesIO(thumbnail_bytes)).size) == THUMBNAIL_SIDE
+
+
+def test_draft_crop_is_kept_in_working_coordinates():
+    draft = AvatarDraft(jpeg_bytes((1000, 800)))
+    draft.crop((100, 100, 600, 500))
+    draft.crop((50, 50, 250, 250))
+    assert draft.crop_box == (150, 150, 350, 350)
+    assert draft.image.size == (200, 200)
+    before = draft.digest
+    draft.reset_crop()
+    assert draft.image.size == draft.working.size and draft.digest != before
+
+
+def test_draft_release_and_redecode():
+    draft = AvatarDraft(jpeg_bytes((1000, 800)))
+    size = draft.image.size
+    draft.release()
+    assert draft.memory_bytes() == len(draft.original)
+    assert draft.image.size == size
+
+
+def test_draft_over_budget_keeps_a_bounded_original():
+    data = jpeg_bytes((3000, 3000))
+    draft = AvatarDraft(data, budget_bytes=len(data))
+    draft.working  # decode, then force the budget check with a crop
+    draft.crop((0, 0, 500, 500))
+    assert len(draft.original) < len(data)
+    assert max(Image.open(BytesIO(draft.original)).size) <= max(draft.working.size)
@@ -0,0 +1,32 @@
+"""Batch label rows: PHNs typed in any case find the stored patient"""
+from batch_labels import fetch_label_rows
+
+
+class StoredRowsCursor:
+    def __init__(self, stored):
+        self.stored = stored
+
+    def execute(self, sql, params):
+        # Like the case-insensitive collation: any spelling matches the stored row
+        self.rows = [row for row in self.stored if row['phn'].strip().upper() in params]
+
+    def fetchall(self):
+        return self.rows
+
+    def close(self):
+        pass
+
+
+class StoredRowsConnection:
+    def __init__(self, stored):
+        self.stored = stored
+
+    def cursor(self, dictionary=False):
+        return StoredRowsCursor(self.stored)
+
+
+def test_fetch_label_rows_matches_normalized_phns():
+    conn = StoredRowsConnection([{'phn': 'phn-1250-000000001-7'}, {'phn': 'PHN-1250-000000002-5'}])
+    rows, missing = fetch_label_rows(conn, [' PHN-1250-000000002-5', 'PHN-1250-000000001-7', 'phn-1250-000000009-1'])
+    assert [row['phn'] for row in rows] == ['PHN-1250-000000002-5', 'phn-1250-000000001-7']
+    assert missing == ['PHN-1250-000000009-1']
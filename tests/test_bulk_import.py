@@ -0,0 +1,120 @@
+"""Bulk import: JSON arrays stream in chunks, and a failed multi-row insert falls back row by row"""
+import json
+import re
+
+import mysql.connector
+import pytest
+
+import bulk_import
+from bulk_import import iter_json, write_batch
+from patients import INSERT_PATIENT_SQL, PATIENT_FIELDS
+
+RECORDS = [
+    {'phn': 'PHN-1', 'full_name': "Nimal [Perera]", 'note': "a, b ] c"},
+    {'phn': 'PHN-2', 'full_name': "Kumari", 'contacts': ['077', '011'], 'nested': {'x': {'y': [1, 2]}}},
+    {'phn': 'PHN-3', 'full_name': "Sunil \"S\" Silva"},
+]
+
+
+@pytest.fixture
+def small_chunks(monkeypatch):
+    monkeypatch.setattr(bulk_import, 'JSON_CHUNK_SIZE', 7)
+
+
+def test_json_array_streams_across_chunk_boundaries(tmp_path, small_chunks):
+    path = tmp_path / 'export.json'
+    path.write_text("  [\n" + ",\n  ".join(json.dumps(record) for record in RECORDS) + "\n]\n")
+    assert list(iter_json(str(path))) == RECORDS
+
+
+def test_json_lines(tmp_path, small_chunks):
+    path = tmp_path / 'export.jsonl'
+    path.write_text("\n".join(json.dumps(record) for record in RECORDS) + "\n\n")
+    assert list(iter_json(str(path))) == RECORDS
+
+
+def test_truncated_json_array_raises(tmp_path, small_chunks):
+    path = tmp_path / 'export.json'
+    path.write_text("[" + json.dumps(RECORDS[0]) + ", " + json.dumps(RECORDS[1])[:-5])
+    records = iter_json(str(path))
+    assert next(records) == RECORDS[0]
+    with pytest.raises(json.JSONDecodeError):
+        next(records)
+
+
+class ListReport:
+    def __init__(self):
+        self.rows = []
+
+    def write(self, row):
+        self.rows.append(row)
+
+
+class ImportCursor:
+    """patients as a set of PHNs; the multi-row insert fails, single rows fail per `errors`"""
+
+    def __init__(self, conn):
+        self.conn = conn
+
+    def execute(self, sql, params):
+        if sql.startswith("SELECT phn, nic"):
+            self.rows = [(phn, None) for phn in params if phn in self.conn.existing]
+        elif sql.startswith("SELECT id, phn"):
+            self.rows = [(index, phn) for index, phn in enumerate(self.conn.inserted) if phn in params]
+        elif sql == INSERT_PATIENT_SQL:
+            phn = params[PATIENT_FIELDS.index('phn')]
+            if phn in self.conn.errors:
+                raise self.conn.errors[phn]
+            self.conn.inserted.append(phn)
+
+    def executemany(self, sql, rows):
+        if sql == INSERT_PATIENT_SQL:
+            raise mysql.connector.IntegrityError(msg="Duplicate entry")
+        self.conn.indexed.setdefault(re.search(r'INTO (\w+)', sql).group(1), []).extend(rows)
+
+    def fetchall(self):
+        return self.rows
+
+    def close(self):
+        pass
+
+
+class ImportConnection:
+    def __init__(self, existing=(), errors=None):
+        self.existing = set(existing)
+        self.errors = errors or {}
+        self.inserted = []
+        self.indexed = {}
+        self.rollbacks = 0
+
+    def cursor(self):
+        return ImportCursor(self)
+
+    def rollback(self):
+        self.rollbacks += 1
+
+
+def patient(phn):
+    return {field: '' for field in PATIENT_FIELDS} | {'phn': phn, 'full_name': phn, 'contact_numbers': '0771234567'}
+
+
+def test_failed_batch_insert_falls_back_row_by_row():
+    conn = ImportConnection(existing={'PHN-0'}, errors={
+        'PHN-2': mysql.connector.IntegrityError(msg="Duplicate entry '901234567V' for key 'nic'"),
+        'PHN-3': mysql.connector.DataError(msg="Data too long for column 'full_name'"),
+    })
+    batch = [(row_number, patient(phn)) for row_number, phn in enumerate(
+        ['PHN-0', 'PHN-1', 'PHN-2', 'PHN-3', 'PHN-4', 'PHN-1'], start=2
+    )]
+    duplicates, rejects = ListReport(), ListReport()
+
+    assert write_batch(conn, batch, duplicates, rejects) == (2, 3, 1)
+    assert conn.rollbacks == 1 and conn.inserted == ['PHN-1', 'PHN-4']
+    assert [(row[0], row[3]) for row in duplicates.rows] == [
+        (2, "PHN already exists"), (7, "PHN already exists"), (4, "Duplicate entry '901234567V' for key 'nic'"),
+    ]
+    assert [row[:2] for row in rejects.rows] == [[5, "Data too long for column 'full_name'"]]
+    # Only the rows that went in get their contacts, blocking keys and change-feed events
+    assert [row[0] for row in conn.indexed['patient_contacts']] == [0, 1]
+    assert [row[1] for row in conn.indexed['patient_blocking_keys']] == [0, 1]
+    assert [row[0] for row in conn.indexed['patient_events']] == [0, 1]
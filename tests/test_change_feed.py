@@ -0,0 +1,122 @@
+"""Change feed reads: events committed into an id gap are delivered late, not lost"""
+import json
+import re
+import time
+
+from change_feed import ChangeFeed, run_feed
+
+
+class Outbox:
+    """patient_events as {event_id: created}; only committed ids are visible"""
+
+    def __init__(self):
+        self.events = {}
+        self.cursors = {}
+
+    def commit(self, event_id, age=60.0):
+        self.events[event_id] = time.time() - age
+
+    def connect(self):
+        return OutboxConnection(self)
+
+
+class OutboxConnection:
+    def __init__(self, outbox):
+        self.outbox = outbox
+
+    def cursor(self):
+        return OutboxCursor(self.outbox)
+
+    def commit(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class OutboxCursor:
+    def __init__(self, outbox):
+        self.outbox = outbox
+        self.rows = []
+
+    def execute(self, sql, params):
+        if sql.startswith("INSERT INTO change_feed_cursors"):
+            self.outbox.cursors[params[0]] = params[1]
+            return
+        after, pending, limit = params[0], set(params[1:-1]), params[-1]
+        assert len(pending) == len(re.findall(r'%s', sql)) - 2
+        now = time.time()
+        self.rows = [
+            (event_id, 'created', created, '{"id": %d}' % event_id, now)
+            for event_id, created in sorted(self.outbox.events.items())
+            if event_id > after or event_id in pending
+        ][:limit]
+
+    def fetchall(self):
+        return self.rows
+
+    def close(self):
+        pass
+
+
+class ListSink:
+    def __init__(self):
+        self.lines = []
+
+    def write(self, data):
+        self.lines.extend(data.splitlines())
+
+    def close(self):
+        pass
+
+
+def test_young_gap_holds_back_newer_events():
+    outbox = Outbox()
+    for event_id in (1, 2):
+        outbox.commit(event_id)
+    outbox.commit(4, age=0)
+    assert [event[0] for event in ChangeFeed(outbox.connect, gap_wait=5).read(0)] == [1, 2]
+
+
+def test_event_committed_into_an_old_gap_is_delivered_late():
+    outbox = Outbox()
+    for event_id in (1, 2, 4, 5):
+        outbox.commit(event_id)
+    feed = ChangeFeed(outbox.connect, gap_wait=5)
+    gaps = {}
+
+    assert [event[0] for event in feed.read(0, gaps)] == [1, 2, 4, 5]
+    assert list(gaps) == [3]
+    assert feed.read(5, gaps) == []
+
+    outbox.commit(3)
+    outbox.commit(6)
+    assert [event[0] for event in feed.read(5, gaps)] == [3, 6]
+    assert gaps == {}
+
+
+def test_gap_is_given_up_after_gap_expire():
+    outbox = Outbox()
+    outbox.commit(1)
+    outbox.commit(3, age=120)
+    gaps = {}
+    assert [event[0] for event in ChangeFeed(outbox.connect, gap_wait=5, gap_expire=60).read(0, gaps)] == [1, 3]
+    assert gaps == {}
+
+
+def test_cursor_stays_below_an_unresolved_gap():
+    outbox = Outbox()
+    for event_id in (1, 2, 4, 5):
+        outbox.commit(event_id)
+    feed = ChangeFeed(outbox.connect, gap_wait=5)
+    sink = ListSink()
+
+    delivered, cursor = run_feed(feed, sink, 0, consumer='lab')
+    assert (delivered, cursor) == (4, 2)
+    assert outbox.cursors['lab'] == 2
+
+    # After a restart the gap is read again from the saved cursor
+    outbox.commit(3)
+    delivered, cursor = run_feed(feed, sink, outbox.cursors['lab'], consumer='lab')
+    assert (delivered, cursor) == (3, 5)
+    assert [json.loads(line)['event_id'] for line in sink.lines] == [1, 2, 4, 5, 3, 4, 5]
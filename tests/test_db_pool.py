@@ -0,0 +1,106 @@
+"""ConnectionPool against sqlite3 connections"""
+import sqlite3
+import threading
+
+import pytest
+
+from db_pool import ConnectionPool, PoolTimeout
+
+
+class Connector:
+    """Opens in-memory sqlite3 connections and counts them"""
+
+    def __init__(self):
+        self.opened = []
+
+    def __call__(self):
+        conn = sqlite3.connect(":memory:", check_same_thread=False)
+        self.opened.append(conn)
+        return conn
+
+
+def test_checkout_and_return_reuses_connection():
+    connect = Connector()
+    pool = ConnectionPool(connect, size=2, timeout=1.0)
+
+    conn = pool.get_connection()
+    assert pool.stats()['in_use'] == 1
+    conn.close()
+    stats = pool.stats()
+    assert (stats['in_use'], stats['idle'], stats['open']) == (0, 1, 1)
+
+    with pool.get_connection() as again:
+        again.cursor().execute("SELECT 1")
+    assert len(connect.opened) == 1
+    assert pool.stats()['checkouts'] == 2
+
+
+def test_closed_proxy_cannot_be_used():
+    pool = ConnectionPool(Connector(), size=1)
+    conn = pool.get_connection()
+    conn.close()
+    conn.close()  # a second close is a no-op
+    with pytest.raises(AttributeError):
+        conn.cursor()
+    assert pool.stats()['idle'] == 1
+
+
+def test_release_rolls_back_open_transaction():
+    pool = ConnectionPool(Connector(), size=1)
+    with pool.get_connection() as conn:
+        conn.execute("CREATE TABLE t (x INTEGER)")
+        conn.commit()
+        conn.execute("INSERT INTO t VALUES (1)")
+    with pool.get_connection() as conn:
+        assert conn.execute("SELECT COUNT(*) FROM t").fetchone()[0] == 0
+
+
+def test_timeout_when_exhausted():
+    pool = ConnectionPool(Connector(), size=1, timeout=0.05)
+    held = pool.get_connection()
+    with pytest.raises(PoolTimeout):
+        pool.get_connection()
+    assert pool.stats()['timeouts'] == 1
+    held.close()
+    pool.get_connection().close()
+
+
+def test_waiter_gets_connection_when_returned():
+    pool = ConnectionPool(Connector(), size=1, timeout=2.0)
+    held = pool.get_connection()
+    threading.Timer(0.05, held.close).start()
+    with pool.get_connection():
+        pass
+    stats = pool.stats()
+    assert stats['wait_time_max_ms'] >= 40
+    assert stats['open'] == 1
+
+
+def test_stale_connection_is_replaced():
+    connect = Connector()
+    healthy = {'ok': True}
+    pool = ConnectionPool(connect, size=1, check=lambda conn: healthy['ok'])
+    pool.get_connection().close()
+
+    healthy['ok'] = False
+    pool.get_connection().close()
+    stats = pool.stats()
+    assert stats['reconnects'] == 1
+    assert stats['open'] == 1
+    assert len(connect.opened) == 2
+
+
+def test_failed_open_frees_the_slot():
+    calls = {'n': 0}
+
+    def flaky():
+        calls['n'] += 1
+        if calls['n'] == 1:
+            raise sqlite3.OperationalError("server gone")
+        return sqlite3.connect(":memory:")
+
+    pool = ConnectionPool(flaky, size=1, timeout=0.05)
+    with pytest.raises(sqlite3.OperationalError):
+        pool.get_connection()
+    pool.get_connection().close()
+    assert pool.stats()['open'] == 1
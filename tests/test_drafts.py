@@ -0,0 +1,73 @@
+"""Shared drafts: form round-trip and which avatar columns a save touches"""
+import json
+from datetime import date
+from io import BytesIO
+
+from PIL import Image
+
+from avatars import AvatarDraft
+from drafts import DraftStore, decode_patient_data, encode_patient_data
+
+
+class RecordingConnection:
+    def __init__(self, row=None):
+        self.row = row
+        self.executed = []
+        self.commits = 0
+
+    def cursor(self):
+        return self
+
+    def execute(self, sql, params):
+        self.executed.append((' '.join(sql.split()), params))
+
+    def fetchone(self):
+        return self.row
+
+    def commit(self):
+        self.commits += 1
+
+    def close(self):
+        pass
+
+
+def make_store(conn):
+    store = DraftStore(lambda: conn)
+    store._maybe_purge = lambda: None
+    return store
+
+
+def test_patient_data_round_trips_with_the_birthday_as_a_date():
+    patient_data = {'full_name': "Nimal Perera", 'birthday': date(1990, 1, 2), 'nic': ''}
+    assert decode_patient_data(encode_patient_data(patient_data)) == patient_data
+
+
+def test_save_without_avatar_leaves_the_stored_avatar_alone():
+    conn = RecordingConnection()
+    make_store(conn).save('d1', {'full_name': "Nimal"})
+    sql, params = conn.executed[0]
+    assert 'avatar' not in sql and params == ['d1', '{"full_name": "Nimal"}'] and conn.commits == 1
+
+
+def test_save_false_clears_the_avatar_and_a_draft_stores_original_and_crop():
+    conn = RecordingConnection()
+    store = make_store(conn)
+    store.save('d1', {}, avatar=False)
+    assert conn.executed[0][1][2:] == [None, None, None]
+
+    buffer = BytesIO()
+    Image.new('RGB', (400, 300), 'blue').save(buffer, format='JPEG')
+    avatar = AvatarDraft(buffer.getvalue())
+    avatar.crop((10, 20, 110, 120))
+    store.save('d1', {}, avatar=avatar)
+    sql, params = conn.executed[1]
+    assert 'avatar = VALUES(avatar)' in sql
+    assert params[2:] == [avatar.original, avatar.digest, json.dumps([10, 20, 110, 120])]
+
+
+def test_load_decodes_the_row():
+    row = ('{"birthday": "1990-01-02"}', bytearray(b'jpeg'), 'abc:(1, 2, 3, 4)', '[1, 2, 3, 4]')
+    draft = make_store(RecordingConnection(row)).load('d1')
+    assert draft == {'patient_data': {'birthday': date(1990, 1, 2)}, 'avatar': b'jpeg',
+                     'avatar_digest': 'abc:(1, 2, 3, 4)', 'avatar_crop': (1, 2, 3, 4)}
+    assert make_store(RecordingConnection(None)).load('missing') is None
@@ -0,0 +1,43 @@
+"""Duplicate detection keys: phonetic codes, NIC forms and phone numbers block together"""
+import pytest
+
+from duplicates import blocking_keys, normalize_nic, score_pair, soundex
+
+
+@pytest.mark.parametrize("word, code", [
+    ('Perera', 'P660'), ('Robert', 'R163'), ('Rupert', 'R163'), ('Ashcraft', 'A261'), ('Tymczak', 'T522'),
+    ('Pfister', 'P236'), ('Lee', 'L000'), ("d'Silva", 'D241'), ('', ''), ('123', ''),
+])
+def test_soundex(word, code):
+    assert soundex(word) == code
+
+
+@pytest.mark.parametrize("nic, normalized", [
+    ('851234567V', '198512304567'), ('851234567x', '198512304567'), (' 85123-4567 v', '198512304567'),
+    ('198512304567', '198512304567'), ('85123456V', ''), ('1985123045678', ''), ('', ''), (None, ''),
+])
+def test_normalize_nic(nic, normalized):
+    assert normalize_nic(nic) == normalized
+
+
+def test_old_and_new_nic_and_phone_spellings_share_keys():
+    old = {'full_name': "Nimal Perera", 'nic': '851234567V', 'contact_numbers': '0771234567'}
+    new = {'full_name': "Nimal Perera", 'nic': '198512304567', 'contact_numbers': '+94 77 123 4567'}
+    assert blocking_keys(old) == blocking_keys(new) == ['c:771234567', 'nic:198512304567']
+
+
+def test_name_keys_need_a_birthday_or_district():
+    patient = {'full_name': "Nimal Perera", 'birthday': '1985-01-02', 'district': 'Kandy'}
+    assert blocking_keys(patient) == ['nb:N540|P660|1985-01-02', 'nd:N540|P660|KANDY', 'sb:P660|1985-01-02']
+    assert 'nd:B536|N540|P660|KANDY' in blocking_keys(dict(patient, other_names="Bandara"))
+    # A misspelt surname still lands in the same name + birthday block
+    assert 'sb:P660|1985-01-02' in blocking_keys(dict(patient, full_name="Nimal Pereira"))
+    assert blocking_keys({'full_name': "Nimal Perera"}) == []
+
+
+def test_same_person_scores_above_a_namesake():
+    patient = {'full_name': "Nimal Perera", 'nic': '851234567V', 'birthday': '1985-01-02'}
+    same, reasons = score_pair(patient, dict(patient, full_name="Nimal Pereira", nic='198512304567'))
+    namesake, _ = score_pair(patient, dict(patient, nic='901234567V', birthday='1990-05-06'))
+    assert same > 0.9 > namesake
+    assert "same NIC" in reasons and "same birthday" in reasons
@@ -0,0 +1,30 @@
+"""Label fonts: a missing face is an error, never a silent substitute"""
+import pytest
+
+import fonts
+
+
+@pytest.fixture
+def no_fonts(monkeypatch, tmp_path):
+    monkeypatch.setattr(fonts, 'font_search_dirs', lambda: [str(tmp_path)])
+    fonts.resolve_font_path.cache_clear()
+    fonts.get_font.cache_clear()
+    yield tmp_path
+    fonts.resolve_font_path.cache_clear()
+    fonts.get_font.cache_clear()
+
+
+def test_missing_font_raises(no_fonts):
+    with pytest.raises(fonts.FontNotFoundError, match="No bold font found"):
+        fonts.get_font('bold', 40)
+
+
+def test_unloadable_font_raises(no_fonts):
+    (no_fonts / 'arial.ttf').write_bytes(b'not a font')
+    with pytest.raises(fonts.FontNotFoundError, match="Cannot load regular font"):
+        fonts.get_font('regular', 40)
+
+
+def test_unknown_face_raises():
+    with pytest.raises(fonts.FontNotFoundError):
+        fonts.resolve_font_path('italic')
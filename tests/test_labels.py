@@ -0,0 +1,92 @@
+"""Label templates: every layout compiles and renders, and cache keys follow the render profile"""
+from io import BytesIO
+
+import pytest
+from PIL import Image
+
+import labels
+from label_templates import TEMPLATES
+
+PATIENT = {
+    'phn': 'PHN-1250-000000001-3', 'title': 'Mrs', 'full_name': "Kumari Wijesinghe", 'birthday': '1990-01-02',
+    'gender': 'Female', 'address_line1': "12 Temple Road", 'contact_numbers': '0771234567',
+}
+
+
+@pytest.mark.parametrize("profile, expected", [('203-mono', (203, '1')), ('300-gray', (300, 'L')),
+                                               ('600-rgb', (600, 'RGB'))])
+def test_parse_render_profile(profile, expected):
+    assert labels.parse_render_profile(profile) == expected
+
+
+@pytest.mark.parametrize("profile", ['', '203', '99-mono', 'abc-rgb', '203-cmyk', '-203-mono'])
+def test_parse_render_profile_rejects_bad_profiles(profile):
+    with pytest.raises(ValueError, match="LABEL_PROFILE"):
+        labels.parse_render_profile(profile)
+
+
+@pytest.mark.parametrize("name", TEMPLATES)
+def test_every_template_renders_at_the_profile_size_and_mode(name):
+    compiled = labels.get_template(name)
+    width_mm, height_mm = TEMPLATES[name]['size_mm']
+    img = labels.generate_label_image(PATIENT, with_timestamp=False, template=name)
+    assert img.size == (labels.cm_to_px(width_mm / 10), labels.cm_to_px(height_mm / 10)) == compiled.base.size
+    assert img.mode == labels.LABEL_MODE
+    assert set(compiled.fields) <= set(PATIENT)
+
+
+def test_unknown_template_is_rejected():
+    with pytest.raises(ValueError, match="unknown label template"):
+        labels.get_template('envelope')
+
+
+def test_optional_elements_are_skipped_without_an_advance():
+    compiled = labels.get_template('patient')
+    with_address = [element['text'] for element, _ in compiled.layout(PATIENT)]
+    without = dict(PATIENT, address_line1='')
+    assert "{address_line1}" in with_address
+    assert "{address_line1}" not in [element['text'] for element, _ in compiled.layout(without)]
+    # The lines after the address move up into its place
+    assert compiled.timestamp_top(without) < compiled.timestamp_top(PATIENT)
+
+
+def test_long_names_shrink_then_get_an_ellipsis():
+    compiled = labels.get_template('patient')
+    name_line = next(element for element in compiled.elements if 'full_name' in element['fields'])
+    text, font, width = compiled._fit(name_line, "Mrs " + "Wijesinghe " * 6)
+    assert font is not name_line['fonts'][0] and not text.endswith("...")
+
+    text, font, width = compiled._fit(name_line, "Mrs " + "Wijesinghe " * 40)
+    assert text.endswith("...") and font is name_line['fonts'][-1]
+    assert width <= name_line['fit_width']
+
+
+def test_cache_keys_change_with_the_render_profile_and_printed_fields(monkeypatch):
+    label_key = labels.label_cache_key(PATIENT)
+    barcode_key = labels.barcode_cache_key(PATIENT)
+    assert labels.label_cache_key(dict(PATIENT, nic='900011234V')) == label_key  # not printed on the label
+    assert labels.label_cache_key(dict(PATIENT, full_name="Kumari Perera")) != label_key
+    assert labels.label_cache_key(PATIENT, 'wristband') != label_key
+
+    monkeypatch.setattr(labels, 'LABEL_DPI', labels.LABEL_DPI // 2)
+    assert labels.label_cache_key(PATIENT) != label_key
+    assert labels.barcode_cache_key(PATIENT) != barcode_key
+
+
+def test_barcode_is_sized_in_the_barcode_mode():
+    img = labels.generate_barcode(PATIENT, 6.0, 1.3)
+    assert img.mode == labels.BARCODE_MODE
+    assert img.height == labels.cm_to_px(1.3)
+    assert img.width <= labels.cm_to_px(6.0)
+    assert labels.generate_barcode(PATIENT, 6.0, 1.3) is img  # served from the cache
+
+
+def test_unencodable_phn_raises_barcode_error():
+    with pytest.raises(labels.BarcodeError, match="PHN-é"):
+        labels.generate_barcode({'phn': 'PHN-é'})
+
+
+def test_png_keeps_the_profile_dpi():
+    png = labels.encode_png(labels.generate_barcode(PATIENT))
+    with Image.open(BytesIO(png)) as img:
+        assert round(img.info['dpi'][0]) == labels.LABEL_DPI
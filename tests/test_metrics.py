@@ -0,0 +1,81 @@
+"""Metrics: spans feed histograms, and everything renders as Prometheus text"""
+import re
+
+import pytest
+
+import metrics
+
+
+@pytest.fixture(autouse=True)
+def clean_metrics(monkeypatch):
+    monkeypatch.setattr(metrics, '_gauge_sources', {})
+    metrics.reset()
+    yield
+    metrics.reset()
+
+
+def sample(text, line_start):
+    return next(line.rsplit(' ', 1)[1] for line in text.splitlines() if line.startswith(line_start))
+
+
+def test_observations_fill_cumulative_buckets():
+    metrics.observe("db.select", 0.003)
+    metrics.observe("db.select", 0.3)
+
+    text = metrics.render_prometheus()
+    name = 'patient_registration_operation_duration_seconds'
+    assert sample(text, f'{name}_bucket{{operation="db.select",le="0.001"}}') == '0'
+    assert sample(text, f'{name}_bucket{{operation="db.select",le="0.005"}}') == '1'
+    assert sample(text, f'{name}_bucket{{operation="db.select",le="+Inf"}}') == '2'
+    assert sample(text, f'{name}_count{{operation="db.select"}}') == '2'
+    assert float(sample(text, f'{name}_sum{{operation="db.select"}}')) == pytest.approx(0.303)
+
+
+def test_failed_spans_are_still_timed():
+    with pytest.raises(KeyError), metrics.span("db.select"):
+        raise KeyError("patients")
+    assert sample(metrics.render_prometheus(), 'patient_registration_operation_duration_seconds_count') == '1'
+
+
+def test_timed_keeps_the_function_and_times_it():
+    @metrics.timed("label.encode_png")
+    def encode(value):
+        """Docstring"""
+        return value * 2
+
+    assert encode(21) == 42 and encode.__name__ == 'encode' and encode.__doc__ == "Docstring"
+    assert sample(metrics.render_prometheus(), 'patient_registration_operation_duration_seconds_count') == '1'
+
+
+def test_counters_and_gauges():
+    metrics.count('payload_bytes', 'print.html', 100)
+    metrics.count('payload_bytes', 'print.html', 50)
+    metrics.count('payload_bytes', 'print.pdf', 7)
+    metrics.register_gauges('pool', lambda: {'size': 5, 'in_use': 2.5, 'healthy': True, 'name': 'main'})
+    metrics.register_gauges('broken', lambda: 1 / 0)
+
+    text = metrics.render_prometheus()
+    assert 'patient_registration_payload_bytes_total{operation="print.html"} 150' in text.splitlines()
+    assert 'patient_registration_payload_bytes_total{operation="print.pdf"} 7' in text.splitlines()
+    assert sample(text, 'patient_registration_pool_size') == '5'
+    assert sample(text, 'patient_registration_pool_in_use') == '2.5'
+    # Booleans and strings aren't gauges, and a failing source is skipped
+    assert not re.search(r'pool_(healthy|name)|broken', text)
+
+
+def test_timed_cursor_names_spans_by_verb():
+    class Cursor:
+        rowcount = 3
+
+        def execute(self, statement, params=None):
+            return 'done'
+
+        def executemany(self, statement, rows):
+            return 'many'
+
+    cursor = metrics.TimedCursor(Cursor())
+    assert cursor.execute("  select 1") == 'done'
+    assert cursor.executemany("INSERT INTO patients VALUES (%s)", [(1,)]) == 'many'
+    assert cursor.rowcount == 3
+    text = metrics.render_prometheus()
+    assert 'operation="db.select"' in text and 'operation="db.insert"' in text
@@ -0,0 +1,76 @@
+"""Schema migrations: applied once, in order, under the named lock"""
+import pytest
+
+import migrations
+
+
+class SchemaCursor:
+    """A server whose schema_migrations table is `applied` (None until created)"""
+
+    def __init__(self, conn):
+        self.conn = conn
+
+    def execute(self, sql, params=()):
+        sql = ' '.join(sql.split())
+        self.conn.executed.append(sql)
+        if sql.startswith("SELECT GET_LOCK"):
+            self.row = (self.conn.lock,)
+        elif sql.startswith("SELECT COUNT(*) FROM information_schema.tables"):
+            self.row = (int(self.conn.applied is not None),)
+        elif sql.startswith("SELECT COALESCE(MAX(version), 0)"):
+            self.row = (max(self.conn.applied, default=0),)
+        elif sql.startswith("CREATE TABLE IF NOT EXISTS schema_migrations"):
+            self.conn.applied = self.conn.applied or []
+        elif sql.startswith("INSERT INTO schema_migrations"):
+            self.conn.applied.append(params[0])
+        else:
+            self.row = None
+
+    def fetchone(self):
+        return self.row
+
+
+class SchemaConnection:
+    def __init__(self, applied=None, lock=1):
+        self.applied = applied
+        self.lock = lock
+        self.executed = []
+        self.commits = 0
+
+    def cursor(self):
+        return SchemaCursor(self)
+
+    def commit(self):
+        self.commits += 1
+
+
+def test_versions_are_increasing_and_unique():
+    versions = [version for version, _, _ in migrations.MIGRATIONS]
+    assert versions == sorted(set(versions)) and versions[0] == 1
+    assert migrations.LATEST_VERSION == versions[-1]
+
+
+def test_get_schema_version():
+    assert migrations.get_schema_version(SchemaCursor(SchemaConnection())) == 0
+    assert migrations.get_schema_version(SchemaCursor(SchemaConnection(applied=[1, 2, 3]))) == 3
+
+
+def test_pending_migrations_are_applied_up_to_the_target():
+    conn = SchemaConnection()
+    assert migrations.migrate(conn, target=2, database='registry') == (0, 2)
+    assert conn.applied == [1, 2] and conn.commits == 2
+    assert any(sql.startswith("CREATE FULLTEXT INDEX ft_patients_names") for sql in conn.executed)
+    assert conn.executed[-1] == "SELECT RELEASE_LOCK(%s)"
+
+    # A second run finds nothing to do and leaves the schema alone
+    conn.executed.clear()
+    assert migrations.migrate(conn, target=2, database='registry') == (2, 2)
+    assert not any(sql.startswith(("CREATE", "ALTER", "INSERT")) for sql in conn.executed)
+    assert conn.executed[-1] == "SELECT RELEASE_LOCK(%s)"
+
+
+def test_lock_timeout_is_an_error():
+    conn = SchemaConnection(lock=0)
+    with pytest.raises(RuntimeError, match="another migration run"):
+        migrations.migrate(conn)
+    assert conn.applied is None
@@ -0,0 +1,32 @@
+"""Exact-lookup cache: a save invalidates the entry whatever case the search used"""
+import patient_cache
+from cache import LRUCache
+from patient_cache import PatientLookupCache
+
+
+def test_save_invalidates_lookups_typed_in_any_case(monkeypatch):
+    queries = []
+
+    def search_patients(conn, search_by, term, page_size):
+        queries.append(term)
+        return [{'phn': 'PHN-1250-000000001-7', 'nic': '198512345678', 'full_name': f"v{len(queries)}"}], None
+
+    monkeypatch.setattr(patient_cache, 'search_patients', search_patients)
+    cache = PatientLookupCache(LRUCache(1 << 20))
+
+    assert cache.lookup(None, 'PHN', 'phn-1250-000000001-7')[0]['full_name'] == 'v1'
+    assert cache.lookup(None, 'PHN', ' PHN-1250-000000001-7 ')[0]['full_name'] == 'v1'
+    assert len(queries) == 1
+
+    cache.invalidate({'phn': 'PHN-1250-000000001-7', 'nic': '198512345678'})
+    assert cache.lookup(None, 'PHN', 'phn-1250-000000001-7')[0]['full_name'] == 'v2'
+
+
+def test_nic_lookups_share_the_saved_key(monkeypatch):
+    monkeypatch.setattr(patient_cache, 'search_patients',
+                        lambda conn, search_by, term, page_size: ([{'nic': '851234567V'}], None))
+    cache = PatientLookupCache(LRUCache(1 << 20))
+    cache.lookup(None, 'NIC', '851234567v')
+    assert cache.get('nic', '851234567V') is not None
+    cache.invalidate({'nic': '851234567V'})
+    assert cache.get('nic', '851234567v') is None
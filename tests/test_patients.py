@@ -0,0 +1,32 @@
+"""Record normalization shared by the bulk importer and the API"""
+from datetime import date
+
+import pytest
+
+from patients import normalize_patient, split_contact_numbers
+
+
+def test_scalars_become_text():
+    patient = normalize_patient({'nic': 199012345678, 'contact_numbers': 771234567, 'phn': 'phn-1250-000000001-3',
+                                 'full_name': "  Nimal   Perera ", 'birthday': '02/01/1990'})
+    assert patient['nic'] == '199012345678'
+    assert patient['phn'] == 'PHN-1250-000000001-3'
+    assert patient['full_name'] == "Nimal Perera"
+    assert patient['birthday'] == date(1990, 1, 2)
+    assert split_contact_numbers(patient['contact_numbers']) == ['0771234567']  # the leading 0 a number loses
+    assert patient['title'] == ''
+
+
+@pytest.mark.parametrize("record, message", [
+    ([{'full_name': "Nimal"}], "expected a record"),
+    ("Nimal Perera", "expected a record"),
+    ({'nic': ['1990']}, "nic must be a single value"),
+    ({'full_name': "x" * 101}, "full_name is longer than 100"),
+    ({'title': "Professor Dr."}, "title is longer than 10"),
+    ({'known_allergies': "ස" * 30000}, "known_allergies is longer than 65535 bytes"),
+    ({'birthday': 19900101}, "unrecognised birthday"),
+    ({'phn': 'PHN-1250-000000001-4'}, "check digit mismatch"),
+])
+def test_bad_records_raise_value_error(record, message):
+    with pytest.raises(ValueError, match=message):
+        normalize_patient(record)
@@ -0,0 +1,73 @@
+"""PHN check digits and block allocation"""
+import threading
+
+import pytest
+
+from phn import PHNAllocator, check_phn, format_phn, is_valid_phn, luhn_check_digit
+
+
+@pytest.mark.parametrize("digits, check", [('7992739871', '3'), ('0', '0'), ('1250000000001', '3')])
+def test_luhn_check_digit(digits, check):
+    assert luhn_check_digit(digits) == check
+
+
+def test_check_digit_catches_single_digit_typos_and_swaps():
+    phn = format_phn(123456789)
+    assert is_valid_phn(phn)
+    serial = phn[9:18]
+    for i in range(len(serial)):
+        for digit in '0123456789':
+            if digit != serial[i]:
+                assert not is_valid_phn(phn[:9] + serial[:i] + digit + serial[i + 1:] + phn[18:])
+    swapped = phn[:9] + serial[1] + serial[0] + serial[2:] + phn[18:]
+    assert not is_valid_phn(swapped)
+
+
+@pytest.mark.parametrize("phn", ['', 'P00012', 'PHN-125-000000001-3', 'PHN-1250-00000001-3', 'phn-1250-000000001-3'])
+def test_malformed_phns_are_not_valid(phn):
+    assert not is_valid_phn(phn)
+
+
+def test_check_phn_only_rejects_typos_in_issued_phns():
+    check_phn(format_phn(1))
+    check_phn('P00012')  # legacy PHNs pass as they are
+    with pytest.raises(ValueError, match="check digit"):
+        check_phn('PHN-1250-000000001-4')
+
+
+def test_allocator_reserves_one_block_per_block_size():
+    reserved = []
+
+    def reserve(size):
+        reserved.append(size)
+        return 1000 * len(reserved)
+
+    allocator = PHNAllocator(reserve, block_size=3, hospital_id='1250')
+    phns = [allocator.next_phn() for _ in range(7)]
+    assert phns == [format_phn(serial, '1250') for serial in (1000, 1001, 1002, 2000, 2001, 2002, 3000)]
+    assert reserved == [3, 3, 3] and allocator.blocks_reserved == 3
+
+
+def test_allocator_is_unique_across_threads():
+    lock = threading.Lock()
+    sequence = {'next': 0}
+
+    def reserve(size):
+        with lock:
+            start = sequence['next']
+            sequence['next'] += size
+            return start
+
+    allocator = PHNAllocator(reserve, block_size=7)
+    phns = []
+
+    def take():
+        for _ in range(200):
+            phns.append(allocator.next_phn())
+
+    threads = [threading.Thread(target=take) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(set(phns)) == 800 and all(is_valid_phn(phn) for phn in phns)
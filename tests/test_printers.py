@@ -0,0 +1,79 @@
+"""ZPL labels sent to a fake port 9100 printer must fit the label"""
+import re
+import threading
+import time
+
+import pytest
+
+from code128 import QUIET_ZONE_MODULES, code128_modules, code128_svg
+from phn import format_phn
+from printers import FakePrinterServer, PrintQueue, RawSocketPrinter, label_to_zpl
+
+ZPL_START_SETS = {'9': 'A', ':': 'B', ';': 'C'}
+ZPL_SWITCH_SETS = {'5': 'C', '6': 'B', '7': 'A'}
+
+
+def zpl_symbol_count(field):
+    """Code128 symbols the printer draws for ^BC field data: start, data and switches (no checksum/stop)"""
+    count, code_set, i = 1, 'B', 0
+    while i < len(field):
+        if field[i] == '>':
+            code = field[i + 1]
+            if code in ZPL_START_SETS:
+                code_set = ZPL_START_SETS[code]
+            else:
+                code_set = ZPL_SWITCH_SETS.get(code, code_set)
+                count += 1  # a switch, or '><' for a literal '>'
+            i += 2
+        else:
+            i += 2 if code_set == 'C' else 1
+            count += 1
+    return count
+
+
+def barcode_extent(zpl):
+    """(print width, barcode left edge, module dots, field data, symbol modules) from a ZPL label"""
+    print_width = int(re.search(r'\^PW(\d+)', zpl).group(1))
+    match = re.search(r'\^FO(\d+),\d+\^BY(\d+)\^BCN,\d+,[YN],N,N,N\^FD([^^]*)\^FS', zpl)
+    assert match, "expected ^BC with explicit code sets (mode N)"
+    x, module_dots, field = int(match.group(1)), int(match.group(2)), match.group(3)
+    modules = (zpl_symbol_count(field) + 1) * 11 + 13  # + checksum, and the 13-module stop pattern
+    return print_width, x, module_dots, field, modules
+
+
+def send_through_fake_printer(payloads):
+    with FakePrinterServer() as server:
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        queue = PrintQueue(RawSocketPrinter('127.0.0.1', server.port), retry_delay=0.05)
+        job_ids = [queue.submit(payload) for payload in payloads]
+        deadline = time.monotonic() + 10
+        while any(queue.status(job_id)['status'] != 'done' for job_id in job_ids):
+            assert time.monotonic() < deadline, queue.jobs()
+            time.sleep(0.01)
+        while len(server.received) < len(payloads):
+            time.sleep(0.01)
+        server.shutdown()
+        return list(server.received)
+
+
+@pytest.mark.parametrize("dpi", [203, 300, 600])
+def test_zpl_barcode_fits_label(dpi):
+    phns = [format_phn(serial) for serial in (1, 123456789, 987654321)] + ["PHN-NOT-FOUND"]
+    patients = [{'title': 'Mr.', 'full_name': "Nimal Perera", 'address_line1': "12 Main Street",
+                 'contact_numbers': "0771234567", 'phn': phn} for phn in phns]
+    jobs = send_through_fake_printer([label_to_zpl(patient, dpi=dpi, timestamp="2026-01-01 09:00")
+                                      for patient in patients])
+
+    assert len(jobs) == len(patients)
+    for patient, job in zip(patients, jobs):
+        print_width, x, module_dots, field, modules = barcode_extent(job.decode('utf-8'))
+        clean_phn = patient['phn'].replace('-', '')
+        assert modules == len(code128_modules(clean_phn)), field
+        quiet = QUIET_ZONE_MODULES * module_dots
+        assert x - quiet >= 0
+        assert x + modules * module_dots + quiet <= print_width, (dpi, patient['phn'], field)
+
+
+def test_svg_escapes_human_readable_text():
+    svg = code128_svg('PHN-1', text='<b>&"PHN-1"')
+    assert '&lt;b&gt;&amp;"PHN-1"</text>' in svg
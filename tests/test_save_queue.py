@@ -0,0 +1,88 @@
+"""Journaled saves: rejected records end as failed and the writer keeps going"""
+import os
+import time
+
+import mysql.connector
+import pytest
+
+import save_queue
+
+
+class NullConnection:
+    def cursor(self):
+        return None
+
+    def commit(self):
+        pass
+
+    def rollback(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class NullCache:
+    def invalidate(self, patient_data):
+        pass
+
+
+@pytest.fixture
+def queue(tmp_path, monkeypatch):
+    outcomes = {}
+
+    def write_patient(cursor, patient_data, avatar):
+        if outcomes[patient_data['phn']]:
+            raise outcomes[patient_data['phn']]
+
+    monkeypatch.setattr(save_queue, 'write_patient', write_patient)
+    monkeypatch.setattr(save_queue, 'get_patient_cache', NullCache)
+    monkeypatch.setattr(save_queue.SaveQueue, '_render_label', lambda self, job, patient_data: None)
+    queue = save_queue.SaveQueue(str(tmp_path), NullConnection, retry_delay=0.01)
+    queue.outcomes = outcomes
+    return queue
+
+
+def wait_settled(queue, job_ids):
+    deadline = time.monotonic() + 10
+    while any(queue.status(job_id)['status'] in ('queued', 'saving') for job_id in job_ids):
+        assert time.monotonic() < deadline, queue.jobs()
+        time.sleep(0.01)
+    return [queue.status(job_id) for job_id in job_ids]
+
+
+def test_rejected_and_unexpected_errors_fail_without_stopping_the_writer(queue, tmp_path):
+    queue.outcomes.update({
+        'A': mysql.connector.DataError(msg="Data too long for column 'nic'"),
+        'B': mysql.connector.IntegrityError(msg="Duplicate entry for key 'nic'"),
+        'C': RuntimeError("unexpected"),
+        'D': None,
+    })
+    job_ids = [queue.submit({'phn': phn, 'full_name': phn}) for phn in 'ABCD']
+    jobs = wait_settled(queue, job_ids)
+
+    assert [job['status'] for job in jobs] == ['failed', 'failed', 'failed', 'saved']
+    assert jobs[0]['error'] == "Data too long for column 'nic'"
+    assert jobs[2]['error'] == "unexpected"
+    assert sorted(os.listdir(tmp_path / 'failed')) == sorted(f"{job_id}.json" for job_id in job_ids[:3])
+    assert os.listdir(tmp_path) == ['failed']
+
+
+def test_programming_error_is_retried(queue):
+    queue.outcomes['A'] = mysql.connector.ProgrammingError(msg="Table 'patients' doesn't exist")
+    job_id = queue.submit({'phn': 'A', 'full_name': 'A'})
+    deadline = time.monotonic() + 10
+    while queue.status(job_id)['attempts'] < 3:
+        assert time.monotonic() < deadline, queue.jobs()
+        time.sleep(0.01)
+    assert queue.status(job_id)['error'] == "Table 'patients' doesn't exist"
+
+    queue.outcomes['A'] = None
+    assert wait_settled(queue, [job_id])[0]['status'] == 'saved'
+
+
+@pytest.mark.parametrize("content", ['{not json', '[]', '{"job_id": "1"}', '{"job_id": 1, "patient_data": {}}'])
+def test_malformed_journal_file_is_set_aside_on_start(tmp_path, content):
+    (tmp_path / 'broken.json').write_text(content)
+    save_queue.SaveQueue(str(tmp_path), NullConnection)
+    assert os.listdir(tmp_path / 'failed') == ['broken.json']